@@ -1,16 +1,22 @@
+import os
+
 from flask import Flask, render_template, redirect, url_for, flash, request
 from flask_login import LoginManager, login_required
+from jinja2 import FileSystemBytecodeCache
 from werkzeug import exceptions
 
 from config import config
 from .database import SQLITE
+from .cache import Cache
 
 
 db = SQLITE()
 login_manager = LoginManager()
+cache = Cache(fill=db.primary)
 
 
 def init_data():
+    """Seed the tenants, payment methods, roles and admin user of an empty database."""
     from .models import User, PaymentMethod, Role, Tenants
 
     admin_exist = db.session.query(User).filter(User.email == "user1@test.com").first()
@@ -23,10 +29,14 @@ def init_data():
 
 def create_app(config_name):
 
+    from .utilities.imports import ImportRequest
+
     app = Flask(__name__)
+    app.request_class = ImportRequest
     app.config.from_object(config[config_name])
     config[config_name].init_app(app)
     db.init_app(app)
+    cache.init_app(app)
 
     login_manager.init_app(app)
     login_manager.login_view = "login"
@@ -36,10 +46,15 @@ def create_app(config_name):
     def unauthorized_handler():
         return redirect(url_for("auth.login"))
 
-    @app.before_first_request
-    def setup():
-        db.create_all()
-        init_data()
+    @app.after_request
+    def memo_headers(response):
+        from .utilities.decorators import memo_stats
+
+        stats = memo_stats()
+        if stats["hits"] or stats["misses"]:
+            response.headers["X-Memo-Hits"] = stats["hits"]
+            response.headers["X-Memo-Misses"] = stats["misses"]
+        return response
 
     # @app.after_request
     # def add_header(response):
@@ -89,6 +104,14 @@ def create_app(config_name):
     app.register_blueprint(costs_blueprint, url_prefix="/costs")
     app.register_blueprint(companies_blueprint, url_prefix="/companies")
 
+    from .commands import balances_cli, db_cli, facts_cli, periods_cli, templates_cli
+
+    app.cli.add_command(balances_cli)
+    app.cli.add_command(facts_cli)
+    app.cli.add_command(periods_cli)
+    app.cli.add_command(db_cli)
+    app.cli.add_command(templates_cli)
+
     # *****************************************************************************************************
 
     @app.errorhandler(exceptions.NotFound)
@@ -106,73 +129,13 @@ def create_app(config_name):
 
     # *****************************************************************************************************
 
-    @app.context_processor
-    def utility_processor():
-        import calendar
-        from calendar import Calendar, monthrange
-        from datetime import datetime, date, timedelta
-
-        def get_workings_days():
-            n = 0
-            num_days = monthrange(today().year, today().month)[1]
-            for i in range(num_days):
-                d = today() + timedelta(days=i)
-                if d.isoweekday() not in [6, 7]:
-                    n += 1
-            return n
-
-        def today():
-            return date.today()
-
-        def dayDelta(dt, delta):
-            return dt + timedelta(days=delta)
-
-        def strftime(value, format):
-            return value.strftime(format)
-
-        def toDate(year, month, day):
-            return datetime.strptime(f"{year}-{month}-{day}", "%Y-%m-%d").date()
-
-        def isocalendar():
-            return date.today().isocalendar()
-
-        def format_price(amount, currency="€"):
-            return "{0:.2f}{1}".format(amount, currency)
-
-        def get_months():
-            return list(calendar.month_name)
-
-        def get_monthdates(year, month):
-            obj = calendar.Calendar()
-            li = []
-
-            # iterating with itermonthdates
-            for day in obj.itermonthdates(year, month):
-                li.append(day)
-            return li
-
-        def get_monthdays_with_name(year, month):
-            l = []
-            for i in range(monthrange(year, month)[1]):
-                l.append(
-                    {
-                        "number": i + 1,
-                        "name": calendar.day_name[calendar.weekday(year, month, i + 1)],
-                    }
-                )
-            return l
-
-        return dict(
-            format_price=format_price,
-            get_months=get_months,
-            get_monthdates=get_monthdates,
-            get_monthdays_with_name=get_monthdays_with_name,
-            toDate=toDate,
-            today=today,
-            dayDelta=dayDelta,
-            isocalendar=isocalendar,
-            strftime=strftime,
-            get_workings_days=get_workings_days,
-        )
+    from .utilities.dates import TEMPLATE_GLOBALS
+    from .utilities.export import FORMATS
+
+    app.jinja_env.globals.update(TEMPLATE_GLOBALS, export_formats=FORMATS)
+
+    if app.config.get("TEMPLATE_CACHE_DIR"):
+        os.makedirs(app.config["TEMPLATE_CACHE_DIR"], exist_ok=True)
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(app.config["TEMPLATE_CACHE_DIR"])
 
     return app
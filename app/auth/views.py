@@ -2,7 +2,7 @@ from flask import render_template, request, flash, redirect, url_for, session, a
 from flask_login import login_user, login_required, logout_user, current_user
 from . import auth as bp
 from .. import db
-from ..models import User, Tenants
+from ..models import User, Tenants, tenant_membership
 
 
 @bp.route("/offline")
@@ -50,7 +50,7 @@ def change_tenant():
 
     # check if the user actually exists
     # take the user-supplied password, hash it, and compare it to the hashed password in the database
-    if not tenant or not tenant.id in [tenant.id for tenant in current_user.tenants]:
+    if not tenant or not tenant.id in tenant_membership():
         flash("Please check your login details and try again.")
         abort(403)
 
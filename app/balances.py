@@ -0,0 +1,255 @@
+"""Keep the ``balances`` table in sync with the ledgers.
+
+Every flush that adds, changes or deletes a ledger row turns it into
+``(amount, count)`` deltas per balance key and applies them with atomic
+``UPDATE ... SET amount = amount + :delta`` statements in the same transaction.
+"""
+import datetime
+from collections import defaultdict
+
+from sqlalchemy import event
+from sqlalchemy.sql import func
+
+from . import cache, db
+from .database import LISTENER_OPTIONS
+from .models import (
+    Balances,
+    CostsMapping,
+    Payments,
+    Purchasing,
+    Reconciliations,
+    Recovers,
+    Sales,
+    Tenants,
+)
+
+
+LEDGERS = {
+    Sales: "sales",
+    Recovers: "recovers",
+    Purchasing: "purchasing",
+    CostsMapping: "costs",
+    Payments: "payments",
+    Reconciliations: "reconciliations",
+}
+
+KEY_COLUMNS = ["company_id", "cost_id", "paymentmethod_id", "cashing"]
+
+
+def key_columns(model):
+    return [getattr(model, name) for name in KEY_COLUMNS if hasattr(model, name)]
+
+
+def balance_keys(model, company_id=None, cost_id=None, paymentmethod_id=None, cashing=None):
+    """Balance keys ``(kind, company_id, cost_id, paymentmethod_id, cashing)`` of a ledger row.
+
+    Payments and reconciliations go to a companies or a costs balance depending
+    on which side they are booked on, those booked on neither (a cash deposit)
+    to the plain ``kind`` balance.
+    """
+    kind = LEDGERS[model]
+
+    if model in (Payments, Reconciliations):
+        if company_id is not None:
+            yield (f"{kind}_companies", company_id, None, paymentmethod_id, cashing)
+        if cost_id is not None:
+            yield (f"{kind}_costs", None, cost_id, paymentmethod_id, cashing)
+        if company_id is None and cost_id is None:
+            yield (kind, None, None, paymentmethod_id, cashing)
+    else:
+        yield (kind, company_id, cost_id, paymentmethod_id, None)
+
+
+def to_amount(value):
+    # amounts come straight from the forms, count what SQL SUM() would count
+    try:
+        return float(value or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def row_values(row):
+    # works for ledger instances as well as query rows, missing columns are None
+    return {
+        column: getattr(row, column, None) for column in ["tenant_id"] + KEY_COLUMNS + ["amount"]
+    }
+
+
+def add_deltas(deltas, model, values, sign=1):
+    amount = to_amount(values.pop("amount"))
+    tenant_id = values.pop("tenant_id")
+    for key in balance_keys(model, **values):
+        delta = deltas[(tenant_id,) + key]
+        delta[0] += sign * amount
+        delta[1] += sign
+
+
+def committed_values(session, obj):
+    model = type(obj)
+    columns = [model.tenant_id] + key_columns(model) + [model.amount]
+    with session.no_autoflush:
+        row = (
+            session.query(*columns)
+            .filter(model.id == obj.id)
+            .execution_options(**LISTENER_OPTIONS)
+            .first()
+        )
+    return row_values(row) if row is not None else None
+
+
+def apply_deltas(session, deltas):
+    """Add ``{(tenant_id, kind, *KEY_COLUMNS): [amount, count]}`` to the balances table."""
+    table = Balances.__table__
+
+    for key, (amount, count) in deltas.items():
+        if not amount and not count:
+            continue
+
+        criteria = [
+            getattr(table.c, column) == value
+            for column, value in zip(["tenant_id", "kind"] + KEY_COLUMNS, key)
+        ]
+        res = session.execute(
+            table.update()
+            .where(*criteria)
+            .values(
+                amount=table.c.amount + amount,
+                count=table.c.count + count,
+                updatedAt=datetime.datetime.now(),
+            ),
+            execution_options=LISTENER_OPTIONS,
+        )
+        if res.rowcount == 0:
+            session.execute(
+                table.insert().values(
+                    dict(zip(["tenant_id", "kind"] + KEY_COLUMNS, key), amount=amount, count=count)
+                ),
+                execution_options=LISTENER_OPTIONS,
+            )
+
+
+@event.listens_for(db.session, "before_flush")
+def update_balances(session, flush_context, instances):
+    deltas = defaultdict(lambda: [0.0, 0])
+
+    for obj in session.new:
+        if type(obj) in LEDGERS:
+            add_deltas(deltas, type(obj), row_values(obj))
+
+    for obj in session.dirty:
+        if type(obj) in LEDGERS and session.is_modified(obj):
+            old = committed_values(session, obj)
+            if old is not None:
+                add_deltas(deltas, type(obj), old, sign=-1)
+            add_deltas(deltas, type(obj), row_values(obj))
+
+    for obj in session.deleted:
+        if type(obj) in LEDGERS:
+            old = committed_values(session, obj)
+            if old is not None:
+                add_deltas(deltas, type(obj), old, sign=-1)
+
+    apply_deltas(session, deltas)
+
+
+# ********************************** rebuild ********************************
+
+
+def ledger_totals(tenant_id=None):
+    """Balance rows recomputed from the ledgers, keyed like ``apply_deltas``."""
+    totals = defaultdict(lambda: [0.0, 0])
+
+    for model in LEDGERS:
+        columns = [model.tenant_id] + key_columns(model)
+        query = db.session.query(
+            *columns,
+            func.coalesce(func.sum(model.amount), 0).label("amount"),
+            func.count(model.id).label("count"),
+        ).group_by(*columns)
+        if tenant_id:
+            query = query.filter(model.tenant_id == tenant_id)
+
+        for row in query:
+            values = row_values(row)
+            values.pop("amount")
+            tenant = values.pop("tenant_id")
+            for key in balance_keys(model, **values):
+                total = totals[(tenant,) + key]
+                total[0] += row.amount
+                total[1] += row.count
+
+    return totals
+
+
+def table_totals(tenant_id=None):
+    query = db.session.query(Balances)
+    if tenant_id:
+        query = query.filter(Balances.tenant_id == tenant_id)
+
+    totals = defaultdict(lambda: [0.0, 0])
+    for balance in query:
+        total = totals[
+            (
+                balance.tenant_id,
+                balance.kind,
+                balance.company_id,
+                balance.cost_id,
+                balance.paymentmethod_id,
+                balance.cashing,
+            )
+        ]
+        total[0] += balance.amount
+        total[1] += balance.count
+    return totals
+
+
+def rebuild(tenant_id=None):
+    query = db.session.query(Balances)
+    if tenant_id:
+        query = query.filter(Balances.tenant_id == tenant_id)
+    query.delete(synchronize_session=False)
+
+    totals = ledger_totals(tenant_id)
+    apply_deltas(db.session, totals)
+    db.session.commit()
+    bump_tenants(tenant_id)
+
+    return len(totals)
+
+
+def bump_tenants(tenant_id=None):
+    """Invalidate the cached figures of the tenant, of every tenant by default."""
+    if tenant_id:
+        tenants = [tenant_id]
+    else:
+        tenants = [id for id, in db.session.query(Tenants.id)]
+    for id in tenants:
+        cache.bump_tenant(id)
+
+
+def check(tenant_id=None):
+    """Compare the figures the dashboard helpers read from both sources.
+
+    Returns ``(tenant_id, key, from_ledgers, from_balances)`` for every total of
+    ``LedgerAggregates`` that differs.
+    """
+    from .utilities.utils import LedgerAggregates
+
+    expected, actual = ledger_totals(tenant_id), table_totals(tenant_id)
+    mismatches = []
+
+    for tenant in sorted({key[0] for key in list(expected) + list(actual)}):
+        ledgers = LedgerAggregates.from_balances(
+            key[1:] + (total[0],) for key, total in expected.items() if key[0] == tenant
+        )
+        balances = LedgerAggregates.from_balances(
+            key[1:] + (total[0],) for key, total in actual.items() if key[0] == tenant
+        )
+
+        for key in sorted(set(ledgers.totals) | set(balances.totals), key=str):
+            if abs(ledgers.totals.get(key, 0.0) - balances.totals.get(key, 0.0)) > 1e-6:
+                mismatches.append(
+                    (tenant, key, ledgers.totals.get(key, 0.0), balances.totals.get(key, 0.0))
+                )
+
+    return mismatches
@@ -0,0 +1,175 @@
+"""Cache for computed dashboard figures and the logged in users.
+
+Entries are keyed by ``(tenant_id, version, view, parameters)``, every write to
+a tenant's ledgers bumps its version so stale entries are simply never read
+again and age out of the backend. Users are keyed by the version of the
+``principals`` namespace the same way.
+
+Versions are random tokens kept apart from the figures, in a store that the
+figures never fill up: a version is never evicted by them, and one lost anyway
+(a restart of uWSGI) comes back as a new token, never as an older one whose
+entries may still be in the backend.
+"""
+import pickle
+import threading
+import time
+import uuid
+from contextlib import nullcontext
+from collections import OrderedDict
+
+
+class LRUCache:
+    """In-process backend, every worker has its own copy, unbounded without ``maxsize``."""
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            item = self.items.get(key)
+            if item is None:
+                return None
+            value, expires = item
+            if expires and expires < time.monotonic():
+                del self.items[key]
+                return None
+            self.items.move_to_end(key)
+            return value
+
+    def set(self, key, value, timeout=0):
+        with self.lock:
+            self.items[key] = (value, time.monotonic() + timeout if timeout else 0)
+            self.items.move_to_end(key)
+            while self.maxsize and len(self.items) > self.maxsize:
+                self.items.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.items.pop(key, None)
+
+
+class NullCache:
+    """Backend that stores nothing, figures are always recomputed."""
+
+    def get(self, key):
+        return None
+
+    def set(self, key, value, timeout=0):
+        pass
+
+    def delete(self, key):
+        pass
+
+
+class UWSGICache:
+    """uWSGI caching framework backend, shared by all processes of the instance.
+
+    Needs the ``cache2`` named like ``CACHE_UWSGI_NAME`` and the one named like
+    ``CACHE_UWSGI_VERSIONS_NAME`` in ``app.ini``.
+    """
+
+    def __init__(self, name):
+        import uwsgi
+
+        self.uwsgi = uwsgi
+        self.name = name
+
+    def get(self, key):
+        value = self.uwsgi.cache_get(key, self.name)
+        return pickle.loads(value) if value is not None else None
+
+    def set(self, key, value, timeout=0):
+        # values bigger than the cache blocks are just not cached
+        self.uwsgi.cache_update(key, pickle.dumps(value), timeout, self.name)
+
+    def delete(self, key):
+        self.uwsgi.cache_del(key, self.name)
+
+
+class Cache:
+    """``fill`` is the context the computations of ``tenant_cached`` run in.
+
+    The app gives ``db.primary``: an entry stored under the version a write just
+    bumped must not be read from a replica that has not replayed that write yet,
+    it would be served until the next write.
+    """
+
+    def __init__(self, app=None, fill=nullcontext):
+        self.backend = None
+        self.versions = None
+        self.timeout = 0
+        self.fill = fill
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        cache_type = app.config["CACHE_TYPE"]
+        if cache_type == "uwsgi":
+            try:
+                self.backend = UWSGICache(app.config["CACHE_UWSGI_NAME"])
+                self.versions = UWSGICache(app.config["CACHE_UWSGI_VERSIONS_NAME"])
+            except ImportError:
+                # flask CLI and other processes outside of uWSGI
+                app.logger.warning("uwsgi is not available, using an in-process cache")
+                self.backend = LRUCache(app.config["CACHE_LRU_SIZE"])
+                self.versions = LRUCache(maxsize=None)
+        elif cache_type == "lru":
+            self.backend = LRUCache(app.config["CACHE_LRU_SIZE"])
+            self.versions = LRUCache(maxsize=None)
+        elif cache_type == "null":
+            self.backend = NullCache()
+            self.versions = NullCache()
+        else:
+            raise ValueError(f"unknown CACHE_TYPE {cache_type!r}")
+        self.timeout = app.config["CACHE_DEFAULT_TIMEOUT"]
+
+    @property
+    def shared(self):
+        """Whether every worker sees the versions bumped by the others."""
+        return isinstance(self.versions, UWSGICache)
+
+    def version(self, namespace):
+        key = f"version:{namespace}"
+        version = self.versions.get(key)
+        if version is None:
+            # a new token rather than a counter restarting at 0, entries keyed with a
+            # lost version are never read again
+            version = uuid.uuid4().hex
+            self.versions.set(key, version)
+        return version
+
+    def bump(self, namespace):
+        """Invalidate every entry keyed with the namespace's version."""
+        version = uuid.uuid4().hex
+        self.versions.set(f"version:{namespace}", version)
+        return version
+
+    def cached(self, key, compute, timeout=None):
+        """Return ``compute()`` cached under ``key``, ``None`` results are not cached."""
+        value = self.backend.get(key)
+        if value is None:
+            value = compute()
+            if value is not None:
+                self.backend.set(key, value, self.timeout if timeout is None else timeout)
+        return value
+
+    def tenant_version(self, tenant_id):
+        return self.version(tenant_id)
+
+    def bump_tenant(self, tenant_id):
+        """Invalidate every cached figure of the tenant."""
+        return self.bump(tenant_id)
+
+    def tenant_cached(self, tenant_id, view, compute, **params):
+        """Return ``compute()`` cached for the tenant's current version of its data."""
+        parameters = ",".join(f"{name}={value}" for name, value in sorted(params.items()))
+        key = f"{tenant_id}:{self.tenant_version(tenant_id)}:{view}:{parameters}"
+
+        def fill():
+            with self.fill():
+                return compute()
+
+        return self.cached(key, fill)
@@ -0,0 +1,160 @@
+"""Close accounting periods: freeze the month end balances and lock the month's rows.
+
+Closing a month stores the balance of every ledger key at its last day in
+``closing_balances``, computed from the previous close plus the rows of the
+months in between, so a close reads one month of rows whatever the tenant's
+age. The balance helpers of ``utils.py`` start from the latest close before the
+date they are asked for.
+
+Rows dated in a closed period are frozen: a flush adding, changing or deleting
+one raises ``ClosedPeriodError``, the CSV import rejects them too.
+"""
+import datetime
+from collections import defaultdict
+
+from sqlalchemy import event, inspect
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.sql import func
+
+from . import cache, db
+from .balances import KEY_COLUMNS, LEDGERS, balance_keys, key_columns, row_values
+from .facts import to_date
+from .models import ClosingBalances, PeriodCloses, Stocks
+from .utilities.dates import month_end
+
+# ledgers frozen by a close, stocks included
+FROZEN = set(LEDGERS) | {Stocks}
+
+
+class ClosedPeriodError(SQLAlchemyError):
+    """A ledger row dated in a closed period was added, changed or deleted."""
+
+
+def closed_through(tenant_id):
+    """Last day of the tenant's latest closed period, None when nothing is closed."""
+    with db.session.no_autoflush:
+        return (
+            db.session.query(func.max(PeriodCloses.date))
+            .filter(PeriodCloses.tenant_id == tenant_id)
+            .scalar()
+        )
+
+
+@event.listens_for(db.session, "before_flush", insert=True)
+def reject_closed_periods(session, flush_context, instances):
+    dates = defaultdict(list)
+
+    for obj in session.new:
+        if type(obj) in FROZEN:
+            dates[obj.tenant_id].append(obj.date)
+
+    for obj in session.dirty:
+        if type(obj) in FROZEN and session.is_modified(obj):
+            history = inspect(obj).attrs.date.history
+            dates[obj.tenant_id].extend(history.deleted)
+            dates[obj.tenant_id].append(obj.date)
+
+    for obj in session.deleted:
+        if type(obj) in FROZEN:
+            history = inspect(obj).attrs.date.history
+            dates[obj.tenant_id].extend(history.deleted or [obj.date])
+
+    for tenant_id, values in dates.items():
+        closed = closed_through(tenant_id)
+        if closed is None:
+            continue
+        for value in values:
+            if value is not None and to_date(value) <= closed:
+                day = to_date(value)
+                raise ClosedPeriodError(
+                    f"période clôturée au {closed:%d/%m/%Y}, écriture du {day:%d/%m/%Y}"
+                )
+
+
+def closing_totals(tenant_id, date):
+    """``{(kind, *KEY_COLUMNS): [amount, count]}`` of the close at ``date``."""
+    totals = defaultdict(lambda: [0.0, 0])
+    rows = db.session.query(ClosingBalances).filter(
+        ClosingBalances.tenant_id == tenant_id, ClosingBalances.date == date
+    )
+    for row in rows:
+        total = totals[(row.kind,) + tuple(getattr(row, column) for column in KEY_COLUMNS)]
+        total[0] += row.amount
+        total[1] += row.count
+    return totals
+
+
+def close_period(tenant_id, month):
+    """Close the month of ``month`` for the tenant, returns the number of balances stored.
+
+    Raises ``ValueError`` when the month is not over or already closed.
+    """
+    end = month_end(month)
+    if end >= datetime.date.today():
+        raise ValueError(f"le mois {end:%m/%Y} n'est pas terminé")
+    previous = closed_through(tenant_id)
+    if previous is not None and end <= previous:
+        raise ValueError(f"période déjà clôturée au {previous:%d/%m/%Y}")
+
+    totals = closing_totals(tenant_id, previous) if previous else defaultdict(lambda: [0.0, 0])
+    for model in LEDGERS:
+        columns = key_columns(model)
+        query = db.session.query(
+            model.tenant_id,
+            *columns,
+            func.coalesce(func.sum(model.amount), 0).label("amount"),
+            func.count(model.id).label("count"),
+        ).filter(model.tenant_id == tenant_id, model.date <= end)
+        if previous:
+            query = query.filter(model.date > previous)
+
+        for row in query.group_by(model.tenant_id, *columns):
+            values = row_values(row)
+            values.pop("amount")
+            values.pop("tenant_id")
+            for key in balance_keys(model, **values):
+                total = totals[key]
+                total[0] += row.amount
+                total[1] += row.count
+
+    # the last stock count of the period replaces the previous one
+    query = db.session.query(func.coalesce(func.sum(Stocks.amount), 0), func.count(Stocks.id))
+    query = query.filter(Stocks.tenant_id == tenant_id, Stocks.date <= end)
+    if previous:
+        query = query.filter(Stocks.date > previous)
+    last_count = query.group_by(Stocks.date).order_by(Stocks.date.desc()).limit(1).first()
+    if last_count is not None:
+        totals[("stocks", None, None, None, None)] = list(last_count)
+
+    db.session.add(PeriodCloses(tenant_id=tenant_id, date=end))
+    rows = [
+        dict(
+            zip(["kind"] + KEY_COLUMNS, key),
+            tenant_id=tenant_id,
+            date=end,
+            amount=amount,
+            count=count,
+        )
+        for key, (amount, count) in totals.items()
+    ]
+    if rows:
+        db.session.execute(ClosingBalances.__table__.insert(), rows)
+    db.session.commit()
+    cache.bump_tenant(tenant_id)
+    return len(totals)
+
+
+def reopen_period(tenant_id, month):
+    """Reopen the month of ``month`` and every later one, returns the closes removed."""
+    start = month.replace(day=1)
+    db.session.query(ClosingBalances).filter(
+        ClosingBalances.tenant_id == tenant_id, ClosingBalances.date >= start
+    ).delete(synchronize_session=False)
+    removed = (
+        db.session.query(PeriodCloses)
+        .filter(PeriodCloses.tenant_id == tenant_id, PeriodCloses.date >= start)
+        .delete(synchronize_session=False)
+    )
+    db.session.commit()
+    cache.bump_tenant(tenant_id)
+    return removed
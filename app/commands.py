@@ -0,0 +1,250 @@
+import datetime
+
+import click
+from flask import current_app, session
+from flask.cli import AppGroup
+from flask_login import login_user
+from sqlalchemy import event, inspect
+
+from . import balances, closing, db, facts, init_data
+from .models import (
+    CostsMapping,
+    Payments,
+    Purchasing,
+    Reconciliations,
+    Recovers,
+    Sales,
+    Stocks,
+    TenantUsers,
+    load_user,
+)
+from .utilities import utils
+from .utilities.pagination import paginate
+
+
+db_cli = AppGroup("db", help="Database maintenance.")
+balances_cli = AppGroup("balances", help="Maintain the denormalized balances table.")
+facts_cli = AppGroup("facts", help="Maintain the daily facts table.")
+periods_cli = AppGroup("periods", help="Close and reopen accounting periods.")
+templates_cli = AppGroup("templates", help="Jinja templates.")
+
+
+@balances_cli.command("rebuild")
+@click.option("--tenant", type=int, default=None, help="Only rebuild this tenant.")
+def rebuild_balances(tenant):
+    """Recompute the balances table from the ledgers, then check it."""
+    rows = balances.rebuild(tenant)
+    click.echo(f"{rows} balance rows rebuilt")
+    check_balances.callback(tenant)
+
+
+@balances_cli.command("check")
+@click.option("--tenant", type=int, default=None, help="Only check this tenant.")
+def check_balances(tenant):
+    """Compare the dashboard figures read from the balances table and the ledgers."""
+    mismatches = balances.check(tenant)
+    for tenant_id, key, expected, actual in mismatches:
+        click.echo(f"tenant {tenant_id} {key}: ledgers {expected} != balances {actual}")
+
+    if mismatches:
+        raise click.ClickException(f"{len(mismatches)} figures differ")
+    click.echo("balances match the ledgers")
+
+
+def day(value):
+    return value.date() if value else None
+
+
+@facts_cli.command("rebuild")
+@click.option("--tenant", type=int, default=None, help="Only rebuild this tenant.")
+@click.option("--start", type=click.DateTime(["%Y-%m-%d"]), default=None, help="First day.")
+@click.option("--end", type=click.DateTime(["%Y-%m-%d"]), default=None, help="Last day.")
+def rebuild_facts(tenant, start, end):
+    """Recompute the daily facts from the ledgers, then check them."""
+    rows = facts.rebuild(tenant, day(start), day(end))
+    click.echo(f"{rows} daily facts rebuilt")
+    check_facts.callback(tenant, start, end)
+
+
+@facts_cli.command("check")
+@click.option("--tenant", type=int, default=None, help="Only check this tenant.")
+@click.option("--start", type=click.DateTime(["%Y-%m-%d"]), default=None, help="First day.")
+@click.option("--end", type=click.DateTime(["%Y-%m-%d"]), default=None, help="Last day.")
+def check_facts(tenant, start, end):
+    """Compare the daily facts with the ledgers."""
+    mismatches = facts.check(tenant, day(start), day(end))
+    for key, expected, actual in mismatches:
+        click.echo(f"{key}: ledgers {expected} != facts {actual}")
+
+    if mismatches:
+        raise click.ClickException(f"{len(mismatches)} facts differ")
+    click.echo("daily facts match the ledgers")
+
+
+@periods_cli.command("close")
+@click.option("--tenant", type=int, required=True, help="Tenant to close.")
+@click.option("--month", type=click.DateTime(["%Y-%m"]), required=True, help="Month, YYYY-MM.")
+def close_period(tenant, month):
+    """Freeze the balances at the end of the month and lock its rows."""
+    try:
+        rows = closing.close_period(tenant, month.date())
+    except ValueError as error:
+        raise click.ClickException(str(error))
+    click.echo(f"{month:%Y-%m} closed, {rows} balances stored")
+
+
+@periods_cli.command("reopen")
+@click.option("--tenant", type=int, required=True, help="Tenant to reopen.")
+@click.option("--month", type=click.DateTime(["%Y-%m"]), required=True, help="Month, YYYY-MM.")
+def reopen_period(tenant, month):
+    """Reopen the month and the months closed after it."""
+    removed = closing.reopen_period(tenant, month.date())
+    click.echo(f"{removed} periods reopened")
+
+
+@db_cli.command("init")
+def init_database():
+    """Create the missing tables, with their indexes.
+
+    The balances and daily facts tables are filled from the ledgers when they
+    are created, an upgraded database already has ledger rows.
+    """
+    created = set(db.metadata.tables) - set(inspect(db.engine).get_table_names())
+    db.create_all()
+    click.echo(f"{len(db.metadata.sorted_tables)} tables ok")
+
+    if "balances" in created:
+        rebuild_balances.callback(None)
+    if "daily_facts" in created:
+        rebuild_facts.callback(None, None, None)
+
+
+@db_cli.command("seed")
+def seed_database():
+    """Add the tenants, payment methods, roles and admin user if the database has none."""
+    init_data()
+    db.session.commit()
+    click.echo("database seeded")
+
+
+@db_cli.command("indexes")
+def create_indexes():
+    """Create the indexes declared on the models that an existing database lacks."""
+    for table in db.metadata.sorted_tables:
+        for index in sorted(table.indexes, key=lambda index: index.name):
+            index.create(bind=db.engine, checkfirst=True)
+            click.echo(f"{index.name} ok")
+
+
+def record_statements(calls):
+    """``{name: [(statement, parameters)]}`` executed by each of ``calls``."""
+    recorded, name = {}, None
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        recorded.setdefault(name, []).append((statement, parameters))
+
+    event.listen(db.engine, "before_cursor_execute", record)
+    try:
+        for name, call in calls.items():
+            call()
+    finally:
+        event.remove(db.engine, "before_cursor_execute", record)
+    return recorded
+
+
+def hot_queries(tenant_id=1):
+    """The statements of the dashboard helpers and the list views for one tenant.
+
+    They run in a request of a member of the tenant, the lists filtered on the
+    current month, and every statement they execute is recorded.
+    """
+    from .costs.views import search as search_costs_mapping
+    from .payments.views import search_costs, search_purchasings
+    from .purchasings.views import search as search_purchasing
+    from .reconciliations.views import search as search_reconciliations
+    from .recovers.views import search as search_recovers
+    from .sales.views import search as search_sales
+
+    user_id = db.session.query(TenantUsers.user_id).filter_by(tenant_id=tenant_id).scalar()
+    if user_id is None:
+        raise click.ClickException(f"tenant {tenant_id} has no user")
+
+    today = datetime.date.today()
+    month = today.replace(day=1)
+    monday = today - datetime.timedelta(days=today.weekday())
+
+    def listed(search, model):
+        return lambda: paginate(search()[0], model)
+
+    calls = {
+        "dashboard balances": utils.get_ledger_aggregates,
+        "stock": utils.get_stock,
+        "sales on date": lambda: utils.get_sales_on_date(today=True),
+        "sales cum": lambda: utils.get_sales_on_date(cum=True),
+        "purchasing cum": lambda: utils.get_purchasing_on_date(cum=True),
+        "costs cum": lambda: utils.get_costs_on_date(cum=True, fixed=True),
+        "bank on date": lambda: utils.get_banque_on_date(end=today),
+        "tresor week": lambda: utils.get_treasury_week(monday),
+        "sales list": listed(search_sales, Sales),
+        "recovers list": listed(search_recovers, Recovers),
+        "purchasing list": listed(search_purchasing, Purchasing),
+        "costs list": listed(search_costs_mapping, CostsMapping),
+        "payments list": listed(search_purchasings, Payments),
+        "payments costs list": listed(search_costs, Payments),
+        "reconciliations list": listed(search_reconciliations, Reconciliations),
+        "stocks list": lambda: paginate(Stocks.query(), Stocks),
+    }
+
+    with current_app.test_request_context(query_string={"s_start_date": month.isoformat()}):
+        login_user(load_user(user_id))
+        session["tenant"] = tenant_id
+        return record_statements(calls)
+
+
+def explain(statement, parameters):
+    with db.engine.connect() as connection:
+        if db.engine.dialect.name == "sqlite":
+            rows = connection.exec_driver_sql(
+                f"EXPLAIN QUERY PLAN {statement}", parameters
+            ).fetchall()
+            plan = [row[-1] for row in rows]
+            full_scan = any(line.startswith("SCAN ") and " USING " not in line for line in plan)
+        else:
+            rows = connection.exec_driver_sql(f"EXPLAIN {statement}", parameters)
+            plan = [row[0] for row in rows]
+            full_scan = any("Seq Scan" in line for line in plan)
+    return plan, full_scan
+
+
+@db_cli.command("explain")
+@click.option("--tenant", type=int, default=1, help="Tenant id used in the filters.")
+def explain_queries(tenant):
+    """Print the query plan of every hot query and fail if one scans a whole table."""
+    scans = []
+    for name, statements in hot_queries(tenant).items():
+        plans = [explain(statement, parameters) for statement, parameters in statements]
+        full_scan = any(scan for plan, scan in plans)
+        click.echo(f"{'SCAN' if full_scan else 'OK':4} {name}")
+        for plan, scan in plans:
+            for line in plan:
+                click.echo(f"     {line}")
+        if full_scan:
+            scans.append(name)
+
+    if scans:
+        raise click.ClickException(f"full table scans: {', '.join(scans)}")
+
+
+def compile_templates(app):
+    """Load every template once, filling the environment's cache and the bytecode cache."""
+    names = app.jinja_env.list_templates(extensions=["html"])
+    for name in names:
+        app.jinja_env.get_template(name)
+    return names
+
+
+@templates_cli.command("compile")
+def compile_templates_command():
+    """Compile every template into TEMPLATE_CACHE_DIR."""
+    names = compile_templates(current_app)
+    click.echo(f"{len(names)} templates compiled")
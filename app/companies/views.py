@@ -4,18 +4,21 @@ from sqlalchemy.exc import SQLAlchemyError
 
 from . import companies as bp
 from .. import db
-from ..models import Companies
+from ..models import Companies, Sales
+from ..utilities.decorators import invalidate_tenant_cache
 
 
 @bp.route("/", methods=["GET"])
 @login_required
 def index():
     companies = Companies.query().all()
-    return render_template("companies/index.html", companies=companies)
+    sales = dict(Sales.query_sum_by(Sales.company_id).all())
+    return render_template("companies/index.html", companies=companies, sales=sales)
 
 
 @bp.route("/", methods=["POST"])
 @login_required
+@invalidate_tenant_cache
 def add_companies():
 
     name = request.form.get("name")
@@ -79,6 +82,7 @@ def get_sale_by_id(id):
 
 @bp.route("/<int:id>", methods=["POST"])
 @login_required
+@invalidate_tenant_cache
 def update_companies(id):
 
     company = Companies.query().filter(Companies.id == id).first()
@@ -127,6 +131,7 @@ def update_companies(id):
 
 @bp.route("/remove/<int:id>", methods=["POST"])
 @login_required
+@invalidate_tenant_cache
 def remove_companies(id):
 
     company = Companies.query().filter(Companies.id == id).first()
@@ -1,17 +1,31 @@
 import datetime
 from flask import request, render_template, flash, redirect, url_for
 from flask_login import login_required
-from sqlalchemy import desc
 from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import joinedload, raiseload
 from . import costs as bp
 from .. import db
+from ..closing import ClosedPeriodError
 from ..models import CostsMapping, CostsDef, PaymentMethod
+from ..utilities.decorators import invalidate_tenant_cache
+from ..utilities.export import stream_export
+from ..utilities.imports import import_ledger, lookup
+from ..utilities.pagination import paginate
 from ..utilities.utils2 import toDate, compare
 
+EXPORT_COLUMNS = [
+    ("Date", "date"),
+    ("Charge", "costsdef.name"),
+    ("Mode de paiement", "paymentmethod.name"),
+    ("Montant", "amount"),
+    ("Commentaire", "comment"),
+    ("Document", "document_number"),
+    ("Echeance", "due_date"),
+]
 
-@bp.route("/", methods=["GET"])
-@login_required
-def index():
+
+def search():
+    """The costs matching the ``s_*`` request arguments, and those arguments."""
     s_costsdef = request.args.get("s_costsdef", type=int, default=0)
     s_paymentmethod = request.args.get("s_paymentmethod", type=int, default=0)
     s_op = request.args.get("s_op", type=str, default="")
@@ -19,7 +33,9 @@ def index():
     s_start_date = request.args.get("s_start_date", type=toDate, default="")
     s_end_date = request.args.get("s_end_date", type=toDate, default="")
 
-    query = CostsMapping.query()
+    query = CostsMapping.query().options(
+        joinedload(CostsMapping.costsdef), joinedload(CostsMapping.paymentmethod)
+    )
 
     if s_costsdef > 0:
         query = query.filter(CostsMapping.cost_id == s_costsdef)
@@ -36,27 +52,65 @@ def index():
     if s_end_date:
         query = query.filter(CostsMapping.date <= s_end_date)
 
-    costsmappings = query.order_by(desc(CostsMapping.date)).all()
+    return query, dict(
+        s_costsdef=s_costsdef,
+        s_paymentmethod=s_paymentmethod,
+        s_op=s_op,
+        s_amount=s_amount,
+        s_start_date=s_start_date,
+        s_end_date=s_end_date,
+    )
+
+
+@bp.route("/", methods=["GET"])
+@login_required
+def index():
+
+    query, filters = search()
+    page = paginate(query, CostsMapping)
 
     costsdefs = CostsDef.query().all()
     paymentmethod = db.session.query(PaymentMethod).filter(PaymentMethod.id.notin_([7])).all()
 
     return render_template(
         "/costs/index.html",
-        costsmappings=costsmappings,
+        costsmappings=page.items,
+        page=page,
         costsdefs=costsdefs,
         paymentmethod=paymentmethod,
-        s_costsdef=s_costsdef,
-        s_paymentmethod=s_paymentmethod,
-        s_op=s_op,
-        s_amount=s_amount,
-        s_start_date=s_start_date,
-        s_end_date=s_end_date,
+        **filters,
+    )
+
+
+@bp.route("/export.<format>", methods=["GET"])
+@login_required
+def export(format):
+    query, _ = search()
+    return stream_export(query, CostsMapping, EXPORT_COLUMNS, "charges", format)
+
+
+@bp.route("/import", methods=["POST"])
+@login_required
+@invalidate_tenant_cache
+def import_csv():
+    file = request.files.get("file")
+    if not file:
+        flash("Aucun fichier", category="warning")
+        return redirect(url_for(".index"))
+
+    parties = CostsDef.query().with_entities(CostsDef.id, CostsDef.name)
+    paymentmethods = db.session.query(PaymentMethod.id, PaymentMethod.name).filter(
+        PaymentMethod.id.notin_([7])
+    )
+    report = import_ledger(
+        file, CostsMapping, "Charge", "cost_id", lookup(parties), lookup(paymentmethods)
     )
+    return render_template("import.html", report=report, ledger="Charges", back=url_for(".index"))
 
 
 @bp.route("/", methods=["POST"])
 @login_required
+@invalidate_tenant_cache
 def add_costs():
 
     cost_id = request.form.get("cost_id", type=int)
@@ -84,6 +138,9 @@ def add_costs():
         db.session.add(new_cost)
         db.session.commit()
         # upload_file(new_cost) # TODO:upload
+    except ClosedPeriodError as e:
+        db.session.rollback()
+        flash(str(e), category="warning")
     except SQLAlchemyError as e:
         print(e)
         db.session.rollback()
@@ -99,7 +156,7 @@ def add_costs():
 @login_required
 def get_costs_by_id(id):
 
-    cost = CostsMapping.query().filter(CostsMapping.id == id).first()
+    cost = CostsMapping.query().options(raiseload("*")).filter(CostsMapping.id == id).first()
 
     if not cost:
         flash("Charge n'exist pas !!!", category="warning")
@@ -118,6 +175,7 @@ def get_costs_by_id(id):
 
 @bp.route("/<int:id>", methods=["POST"])
 @login_required
+@invalidate_tenant_cache
 def update_costs(id):
 
     cost = CostsMapping.query().filter(CostsMapping.id == id).first()
@@ -149,6 +207,10 @@ def update_costs(id):
         db.session.commit()
         # upload_file(cost) # TODO:upload
 
+    except ClosedPeriodError as e:
+        db.session.rollback()
+        flash(str(e), category="warning")
+
     except SQLAlchemyError as e:
         print(e)
         db.session.rollback()
@@ -162,6 +224,7 @@ def update_costs(id):
 
 @bp.route("/remove/<int:id>", methods=["POST"])
 @login_required
+@invalidate_tenant_cache
 def remove_costs(id):
 
     cost = CostsMapping.query().filter(CostsMapping.id == id).first()
@@ -175,6 +238,10 @@ def remove_costs(id):
         db.session.commit()
         flash("Charge supprimer !!!", category="success")
 
+    except ClosedPeriodError as e:
+        db.session.rollback()
+        flash(str(e), category="warning")
+
     except SQLAlchemyError as e:
         print(e)
         db.session.rollback()
@@ -188,6 +255,7 @@ def remove_costs(id):
 
 @bp.route("/costs_type", methods=["POST"])
 @login_required
+@invalidate_tenant_cache
 def add_costs_type():
 
     fixed = request.form.get("fixed", type=int)
@@ -198,6 +266,9 @@ def add_costs_type():
     try:
         db.session.add(new_cost_type)
         db.session.commit()
+    except ClosedPeriodError as e:
+        db.session.rollback()
+        flash(str(e), category="warning")
     except SQLAlchemyError as e:
         print(e)
         db.session.rollback()
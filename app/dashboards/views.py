@@ -1,10 +1,13 @@
+import os
+
 from flask import render_template, request, session
 
 from flask_login import login_required, current_user
-from sqlalchemy import desc
 from . import dash
-from .. import db
-from ..models import Companies, SalesCategories, PaymentMethod, Reconciliations
+from .. import db, cache
+from ..models import current_tenant, Companies, SalesCategories, PaymentMethod
+from ..utilities.dates import month_periods, quarter_periods
+from ..utilities.decorators import admin_required
 from ..utilities.utils import *
 
 
@@ -38,23 +41,37 @@ def dashboard():
     )
 
 
+# periods of the comparative income statement, ``?periodes=`` of the exploit page
+INCOME_PERIODS = {"mois": (month_periods, 12), "trimestres": (quarter_periods, 8)}
+
+
 @dash.route("/exploit")
 @login_required
 def exploit():
     salesCategories = SalesCategories.query().all()
 
+    figures = cache.tenant_cached(
+        current_tenant(), "exploit", get_exploit_figures, day=datetime.date.today()
+    )
+
+    periods = request.args.get("periodes")
+    if periods not in INCOME_PERIODS:
+        periods = "mois"
+    builder, count = INCOME_PERIODS[periods]
+    statement = cache.tenant_cached(
+        current_tenant(),
+        "income_statement",
+        lambda: get_income_statement(builder(count)),
+        periods=periods,
+        day=datetime.date.today(),
+    )
+
     return render_template(
         "dashboard/exploit.html",
         salesCategories=salesCategories,
-        get_sales_on_date=get_sales_on_date,
-        get_stock_on_date=get_stock_on_date,
-        get_purchasing_on_date=get_purchasing_on_date,
-        get_costo_goods_sold=get_costo_goods_sold,
-        get_gross_margin=get_gross_margin,
-        get_costs_on_date=get_costs_on_date,
-        get_gross_operating_income=get_gross_operating_income,
-        get_tax_gross_operating_income=get_tax_gross_operating_income,
-        get_net_operating_income=get_net_operating_income,
+        figures=figures,
+        periods=periods,
+        statement=statement,
     )
 
 
@@ -70,62 +87,26 @@ def tresor():
         iso = first_day.isocalendar()
         week = f"{iso[0]}-W{iso[1]}"
 
-    init_sold = []
-    end_sold = []
-
-    caching = []
-
-    debt = []
-
-    for daynumber in range(7):
-        day = first_day + datetime.timedelta(days=daynumber)
-        day_befor = first_day + datetime.timedelta(days=daynumber - 1)
-
-        query = Reconciliations.query_sum()
-        query = query.filter(Reconciliations.date == day)
-
-        init_sold.append(get_banque_on_date(end=day_befor))
-        end_sold.append(get_banque_on_date(end=day))
-
-        res_caching = []
-        res_debt = []
-        for payment_id in [1, 2, 3, 5, 6, 7]:
-            query_caching = query.filter(
-                Reconciliations.cashing == True, Reconciliations.paymentmethod_id == payment_id
-            )
-            query_debit = query.filter(
-                Reconciliations.cashing == False, Reconciliations.paymentmethod_id == payment_id
-            )
-            res_caching.append(round(query_caching.scalar(), 3))
-            res_debt.append(round(query_debit.scalar(), 3))
-
-        caching.append(res_caching)
-        debt.append(res_debt)
+    treasury = cache.tenant_cached(
+        current_tenant(), "tresor", lambda: get_treasury_week(first_day), week=first_day
+    )
 
     paymentmethods = db.session.query(PaymentMethod).filter(PaymentMethod.id.notin_([7])).all()
 
-    encaiss = (
-        Reconciliations.query()
-        .filter(Reconciliations.cashing == True)
-        .order_by(desc(Reconciliations.date))
-        .all()
-    )
-    decaiss = (
-        Reconciliations.query()
-        .filter(Reconciliations.cashing == False)
-        .order_by(desc(Reconciliations.date))
-        .all()
-    )
-
     return render_template(
         "dashboard/tresor.html",
-        encaiss=encaiss,
-        decaiss=decaiss,
         paymentmethods=paymentmethods,
-        caching=caching,
-        debt=debt,
-        init_sold=init_sold,
-        end_sold=end_sold,
         week=week,
         first_day=first_day,
+        **treasury,
+    )
+
+
+@dash.route("/queries")
+@login_required
+@admin_required
+def queries():
+    # the timings are kept per uWSGI worker, the page shows the one answering it
+    return render_template(
+        "dashboard/queries.html", routes=db.route_stats.slowest(), worker=os.getpid()
     )
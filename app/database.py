@@ -1,18 +1,244 @@
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from functools import wraps
 from operator import imod
-from sqlalchemy.exc import SQLAlchemyError
+from flask import current_app, g, has_app_context, has_request_context, request
+from jinja2 import Template
+from sqlalchemy.exc import OperationalError, SQLAlchemyError
 
-from sqlalchemy import create_engine
-from sqlalchemy.orm import scoped_session, sessionmaker
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.orm import Session, scoped_session, sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 
 
+class LazyLoadError(SQLAlchemyError):
+    """A relationship was lazy loaded while a template was rendering."""
+
+
+class GuardedTemplate(Template):
+    """Template that flags ``g`` while it renders, see ``LAZY_LOAD_GUARD``."""
+
+    def render(self, *args, **kwargs):
+        if not has_app_context():
+            return super().render(*args, **kwargs)
+
+        g.rendering_template = self.name or "<string>"
+        try:
+            return super().render(*args, **kwargs)
+        finally:
+            g.rendering_template = None
+
+
+def guard_lazy_load(orm_execute_state):
+    """Report relationships loaded by the templates instead of the views."""
+    if not orm_execute_state.is_relationship_load or not has_app_context():
+        return
+
+    template = g.get("rendering_template")
+    if template is None:
+        return
+
+    instance = orm_execute_state.lazy_loaded_from
+    message = f"{template} lazy loaded a relationship of {instance.class_.__name__}"
+    if current_app.config["LAZY_LOAD_GUARD"] == "raise":
+        raise LazyLoadError(message)
+    current_app.logger.warning(message)
+
+
+def normalize_sql(statement):
+    """Shape of a statement: numbers and parameter lists folded, whitespace collapsed."""
+    statement = re.sub(r"\s+", " ", statement).strip()
+    statement = re.sub(r"\b\d+(\.\d+)?\b", "?", statement)
+    return re.sub(r"\(\?(, \?)+\)", "(?)", statement)
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+# execution options of the statements the flush listeners run once per ledger key,
+# counted and timed but never reported as N+1
+LISTENER_OPTIONS = {"n_plus_one": False}
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    duration = time.perf_counter() - conn.info["query_started"].pop()
+    if has_request_context():
+        counted = context is None or context.execution_options.get("n_plus_one", True)
+        g.setdefault("db_statements", []).append((normalize_sql(statement), duration, counted))
+
+
+# requests that only read, they run in a read-only transaction that is never committed
+READ_ONLY_METHODS = {"GET", "HEAD"}
+
+
+def sqlite_pragmas(pragmas):
+    """Connect listener applying ``SQLITE_PRAGMAS``, busy_timeout first so the others may wait."""
+    pragmas = sorted(pragmas.items(), key=lambda pragma: pragma[0] != "busy_timeout")
+
+    def connect(dbapi_connection, connection_record):
+        for name, value in pragmas:
+            dbapi_connection.execute(f"PRAGMA {name} = {value}")
+
+    return connect
+
+
+def is_busy(error):
+    return "database is locked" in str(error) or "database is busy" in str(error)
+
+
+def begin_immediate(connection):
+    """Take the write lock up front, retrying with jittered backoff while another writer holds it.
+
+    A deferred transaction that reads then writes cannot wait for the lock, SQLite answers
+    SQLITE_BUSY at once to avoid a deadlock between readers upgrading to writers.
+    """
+    retries = current_app.config["SQLITE_BUSY_RETRIES"] if has_app_context() else 0
+    backoff = current_app.config["SQLITE_BUSY_BACKOFF"] if has_app_context() else 0
+    for attempt in range(retries + 1):
+        try:
+            connection.exec_driver_sql("BEGIN IMMEDIATE")
+            return
+        except OperationalError as error:
+            if attempt == retries or not is_busy(error):
+                raise
+            time.sleep(random.uniform(0, backoff * 2**attempt))
+
+
+def begin_transaction(session, transaction, connection):
+    """Make read-only requests refuse writes and let writing ones lock the database early."""
+    if session.info.get("read_only"):
+        if connection.dialect.name == "sqlite":
+            connection.exec_driver_sql("PRAGMA query_only = ON")
+            connection.info["query_only"] = True
+        elif connection.dialect.name == "postgresql":
+            connection.exec_driver_sql("SET TRANSACTION READ ONLY")
+    elif session.info.get("immediate") and connection.dialect.name == "sqlite":
+        begin_immediate(connection)
+
+
+def sqlite_checkin(dbapi_connection, connection_record):
+    # query_only outlives the transaction, the next user of the connection may write
+    if connection_record.info.pop("query_only", False):
+        dbapi_connection.execute("PRAGMA query_only = OFF")
+
+
+def engine_options(uri, config):
+    """``create_engine`` arguments: SQLite's threading, pool sizing and health for the others."""
+    url = make_url(uri)
+    if url.get_backend_name() == "sqlite":
+        options = {"connect_args": {"check_same_thread": False}}
+        if url.database in (None, "", ":memory:"):
+            return options
+        # keep the connections and their pragmas, file databases are not pooled by default
+        return dict(
+            options,
+            poolclass=QueuePool,
+            pool_size=config["DATABASE_POOL_SIZE"],
+            max_overflow=config["DATABASE_MAX_OVERFLOW"],
+        )
+
+    return dict(
+        pool_size=config["DATABASE_POOL_SIZE"],
+        max_overflow=config["DATABASE_MAX_OVERFLOW"],
+        pool_timeout=config["DATABASE_POOL_TIMEOUT"],
+        pool_recycle=config["DATABASE_POOL_RECYCLE"],
+        pool_pre_ping=config["DATABASE_POOL_PRE_PING"],
+    )
+
+
+class RoutingSession(Session):
+    """Session sending the reads of ``SQLITE.replica`` blocks to the read-only engine.
+
+    Only read-only requests are routed, a request that writes keeps reading its own
+    writes from the primary, and so do the ``SQLITE.primary`` blocks.
+    """
+
+    def __init__(self, replica_bind=None, **kwargs):
+        super().__init__(**kwargs)
+        self.replica_bind = replica_bind
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        if (
+            self.replica_bind is not None
+            and self.info.get("replica")
+            and self.info.get("read_only")
+            and not self.info.get("primary")
+            and not self._flushing
+        ):
+            return self.replica_bind
+        return super().get_bind(mapper, clause, **kwargs)
+
+
+class RouteStats:
+    """Request and SQL timings of every route served by this process.
+
+    Each uWSGI worker keeps its own, the admin page shows the worker answering it.
+    """
+
+    def __init__(self):
+        self.routes = {}
+        self.lock = threading.Lock()
+
+    def add(self, route, duration, queries, db_time, n_plus_one):
+        with self.lock:
+            stats = self.routes.setdefault(
+                route,
+                {
+                    "route": route,
+                    "requests": 0,
+                    "time": 0.0,
+                    "max_time": 0.0,
+                    "queries": 0,
+                    "db_time": 0.0,
+                    "n_plus_one": 0,
+                },
+            )
+            stats["requests"] += 1
+            stats["time"] += duration
+            stats["max_time"] = max(stats["max_time"], duration)
+            stats["queries"] += queries
+            stats["db_time"] += db_time
+            stats["n_plus_one"] += bool(n_plus_one)
+
+    def slowest(self, limit=50):
+        """Routes by mean response time, times in milliseconds."""
+        with self.lock:
+            routes = [dict(stats) for stats in self.routes.values()]
+
+        for stats in routes:
+            requests = stats["requests"]
+            stats["mean_time"] = stats["time"] / requests * 1000
+            stats["max_time"] *= 1000
+            stats["mean_queries"] = stats["queries"] / requests
+            stats["mean_db_time"] = stats["db_time"] / requests * 1000
+
+        return sorted(routes, key=lambda stats: stats["mean_time"], reverse=True)[:limit]
+
+
 class SQLITE:
+    """Engines and session of the application: SQLite or PostgreSQL, with an optional replica."""
+
     def __init__(self, app=None):
 
-        self.session = scoped_session(sessionmaker(autocommit=False, autoflush=False))
+        self.session = scoped_session(
+            sessionmaker(class_=RoutingSession, autocommit=False, autoflush=False)
+        )
         self.engine = None
+        self.replica_engine = None
         self.Model = declarative_base(bind=self.engine)
         self.app = app
+        self.route_stats = RouteStats()
+
+        event.listen(self.session, "do_orm_execute", guard_lazy_load)
+        event.listen(self.session, "after_begin", begin_transaction)
 
         if app is not None:
             self.init_app(app)
@@ -29,18 +255,150 @@ class SQLITE:
 
         return self.Model.metadata
 
+    @property
+    def engines(self):
+        return [engine for engine in (self.engine, self.replica_engine) if engine is not None]
+
+    def dispose(self):
+        """Drop the pooled connections, a forked process must open its own."""
+        for engine in self.engines:
+            engine.dispose()
+
+    @contextmanager
+    def replica(self):
+        """Run the reads of the block on the replica, when there is one."""
+        info = self.session.info
+        previous = info.get("replica", False)
+        info["replica"] = True
+        try:
+            yield
+        finally:
+            info["replica"] = previous
+
+    @contextmanager
+    def primary(self):
+        """Run the reads of the block on the primary, its ``replica`` blocks included."""
+        info = self.session.info
+        previous = info.get("primary", False)
+        info["primary"] = True
+        try:
+            yield
+        finally:
+            info["primary"] = previous
+
+    def on_replica(self, f):
+        """Decorator form of ``replica``."""
+
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            with self.replica():
+                return f(*args, **kwargs)
+
+        return decorated_function
+
+    def read_only(self, f):
+        """View decorator: the request only reads whatever its method, like a GET.
+
+        It gets a read-only transaction instead of the write lock of ``BEGIN IMMEDIATE``.
+        """
+        f.read_only = True
+        return f
+
+    def make_engine(self, app, uri):
+        engine = create_engine(uri, **engine_options(uri, app.config))
+        if engine.dialect.name == "sqlite":
+            event.listen(engine, "connect", sqlite_pragmas(app.config["SQLITE_PRAGMAS"]))
+            event.listen(engine, "checkin", sqlite_checkin)
+        return engine
+
     def init_app(self, app):
 
-        self.engine = create_engine(
-            app.config["DATABASE_URI"], connect_args={"check_same_thread": False}
-        )
-        self.session.configure(bind=self.engine)
+        self.engine = self.make_engine(app, app.config["DATABASE_URI"])
+        self.replica_engine = None
+        if app.config.get("DATABASE_REPLICA_URI"):
+            self.replica_engine = self.make_engine(app, app.config["DATABASE_REPLICA_URI"])
+        self.session.remove()
+        self.session.configure(bind=self.engine, replica_bind=self.replica_engine)
 
-        @app.teardown_appcontext
-        def shutdown_session(response_or_exc):
+        if app.config.get("LAZY_LOAD_GUARD"):
+            app.jinja_env.template_class = GuardedTemplate
+
+        if app.config.get("SQL_INSTRUMENTATION"):
+            self.init_instrumentation(app)
 
-            if response_or_exc is None:
+        @app.before_request
+        def begin_request():
+            view = app.view_functions.get(request.endpoint)
+            read_only = request.method in READ_ONLY_METHODS or getattr(view, "read_only", False)
+            self.session.info["read_only"] = read_only
+            self.session.info["immediate"] = app.config["SQLITE_BEGIN_IMMEDIATE"] and not read_only
+
+        @app.teardown_request
+        def end_request(exc):
+            # reads are rolled back, there is nothing to commit and nothing to sync
+            if exc is None and not self.session.info.get("read_only"):
                 self.session.commit()
+            else:
+                self.session.rollback()
+            self.session.info["read_only"] = self.session.info["immediate"] = False
+
+        @app.teardown_appcontext
+        def shutdown_session(response_or_exc):
+            # requests end in end_request, commands commit what they write
             self.session.remove()
 
             return response_or_exc
+
+    def init_instrumentation(self, app):
+        """Count and time the statements of every request, see ``SQL_INSTRUMENTATION``."""
+        self.route_stats = RouteStats()
+        for engine in self.engines:
+            event.listen(engine, "before_cursor_execute", before_cursor_execute)
+            event.listen(engine, "after_cursor_execute", after_cursor_execute)
+
+        @app.before_request
+        def start_timer():
+            g.request_started = time.perf_counter()
+
+        @app.after_request
+        def record_queries(response):
+            if "request_started" not in g:
+                return response
+
+            duration = time.perf_counter() - g.request_started
+            statements = g.pop("db_statements", [])
+            db_time = sum(statement_time for _, statement_time, _ in statements)
+            shapes = Counter(shape for shape, _, counted in statements if counted)
+            n_plus_one = [
+                shape
+                for shape, count in shapes.items()
+                if count >= app.config["SQL_N_PLUS_ONE_THRESHOLD"]
+            ]
+
+            response.headers["X-DB-Queries"] = len(statements)
+            response.headers["Server-Timing"] = (
+                f'db;dur={db_time * 1000:.1f};desc="{len(statements)} queries", '
+                f"app;dur={duration * 1000:.1f}"
+            )
+            if n_plus_one:
+                response.headers["X-DB-N-Plus-One"] = len(n_plus_one)
+
+            route = (
+                f"{request.method} {request.url_rule.rule if request.url_rule else '<unmatched>'}"
+            )
+            self.route_stats.add(route, duration, len(statements), db_time, n_plus_one)
+
+            log = app.logger.warning if n_plus_one else app.logger.info
+            log(
+                json.dumps(
+                    {
+                        "route": route,
+                        "status": response.status_code,
+                        "time_ms": round(duration * 1000, 1),
+                        "queries": len(statements),
+                        "db_ms": round(db_time * 1000, 1),
+                        "n_plus_one": {shape: shapes[shape] for shape in n_plus_one},
+                    }
+                )
+            )
+            return response
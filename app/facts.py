@@ -0,0 +1,241 @@
+"""Keep the ``daily_facts`` table in sync with the ledgers.
+
+The same bookkeeping as ``balances.py`` with the day as one more key: every flush
+turns the ledger rows it writes into ``(amount, count)`` deltas per ``(tenant_id,
+date, ledger, company_id, cost_id, paymentmethod_id, cashing)`` and applies them in
+the same transaction. ``fixed`` is ``CostsDef.fixed`` of the row's cost, looked up
+when the deltas are applied and rewritten when a cost changes category.
+
+A period sum then reads one row per day and key, however many transactions the
+tenant booked.
+"""
+import datetime
+from collections import defaultdict
+
+from sqlalchemy import event, inspect
+from sqlalchemy.sql import func
+
+from . import db
+from .database import LISTENER_OPTIONS
+from .balances import KEY_COLUMNS, LEDGERS, bump_tenants, key_columns, to_amount
+from .models import CostsDef, DailyFacts
+
+FACT_COLUMNS = ["tenant_id", "date", "ledger"] + KEY_COLUMNS
+
+
+def to_date(value):
+    # the forms give datetimes, SQLite may give back ISO strings
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    if isinstance(value, str):
+        return datetime.date.fromisoformat(value[:10])
+    return value
+
+
+def row_values(row):
+    return {
+        column: getattr(row, column, None)
+        for column in ["tenant_id", "date"] + KEY_COLUMNS + ["amount"]
+    }
+
+
+def fact_key(model, values):
+    return (values["tenant_id"], to_date(values["date"]), LEDGERS[model]) + tuple(
+        values.get(column) for column in KEY_COLUMNS
+    )
+
+
+def add_deltas(deltas, model, values, sign=1):
+    if values.get("date") is None:
+        return
+    delta = deltas[fact_key(model, values)]
+    delta[0] += sign * to_amount(values["amount"])
+    delta[1] += sign
+
+
+def committed_values(session, obj):
+    model = type(obj)
+    columns = [model.tenant_id, model.date] + key_columns(model) + [model.amount]
+    with session.no_autoflush:
+        row = (
+            session.query(*columns)
+            .filter(model.id == obj.id)
+            .execution_options(**LISTENER_OPTIONS)
+            .first()
+        )
+    return row_values(row) if row is not None else None
+
+
+def fixed_costs(session, cost_ids):
+    """``{cost_id: fixed}`` of the given costs."""
+    if not cost_ids:
+        return {}
+    with session.no_autoflush:
+        return dict(
+            session.query(CostsDef.id, CostsDef.fixed).filter(CostsDef.id.in_(sorted(cost_ids)))
+        )
+
+
+def apply_deltas(session, deltas):
+    """Add ``{(tenant_id, date, ledger, *KEY_COLUMNS): [amount, count]}`` to the daily facts."""
+    table = DailyFacts.__table__
+    cost_index = FACT_COLUMNS.index("cost_id")
+    fixed = fixed_costs(session, {key[cost_index] for key in deltas} - {None})
+
+    for key, (amount, count) in deltas.items():
+        if not amount and not count:
+            continue
+
+        criteria = [getattr(table.c, column) == value for column, value in zip(FACT_COLUMNS, key)]
+        res = session.execute(
+            table.update()
+            .where(*criteria)
+            .values(
+                amount=table.c.amount + amount,
+                count=table.c.count + count,
+                updatedAt=datetime.datetime.now(),
+            ),
+            execution_options=LISTENER_OPTIONS,
+        )
+        if res.rowcount == 0:
+            session.execute(
+                table.insert().values(
+                    dict(
+                        zip(FACT_COLUMNS, key),
+                        fixed=fixed.get(key[cost_index]),
+                        amount=amount,
+                        count=count,
+                    )
+                ),
+                execution_options=LISTENER_OPTIONS,
+            )
+
+
+@event.listens_for(db.session, "before_flush")
+def update_facts(session, flush_context, instances):
+    deltas = defaultdict(lambda: [0.0, 0])
+
+    for obj in session.new:
+        if type(obj) in LEDGERS:
+            add_deltas(deltas, type(obj), row_values(obj))
+
+    for obj in session.dirty:
+        if type(obj) in LEDGERS and session.is_modified(obj):
+            old = committed_values(session, obj)
+            if old is not None:
+                add_deltas(deltas, type(obj), old, sign=-1)
+            add_deltas(deltas, type(obj), row_values(obj))
+
+        elif type(obj) is CostsDef and inspect(obj).attrs.fixed.history.has_changes():
+            table = DailyFacts.__table__
+            session.execute(
+                table.update()
+                .where(table.c.tenant_id == obj.tenant_id, table.c.cost_id == obj.id)
+                .values(fixed=bool(obj.fixed)),
+                execution_options=LISTENER_OPTIONS,
+            )
+
+    for obj in session.deleted:
+        if type(obj) in LEDGERS:
+            old = committed_values(session, obj)
+            if old is not None:
+                add_deltas(deltas, type(obj), old, sign=-1)
+
+    apply_deltas(session, deltas)
+
+
+# ********************************** rebuild ********************************
+
+
+def in_range(query, column, start=None, end=None):
+    if start:
+        query = query.filter(column >= start)
+    if end:
+        query = query.filter(column <= end)
+    return query
+
+
+def ledger_totals(tenant_id=None, start=None, end=None):
+    """Daily facts recomputed from the ledgers, keyed like ``apply_deltas``."""
+    totals = defaultdict(lambda: [0.0, 0])
+
+    for model in LEDGERS:
+        columns = [model.tenant_id, model.date] + key_columns(model)
+        query = db.session.query(
+            *columns,
+            func.coalesce(func.sum(model.amount), 0).label("amount"),
+            func.count(model.id).label("count"),
+        ).group_by(*columns)
+        if tenant_id:
+            query = query.filter(model.tenant_id == tenant_id)
+        query = in_range(query, model.date, start, end)
+
+        for row in query:
+            values = row_values(row)
+            if values["date"] is None:
+                continue
+            total = totals[fact_key(model, values)]
+            total[0] += row.amount
+            total[1] += row.count
+
+    return totals
+
+
+def table_totals(tenant_id=None, start=None, end=None):
+    table = DailyFacts.__table__
+    query = db.session.query(*[getattr(table.c, column) for column in FACT_COLUMNS + ["fixed"]])
+    query = query.add_columns(table.c.amount, table.c.count)
+    if tenant_id:
+        query = query.filter(table.c.tenant_id == tenant_id)
+    query = in_range(query, table.c.date, start, end)
+
+    totals = defaultdict(lambda: [0.0, 0])
+    for row in query:
+        total = totals[(row[0], to_date(row[1])) + tuple(row[2:-2])]
+        total[0] += row.amount
+        total[1] += row.count
+    return totals
+
+
+def rebuild(tenant_id=None, start=None, end=None):
+    """Recompute the daily facts of a tenant and period, every tenant and day by default."""
+    query = db.session.query(DailyFacts)
+    if tenant_id:
+        query = query.filter(DailyFacts.tenant_id == tenant_id)
+    in_range(query, DailyFacts.date, start, end).delete(synchronize_session=False)
+
+    # the period is empty now, every fact is a plain insert
+    cost_index = FACT_COLUMNS.index("cost_id")
+    totals = ledger_totals(tenant_id, start, end)
+    fixed = fixed_costs(db.session, {key[cost_index] for key in totals} - {None})
+    rows = [
+        dict(zip(FACT_COLUMNS, key), fixed=fixed.get(key[cost_index]), amount=amount, count=count)
+        for key, (amount, count) in totals.items()
+    ]
+    if rows:
+        db.session.execute(DailyFacts.__table__.insert(), rows)
+    db.session.commit()
+    bump_tenants(tenant_id)
+
+    return len(totals)
+
+
+def check(tenant_id=None, start=None, end=None):
+    """``(key, from_ledgers, from_facts)`` of every fact differing from the ledgers.
+
+    Keys end with ``fixed``, a cost whose category changed without its facts is
+    reported too.
+    """
+    cost_index = FACT_COLUMNS.index("cost_id")
+    totals = ledger_totals(tenant_id, start, end)
+    fixed = fixed_costs(db.session, {key[cost_index] for key in totals} - {None})
+    expected = {key + (fixed.get(key[cost_index]),): total for key, total in totals.items()}
+    actual = table_totals(tenant_id, start, end)
+
+    mismatches = []
+    for key in sorted(set(expected) | set(actual), key=str):
+        amount, count = expected.get(key, (0.0, 0))
+        table_amount, table_count = actual.get(key, (0.0, 0))
+        if abs(amount - table_amount) > 1e-6 or count != table_count:
+            mismatches.append((key, (amount, count), (table_amount, table_count)))
+    return mismatches
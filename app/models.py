@@ -1,37 +1,62 @@
 import datetime
+from collections import namedtuple
 
-from flask import session, abort
+from flask import abort, current_app, g, has_request_context, session
 from flask_login import AnonymousUserMixin, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
-from sqlalchemy import Column, Float, Integer, String, ForeignKey, Boolean, CheckConstraint
+from sqlalchemy import Column, Float, Integer, String, ForeignKey, Boolean, CheckConstraint, Index
+from sqlalchemy import UniqueConstraint
+from sqlalchemy import event
 from sqlalchemy.types import Date
 from sqlalchemy.exc import SQLAlchemyError
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import joinedload, relationship, selectinload, with_loader_criteria
 from sqlalchemy.ext.declarative import declared_attr
 from sqlalchemy.sql import func
 
 
-from . import db, login_manager
+from . import cache, db, login_manager
+
+
+def tenant_membership():
+    """Tenants the current user may select, resolved once per request."""
+    user = current_user._get_current_object()
+    membership = g.get("tenant_membership")
+    if membership is None or membership[0] is not user:
+        membership = (user, frozenset(tenant.id for tenant in user.tenants))
+        g.tenant_membership = membership
+    return membership[1]
+
+
+def current_tenant():
+    """Tenant of the current session, aborts with 403 if the user is not a member."""
+    tenant_id = session.get("tenant")
+    if tenant_id in tenant_membership():
+        return tenant_id
+    abort(403)
 
 
 class DictMixIn:
     id = Column(Integer, primary_key=True, index=True)
     createdAt = Column(Date, default=datetime.datetime.now)
-    updatedAt = Column(Date, default=datetime.datetime.now)
+    updatedAt = Column(Date, default=datetime.datetime.now, onupdate=datetime.datetime.now)
 
     @classmethod
     def query(cls):
-        if session.get("tenant") in [tenant.id for tenant in current_user.tenants]:
-            return db.session.query(cls).filter_by(tenant_id=session.get("tenant"))
-        abort(403)
+        return db.session.query(cls).filter_by(tenant_id=current_tenant())
 
     @classmethod
     def query_sum(cls):
-        if session.get("tenant") in [tenant.id for tenant in current_user.tenants]:
-            return db.session.query(func.coalesce(func.sum(cls.amount), 0)).filter_by(
-                tenant_id=session.get("tenant")
-            )
-        abort(403)
+        return db.session.query(func.coalesce(func.sum(cls.amount), 0)).filter_by(
+            tenant_id=current_tenant()
+        )
+
+    @classmethod
+    def query_sum_by(cls, *columns):
+        return (
+            db.session.query(*columns, func.coalesce(func.sum(cls.amount), 0))
+            .filter(cls.tenant_id == current_tenant())
+            .group_by(*columns)
+        )
 
     def to_dict(self):
         return {
@@ -48,6 +73,33 @@ class TenantMix:
         return Column(Integer, ForeignKey("tenants.id"), nullable=False)
 
 
+@event.listens_for(db.session, "do_orm_execute")
+def filter_tenant(orm_execute_state):
+    """Limit the ORM selects of a logged in request to the rows of the session's tenant.
+
+    Also applies to relationship loads, a tenant the user is not a member of
+    matches no row.
+    """
+    mappers = orm_execute_state.all_mappers
+    if (
+        not orm_execute_state.is_select
+        or orm_execute_state.is_column_load
+        or not has_request_context()
+        or session.get("tenant") is None
+        # users and memberships, the user loader runs before current_user exists
+        or (mappers and not any(issubclass(mapper.class_, TenantMix) for mapper in mappers))
+        or not current_user.is_authenticated
+    ):
+        return
+
+    tenant_id = session["tenant"] if session["tenant"] in tenant_membership() else None
+    orm_execute_state.statement = orm_execute_state.statement.options(
+        with_loader_criteria(
+            TenantMix, lambda cls: cls.tenant_id == tenant_id, include_aliases=True
+        )
+    )
+
+
 class UserMix:
     @declared_attr
     def user_id(cls):
@@ -251,6 +303,8 @@ class TenantUsers(db.Model, DictMixIn):
     tenant = relationship("Tenants", back_populates="users")
     user = relationship("User", back_populates="tenants")
 
+    __table_args__ = (Index("ix_tenant_users_user", "user_id"),)
+
     def __repr__(self):
         return f"<TenantUsers {self.tenant.name!r},{self.user.name!r}>"
 
@@ -266,11 +320,78 @@ class AnonymousUser(AnonymousUserMixin):
 login_manager.anonymous_user = AnonymousUser
 
 
+Membership = namedtuple("Membership", "id tenant")
+TenantRef = namedtuple("TenantRef", "id name")
+
+
+class Principal:
+    """What the views and templates read from ``current_user``, detached from the session.
+
+    Cached by ``load_user`` until a user, role or tenant membership changes.
+    """
+
+    is_authenticated = True
+    is_active = True
+    is_anonymous = False
+
+    def __init__(self, user):
+        self.id = user.id
+        self.name = user.name
+        self.email = user.email
+        self.permissions = user.role.permissions if user.role is not None else None
+        self.tenants = [
+            Membership(membership.id, TenantRef(membership.tenant.id, membership.tenant.name))
+            for membership in user.tenants
+        ]
+
+    def get_id(self):
+        return self.id
+
+    def can(self, perm):
+        return self.permissions is not None and self.permissions & perm == perm
+
+    def is_administrator(self):
+        return self.can(Permission.ADMIN)
+
+    def __repr__(self):
+        return f"<Principal {self.name!r}>"
+
+
+def load_principal(user_id):
+    # the sidebar renders every tenant of the user and the admin links
+    user = (
+        db.session.query(User)
+        .options(selectinload(User.tenants).joinedload(TenantUsers.tenant), joinedload(User.role))
+        .filter(User.id == int(user_id))
+        .first()
+    )
+    return Principal(user) if user is not None else None
+
+
 @login_manager.user_loader
 def load_user(user_id):
-    # since the user_id is just the primary key of our user table, use it in the query for the user
-    user = db.session.query(User).get(int(user_id))
-    return user
+    key = f"principal:{cache.version('principals')}:{user_id}"
+    return cache.cached(
+        key, lambda: load_principal(user_id), current_app.config["PRINCIPAL_CACHE_TIMEOUT"]
+    )
+
+
+@event.listens_for(db.session, "after_flush")
+def principals_changed(session, flush_context):
+    changed = session.new | session.dirty | session.deleted
+    if any(isinstance(instance, (User, Role, Tenants, TenantUsers)) for instance in changed):
+        session.info["principals_changed"] = True
+
+
+@event.listens_for(db.session, "after_commit")
+def invalidate_principals(session):
+    if session.info.pop("principals_changed", False):
+        cache.bump("principals")
+
+
+@event.listens_for(db.session, "after_rollback")
+def discard_principals_changes(session):
+    session.info.pop("principals_changed", None)
 
 
 class Companies(db.Model, DictMixIn, TenantMix):
@@ -288,6 +409,8 @@ class Companies(db.Model, DictMixIn, TenantMix):
     payments = relationship("Payments", back_populates="company")
     reconciliations = relationship("Reconciliations", back_populates="company")
 
+    __table_args__ = (Index("ix_companies_tenant", "tenant_id"),)
+
     def __init__(self, name=None, email=None, phone=None, customer=True, supplier=False):
         self.tenant_id = int(session["tenant"])
         self.name = name
@@ -328,6 +451,13 @@ class Sales(db.Model, DictMixIn, TenantMix):
     paymentmethod = relationship("PaymentMethod", back_populates="sales")
     company = relationship("Companies", back_populates="sales")
 
+    __table_args__ = (
+        Index("ix_sales_tenant_date", "tenant_id", "date"),
+        Index(
+            "ix_sales_tenant_company_paymentmethod", "tenant_id", "company_id", "paymentmethod_id"
+        ),
+    )
+
     def __init__(
         self,
         # categorie_id=None,
@@ -410,6 +540,8 @@ class CostsDef(db.Model, DictMixIn, TenantMix):
 
     reconciliations = relationship("Reconciliations", back_populates="cost")
 
+    __table_args__ = (Index("ix_costsdef_tenant", "tenant_id"),)
+
     def __init__(self, name=None, fixed=False):
         self.tenant_id = int(session["tenant"])
         self.name = name
@@ -436,6 +568,13 @@ class CostsMapping(db.Model, DictMixIn, TenantMix):
     costsdef = relationship("CostsDef", back_populates="costsmappings")
     paymentmethod = relationship("PaymentMethod", back_populates="costsmappings")
 
+    __table_args__ = (
+        Index("ix_costsmapping_tenant_date", "tenant_id", "date"),
+        Index(
+            "ix_costsmapping_tenant_cost_paymentmethod", "tenant_id", "cost_id", "paymentmethod_id"
+        ),
+    )
+
     def __init__(
         self,
         cost_id=cost_id,
@@ -476,6 +615,16 @@ class Purchasing(db.Model, DictMixIn, TenantMix):
     paymentmethod = relationship("PaymentMethod", back_populates="purchasings")
     company = relationship("Companies", back_populates="purchasings")
 
+    __table_args__ = (
+        Index("ix_purchasing_tenant_date", "tenant_id", "date"),
+        Index(
+            "ix_purchasing_tenant_company_paymentmethod",
+            "tenant_id",
+            "company_id",
+            "paymentmethod_id",
+        ),
+    )
+
     def __init__(
         self,
         paymentmethod_id=paymentmethod_id,
@@ -517,6 +666,16 @@ class Recovers(db.Model, DictMixIn, TenantMix):
     paymentmethod = relationship("PaymentMethod", back_populates="recovers")
     company = relationship("Companies", back_populates="recovers")
 
+    __table_args__ = (
+        Index("ix_recovers_tenant_date", "tenant_id", "date"),
+        Index(
+            "ix_recovers_tenant_company_paymentmethod",
+            "tenant_id",
+            "company_id",
+            "paymentmethod_id",
+        ),
+    )
+
     def __init__(
         self,
         # categorie_id=None,
@@ -560,6 +719,9 @@ class Reconciliations(db.Model, DictMixIn, TenantMix):
     paymentmethod = relationship("PaymentMethod", back_populates="reconciliations")
     company = relationship("Companies", back_populates="reconciliations")
     cost = relationship("CostsDef", back_populates="reconciliations")
+    items = relationship(
+        "ReconciliationItems", back_populates="reconciliation", cascade="all, delete-orphan"
+    )
 
     # table level CHECK constraint.  'name' is optional.
 
@@ -568,6 +730,26 @@ class Reconciliations(db.Model, DictMixIn, TenantMix):
             "(company_id  is null or cost_id is null) and not (company_id is null and cost_id is null)",
             name="only_one_value",
         ),
+        Index("ix_reconciliations_tenant_date", "tenant_id", "date"),
+        Index(
+            "ix_reconciliations_tenant_cashing_paymentmethod_date",
+            "tenant_id",
+            "cashing",
+            "paymentmethod_id",
+            "date",
+        ),
+        Index(
+            "ix_reconciliations_tenant_company_paymentmethod",
+            "tenant_id",
+            "company_id",
+            "paymentmethod_id",
+        ),
+        Index(
+            "ix_reconciliations_tenant_cost_paymentmethod",
+            "tenant_id",
+            "cost_id",
+            "paymentmethod_id",
+        ),
     )
 
     def __init__(
@@ -594,6 +776,34 @@ class Reconciliations(db.Model, DictMixIn, TenantMix):
         return f"<Reconciliations {self.id!r}>"
 
 
+class ReconciliationItems(db.Model, DictMixIn, TenantMix):
+    """Ledger row settled by a reconciliation booked from a bank statement.
+
+    ``kind`` names the ledger as in ``balances.LEDGERS``, a row is settled once.
+    """
+
+    __tablename__ = "reconciliation_items"
+
+    reconciliation_id = Column(Integer, ForeignKey("reconciliations.id"), nullable=False)
+    kind = Column(String(30), nullable=False)
+    item_id = Column(Integer, nullable=False)
+
+    reconciliation = relationship("Reconciliations", back_populates="items")
+
+    __table_args__ = (
+        UniqueConstraint("tenant_id", "kind", "item_id", name="uq_reconciliation_items_item"),
+        Index("ix_reconciliation_items_reconciliation", "reconciliation_id"),
+    )
+
+    def __init__(self, kind=None, item_id=None):
+        self.tenant_id = int(session["tenant"])
+        self.kind = kind
+        self.item_id = item_id
+
+    def __repr__(self):
+        return f"<ReconciliationItems {self.kind!r} {self.item_id!r}>"
+
+
 class Stocks(db.Model, DictMixIn, TenantMix):
     __tablename__ = "stocks"
 
@@ -601,6 +811,8 @@ class Stocks(db.Model, DictMixIn, TenantMix):
     date = Column(Date, default=datetime.datetime.now)
     comment = Column(String(50), nullable=False)
 
+    __table_args__ = (Index("ix_stocks_tenant_date", "tenant_id", "date"),)
+
     def __init__(
         self,
         amount=0.0,
@@ -646,6 +858,14 @@ class Payments(db.Model, DictMixIn, TenantMix):
             "(company_id  is null or cost_id is null) and not (company_id is null and cost_id is null)",
             name="only_one_value",
         ),
+        Index("ix_payments_tenant_date", "tenant_id", "date"),
+        Index(
+            "ix_payments_tenant_company_paymentmethod",
+            "tenant_id",
+            "company_id",
+            "paymentmethod_id",
+        ),
+        Index("ix_payments_tenant_cost_paymentmethod", "tenant_id", "cost_id", "paymentmethod_id"),
     )
 
     def __init__(
@@ -672,3 +892,114 @@ class Payments(db.Model, DictMixIn, TenantMix):
 
     def __repr__(self):
         return f"<Payments {self.id}>"
+
+
+class Balances(db.Model, DictMixIn, TenantMix):
+    """Running total of one ledger per company/cost, payment method and cashing.
+
+    Maintained by the flush listener in ``balances.py``, rebuild it with
+    ``flask balances rebuild``.
+    """
+
+    __tablename__ = "balances"
+
+    kind = Column(String(30), nullable=False)
+    company_id = Column(Integer, ForeignKey("companies.id"))
+    cost_id = Column(Integer, ForeignKey("costsdef.id"))
+    paymentmethod_id = Column(Integer, ForeignKey("paymentmethod.id"))
+    cashing = Column(Boolean)
+
+    amount = Column(Float, default=0.0)
+    count = Column(Integer, default=0)
+
+    __table_args__ = (
+        Index(
+            "ix_balances_key",
+            "tenant_id",
+            "kind",
+            "company_id",
+            "cost_id",
+            "paymentmethod_id",
+            "cashing",
+        ),
+    )
+
+    def __repr__(self):
+        return f"<Balances {self.kind!r} {self.amount!r}>"
+
+
+class DailyFacts(db.Model, DictMixIn, TenantMix):
+    """Daily total of one ledger per company/cost, payment method, cashing and fixed cost.
+
+    Maintained by the flush listener in ``facts.py``, rebuild it with
+    ``flask facts rebuild``.
+    """
+
+    __tablename__ = "daily_facts"
+
+    date = Column(Date, nullable=False)
+    ledger = Column(String(30), nullable=False)
+    company_id = Column(Integer, ForeignKey("companies.id"))
+    cost_id = Column(Integer, ForeignKey("costsdef.id"))
+    paymentmethod_id = Column(Integer, ForeignKey("paymentmethod.id"))
+    cashing = Column(Boolean)
+    fixed = Column(Boolean)
+
+    amount = Column(Float, default=0.0)
+    count = Column(Integer, default=0)
+
+    __table_args__ = (
+        Index(
+            "ix_daily_facts_key",
+            "tenant_id",
+            "ledger",
+            "date",
+            "company_id",
+            "cost_id",
+            "paymentmethod_id",
+            "cashing",
+            "fixed",
+            "amount",
+        ),
+        Index("ix_daily_facts_tenant_cost", "tenant_id", "cost_id"),
+    )
+
+    def __repr__(self):
+        return f"<DailyFacts {self.ledger!r} {self.date!r} {self.amount!r}>"
+
+
+class PeriodCloses(db.Model, DictMixIn, TenantMix):
+    """Month closed by ``flask periods close``, its ledger rows can no longer change."""
+
+    __tablename__ = "period_closes"
+
+    date = Column(Date, nullable=False)
+
+    __table_args__ = (Index("ix_period_closes_tenant_date", "tenant_id", "date"),)
+
+    def __repr__(self):
+        return f"<PeriodCloses {self.date!r}>"
+
+
+class ClosingBalances(db.Model, DictMixIn, TenantMix):
+    """Balance of one ledger key at the end of a closed period, keyed like ``Balances``.
+
+    The ``stocks`` kind holds the last stock count of the period.
+    """
+
+    __tablename__ = "closing_balances"
+
+    date = Column(Date, nullable=False)
+    kind = Column(String(30), nullable=False)
+    company_id = Column(Integer, ForeignKey("companies.id"))
+    cost_id = Column(Integer, ForeignKey("costsdef.id"))
+    paymentmethod_id = Column(Integer, ForeignKey("paymentmethod.id"))
+    cashing = Column(Boolean)
+
+    amount = Column(Float, default=0.0)
+    count = Column(Integer, default=0)
+
+    __table_args__ = (Index("ix_closing_balances_tenant_date", "tenant_id", "date"),)
+
+    def __repr__(self):
+        return f"<ClosingBalances {self.date!r} {self.kind!r} {self.amount!r}>"
@@ -1,18 +1,39 @@
 import datetime
 from flask import request, render_template, flash, redirect, url_for
 from flask_login import login_required
-from sqlalchemy import desc
 from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import joinedload, raiseload
 from . import payments as bp
 from .. import db
+from ..closing import ClosedPeriodError
 from ..models import Payments, Companies, PaymentMethod, CostsDef
+from ..utilities.decorators import invalidate_tenant_cache
+from ..utilities.export import stream_export
+from ..utilities.pagination import paginate
 from ..utilities.utils2 import toDate, compare
 
-
-@bp.route("/", methods=["GET"])
-@login_required
-def index_purchasings():
-
+EXPORT_PURCHASINGS_COLUMNS = [
+    ("Date", "date"),
+    ("Fournisseur", "company.name"),
+    ("Mode de paiement", "paymentmethod.name"),
+    ("Montant", "amount"),
+    ("Commentaire", "comment"),
+    ("Document", "document_number"),
+    ("Echeance", "due_date"),
+]
+EXPORT_COSTS_COLUMNS = [
+    ("Date", "date"),
+    ("Charge", "costsdef.name"),
+    ("Mode de paiement", "paymentmethod.name"),
+    ("Montant", "amount"),
+    ("Commentaire", "comment"),
+    ("Document", "document_number"),
+    ("Echeance", "due_date"),
+]
+
+
+def search_purchasings():
+    """The supplier payments matching the ``s_*`` request arguments, and those arguments."""
     s_company = request.args.get("s_company", type=int, default=0)
     s_paymentmethod = request.args.get("s_paymentmethod", type=int, default=0)
     s_op = request.args.get("s_op", type=str, default="")
@@ -20,7 +41,11 @@ def index_purchasings():
     s_start_date = request.args.get("s_start_date", type=toDate, default="")
     s_end_date = request.args.get("s_end_date", type=toDate, default="")
 
-    query = Payments.query().filter(Payments.company_id.isnot(None))
+    query = (
+        Payments.query()
+        .options(joinedload(Payments.company), joinedload(Payments.paymentmethod))
+        .filter(Payments.company_id.isnot(None))
+    )
 
     if s_company > 0:
         query = query.filter(Payments.company_id == s_company)
@@ -37,7 +62,22 @@ def index_purchasings():
     if s_end_date:
         query = query.filter(Payments.date <= s_end_date)
 
-    payments = query.order_by(desc(Payments.date)).all()
+    return query, dict(
+        s_company=s_company,
+        s_paymentmethod=s_paymentmethod,
+        s_op=s_op,
+        s_amount=s_amount,
+        s_start_date=s_start_date,
+        s_end_date=s_end_date,
+    )
+
+
+@bp.route("/", methods=["GET"])
+@login_required
+def index_purchasings():
+
+    query, filters = search_purchasings()
+    page = paginate(query, Payments)
 
     suppliers = Companies.query().filter_by(supplier=True).all()
 
@@ -45,22 +85,25 @@ def index_purchasings():
 
     return render_template(
         "/payments/index.html",
-        payments=payments,
+        payments=page.items,
+        page=page,
         paymentmethod=paymentmethod,
         suppliers=suppliers,
-        s_company=s_company,
-        s_paymentmethod=s_paymentmethod,
-        s_op=s_op,
-        s_amount=s_amount,
-        s_start_date=s_start_date,
-        s_end_date=s_end_date,
+        **filters,
     )
 
 
-@bp.route("/costs", methods=["GET"])
+@bp.route("/export.<format>", methods=["GET"])
 @login_required
-def index_costs():
+def export_purchasings(format):
+    query, _ = search_purchasings()
+    return stream_export(
+        query, Payments, EXPORT_PURCHASINGS_COLUMNS, "paiements-fournisseurs", format
+    )
+
 
+def search_costs():
+    """The cost payments matching the ``s_*`` request arguments, and those arguments."""
     s_company = request.args.get("s_company", type=int, default=0)
     s_paymentmethod = request.args.get("s_paymentmethod", type=int, default=0)
     s_op = request.args.get("s_op", type=str, default="")
@@ -68,7 +111,11 @@ def index_costs():
     s_start_date = request.args.get("s_start_date", type=toDate, default="")
     s_end_date = request.args.get("s_end_date", type=toDate, default="")
 
-    query = Payments.query().filter(Payments.cost_id.isnot(None))
+    query = (
+        Payments.query()
+        .options(joinedload(Payments.costsdef), joinedload(Payments.paymentmethod))
+        .filter(Payments.cost_id.isnot(None))
+    )
 
     if s_company > 0:
         query = query.filter(Payments.cost_id == s_company)
@@ -85,26 +132,45 @@ def index_costs():
     if s_end_date:
         query = query.filter(Payments.date <= s_end_date)
 
-    payments = query.order_by(desc(Payments.date)).all()
+    return query, dict(
+        s_company=s_company,
+        s_paymentmethod=s_paymentmethod,
+        s_op=s_op,
+        s_amount=s_amount,
+        s_start_date=s_start_date,
+        s_end_date=s_end_date,
+    )
+
+
+@bp.route("/costs", methods=["GET"])
+@login_required
+def index_costs():
+
+    query, filters = search_costs()
+    page = paginate(query, Payments)
     paymentmethod = db.session.query(PaymentMethod).filter(PaymentMethod.id.notin_([7])).all()
     cost_defs = CostsDef.query().all()
 
     return render_template(
         "/payments/costs.html",
-        payments=payments,
+        payments=page.items,
+        page=page,
         paymentmethod=paymentmethod,
         cost_defs=cost_defs,
-        s_company=s_company,
-        s_paymentmethod=s_paymentmethod,
-        s_op=s_op,
-        s_amount=s_amount,
-        s_start_date=s_start_date,
-        s_end_date=s_end_date,
+        **filters,
     )
 
 
+@bp.route("/costs/export.<format>", methods=["GET"])
+@login_required
+def export_costs(format):
+    query, _ = search_costs()
+    return stream_export(query, Payments, EXPORT_COSTS_COLUMNS, "paiements-charges", format)
+
+
 @bp.route("/", methods=["POST"])
 @login_required
+@invalidate_tenant_cache
 def add_payments():
     # categorie_id = request.form.get("categorie_id", type=int)
     payment_id = request.form.get("payment_id", type=int)
@@ -136,6 +202,9 @@ def add_payments():
         db.session.add(new_payment)
         db.session.commit()
         # upload_file(new_payment) # TODO: upload
+    except ClosedPeriodError as e:
+        db.session.rollback()
+        flash(str(e), category="warning")
     except SQLAlchemyError as e:
         print(e)
         db.session.rollback()
@@ -155,7 +224,12 @@ def add_payments():
 @login_required
 def get_payment_purchasing_by_id(id):
 
-    payment = Payments.query().filter(Payments.id == id, Payments.company_id.isnot(None)).first()
+    payment = (
+        Payments.query()
+        .options(raiseload("*"))
+        .filter(Payments.id == id, Payments.company_id.isnot(None))
+        .first()
+    )
 
     if not payment:
         flash("Le paiement n'exist pas !!!", category="warning")
@@ -174,6 +248,7 @@ def get_payment_purchasing_by_id(id):
 
 @bp.route("/purchasings/<int:id>", methods=["POST"])
 @login_required
+@invalidate_tenant_cache
 def update_payment_purchasing(id):
 
     payment = Payments.query().filter(Payments.id == id, Payments.company_id.isnot(None)).first()
@@ -205,6 +280,10 @@ def update_payment_purchasing(id):
         db.session.commit()
         # upload_file(sale) #TODO: uplaod file
 
+    except ClosedPeriodError as e:
+        db.session.rollback()
+        flash(str(e), category="warning")
+
     except SQLAlchemyError as e:
         print(e)
         db.session.rollback()
@@ -218,6 +297,7 @@ def update_payment_purchasing(id):
 
 @bp.route("/purchasings/remove/<int:id>", methods=["POST"])
 @login_required
+@invalidate_tenant_cache
 def remove_payment_purchasings(id):
 
     payment = (
@@ -235,6 +315,10 @@ def remove_payment_purchasings(id):
         db.session.commit()
         flash("Paiement supprimer !!!", category="success")
 
+    except ClosedPeriodError as e:
+        db.session.rollback()
+        flash(str(e), category="warning")
+
     except SQLAlchemyError as e:
         print(e)
         db.session.rollback()
@@ -248,7 +332,12 @@ def remove_payment_purchasings(id):
 @login_required
 def get_payment_costs_by_id(id):
 
-    payment = Payments.query().filter(Payments.id == id, Payments.cost_id.isnot(None)).first()
+    payment = (
+        Payments.query()
+        .options(raiseload("*"))
+        .filter(Payments.id == id, Payments.cost_id.isnot(None))
+        .first()
+    )
 
     if not payment:
         flash("Le paiement n'exist pas !!!", category="warning")
@@ -267,6 +356,7 @@ def get_payment_costs_by_id(id):
 
 @bp.route("/costs/<int:id>", methods=["POST"])
 @login_required
+@invalidate_tenant_cache
 def update_payment_cost(id):
 
     payment = Payments.query().filter(Payments.id == id, Payments.cost_id.isnot(None)).first()
@@ -298,6 +388,10 @@ def update_payment_cost(id):
         db.session.commit()
         # upload_file(sale) #TODO: uplaod file
 
+    except ClosedPeriodError as e:
+        db.session.rollback()
+        flash(str(e), category="warning")
+
     except SQLAlchemyError as e:
         print(e)
         db.session.rollback()
@@ -311,6 +405,7 @@ def update_payment_cost(id):
 
 @bp.route("/costs/remove/<int:id>", methods=["POST"])
 @login_required
+@invalidate_tenant_cache
 def remove_payment_cost(id):
 
     payment = Payments.query().filter(Payments.id == id, Payments.cost_id.isnot(None)).first()
@@ -324,6 +419,10 @@ def remove_payment_cost(id):
         db.session.commit()
         flash("Paiement supprimer !!!", category="success")
 
+    except ClosedPeriodError as e:
+        db.session.rollback()
+        flash(str(e), category="warning")
+
     except SQLAlchemyError as e:
         print(e)
         db.session.rollback()
@@ -1,18 +1,32 @@
 import datetime
 from flask import request, render_template, flash, redirect, url_for
 from flask_login import login_required
-from sqlalchemy import desc
 from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import joinedload, raiseload
 from . import purchasings as bp
 from .. import db
+from ..closing import ClosedPeriodError
 from ..models import Purchasing, Companies, PaymentMethod, SalesCategories
+from ..utilities.decorators import invalidate_tenant_cache
+from ..utilities.export import stream_export
+from ..utilities.imports import import_ledger, lookup
+from ..utilities.pagination import paginate
 from ..utilities.utils2 import toDate, compare
 
+EXPORT_COLUMNS = [
+    ("Date", "date"),
+    ("Fournisseur", "company.name"),
+    ("Mode de paiement", "paymentmethod.name"),
+    ("Montant", "amount"),
+    ("Commentaire", "comment"),
+    ("Document", "document_number"),
+    ("Echeance", "due_date"),
+    ("Mois", "month_for"),
+]
 
-@bp.route("/", methods=["GET"])
-@login_required
-def index():
 
+def search():
+    """The purchasings matching the ``s_*`` request arguments, and those arguments."""
     s_company = request.args.get("s_company", type=int, default=0)
     s_paymentmethod = request.args.get("s_paymentmethod", type=int, default=0)
     s_op = request.args.get("s_op", type=str, default="")
@@ -20,7 +34,9 @@ def index():
     s_start_date = request.args.get("s_start_date", type=toDate, default="")
     s_end_date = request.args.get("s_end_date", type=toDate, default="")
 
-    query = Purchasing.query()
+    query = Purchasing.query().options(
+        joinedload(Purchasing.company), joinedload(Purchasing.paymentmethod)
+    )
 
     if s_company > 0:
         query = query.filter(Purchasing.company_id == s_company)
@@ -37,7 +53,22 @@ def index():
     if s_end_date:
         query = query.filter(Purchasing.date <= s_end_date)
 
-    purchasings = query.order_by(desc(Purchasing.date)).all()
+    return query, dict(
+        s_company=s_company,
+        s_paymentmethod=s_paymentmethod,
+        s_op=s_op,
+        s_amount=s_amount,
+        s_start_date=s_start_date,
+        s_end_date=s_end_date,
+    )
+
+
+@bp.route("/", methods=["GET"])
+@login_required
+def index():
+
+    query, filters = search()
+    page = paginate(query, Purchasing)
 
     companies = Companies.query().filter_by(supplier=True).all()
     salescategories = SalesCategories.query().all()
@@ -45,21 +76,44 @@ def index():
 
     return render_template(
         "/purchasings/index.html",
-        purchasings=purchasings,
+        purchasings=page.items,
+        page=page,
         companies=companies,
         salescategories=salescategories,
         paymentmethod=paymentmethod,
-        s_company=s_company,
-        s_paymentmethod=s_paymentmethod,
-        s_op=s_op,
-        s_amount=s_amount,
-        s_start_date=s_start_date,
-        s_end_date=s_end_date,
+        **filters,
     )
 
 
+@bp.route("/export.<format>", methods=["GET"])
+@login_required
+def export(format):
+    query, _ = search()
+    return stream_export(query, Purchasing, EXPORT_COLUMNS, "achats", format)
+
+
+@bp.route("/import", methods=["POST"])
+@login_required
+@invalidate_tenant_cache
+def import_csv():
+    file = request.files.get("file")
+    if not file:
+        flash("Aucun fichier", category="warning")
+        return redirect(url_for(".index"))
+
+    parties = Companies.query().filter_by(supplier=True).with_entities(Companies.id, Companies.name)
+    paymentmethods = db.session.query(PaymentMethod.id, PaymentMethod.name).filter(
+        PaymentMethod.id.notin_([7])
+    )
+    report = import_ledger(
+        file, Purchasing, "Fournisseur", "company_id", lookup(parties), lookup(paymentmethods)
+    )
+    return render_template("import.html", report=report, ledger="Achats", back=url_for(".index"))
+
+
 @bp.route("/", methods=["POST"])
 @login_required
+@invalidate_tenant_cache
 def add_purchasings():
 
     payment_id = request.form.get("payment_id", type=int)
@@ -87,6 +141,9 @@ def add_purchasings():
         db.session.add(new_purchasing)
         db.session.commit()
         # upload_file(new_purchasing) # TODO: upload
+    except ClosedPeriodError as e:
+        db.session.rollback()
+        flash(str(e), category="warning")
     except SQLAlchemyError as e:
         print(e)
         db.session.rollback()
@@ -102,7 +159,7 @@ def add_purchasings():
 @login_required
 def get_purchasings_by_id(id):
 
-    purchasing = Purchasing.query().filter(Purchasing.id == id).first()
+    purchasing = Purchasing.query().options(raiseload("*")).filter(Purchasing.id == id).first()
 
     if not purchasing:
         flash("Achat n'exist pas !!!", category="warning")
@@ -123,6 +180,7 @@ def get_purchasings_by_id(id):
 
 @bp.route("/<int:id>", methods=["POST"])
 @login_required
+@invalidate_tenant_cache
 def update_purchasings(id):
 
     purchasing = Purchasing.query().filter(Purchasing.id == id).first()
@@ -154,6 +212,10 @@ def update_purchasings(id):
         db.session.commit()
         # upload_file(purchasing)# TODO: upload
 
+    except ClosedPeriodError as e:
+        db.session.rollback()
+        flash(str(e), category="warning")
+
     except SQLAlchemyError as e:
         print(e)
         db.session.rollback()
@@ -167,6 +229,7 @@ def update_purchasings(id):
 
 @bp.route("/remove/<int:id>", methods=["POST"])
 @login_required
+@invalidate_tenant_cache
 def remove_purchasings(id):
 
     purchasing = Purchasing.query().filter(Purchasing.id == id).first()
@@ -180,6 +243,10 @@ def remove_purchasings(id):
         db.session.commit()
         flash("Achat supprimer !!!", category="success")
 
+    except ClosedPeriodError as e:
+        db.session.rollback()
+        flash(str(e), category="warning")
+
     except SQLAlchemyError as e:
         print(e)
         db.session.rollback()
@@ -1,18 +1,31 @@
 import datetime
-from flask import request, render_template, flash, redirect, url_for
+from flask import current_app, request, render_template, flash, redirect, url_for
 from flask_login import login_required
-from sqlalchemy import desc
 from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import joinedload
 from . import reconciliations as bp
 from .. import db
+from ..closing import ClosedPeriodError
 from ..models import CostsDef, Reconciliations, Companies, PaymentMethod
+from ..utilities.decorators import invalidate_tenant_cache
+from ..utilities.export import stream_export
+from ..utilities.pagination import paginate
+from ..utilities.statements import parse_statement, propose, reconcile
 from ..utilities.utils2 import toDate, compare
 
+EXPORT_COLUMNS = [
+    ("Date", "date"),
+    ("Encaissement", "cashing"),
+    ("Tiers", "company.name"),
+    ("Charge", "cost.name"),
+    ("Mode de paiement", "paymentmethod.name"),
+    ("Montant", "amount"),
+    ("Commentaire", "comment"),
+]
 
-@bp.route("/", methods=["GET"])
-@login_required
-def index():
 
+def search():
+    """The reconciliations matching the ``s_*`` request arguments, and those arguments."""
     s_categorie = request.args.get("s_categorie", type=int, default=0)
     s_type = request.args.get("s_type", type=int, default=0)
 
@@ -24,7 +37,11 @@ def index():
     s_start_date = request.args.get("s_start_date", type=toDate, default="")
     s_end_date = request.args.get("s_end_date", type=toDate, default="")
 
-    query = Reconciliations.query()
+    query = Reconciliations.query().options(
+        joinedload(Reconciliations.company),
+        joinedload(Reconciliations.cost),
+        joinedload(Reconciliations.paymentmethod),
+    )
     if s_categorie == 1:
         query = query.join(Companies).filter(Companies.customer == True)
         if s_company > 0:
@@ -57,7 +74,25 @@ def index():
     if s_end_date:
         query = query.filter(Reconciliations.date <= s_end_date)
 
-    reconciliations = query.order_by(desc(Reconciliations.date)).all()
+    return query, dict(
+        s_categorie=s_categorie,
+        s_type=s_type,
+        s_company=s_company,
+        s_costdef=s_costdef,
+        s_paymentmethod=s_paymentmethod,
+        s_op=s_op,
+        s_amount=s_amount,
+        s_start_date=s_start_date,
+        s_end_date=s_end_date,
+    )
+
+
+@bp.route("/", methods=["GET"])
+@login_required
+def index():
+
+    query, filters = search()
+    page = paginate(query, Reconciliations)
 
     companies = Companies.query().all()
     paymentmethod = db.session.query(PaymentMethod).filter(PaymentMethod.id.notin_([4])).all()
@@ -65,24 +100,88 @@ def index():
 
     return render_template(
         "/reconciliations/index.html",
-        reconciliations=reconciliations,
+        reconciliations=page.items,
+        page=page,
         paymentmethod=paymentmethod,
         companies=companies,
         cosdefs=cosdefs,
-        s_categorie=s_categorie,
-        s_type=s_type,
-        s_company=s_company,
-        s_costdef=s_costdef,
-        s_paymentmethod=s_paymentmethod,
-        s_op=s_op,
-        s_amount=s_amount,
-        s_start_date=s_start_date,
-        s_end_date=s_end_date,
+        **filters,
     )
 
 
+@bp.route("/export.<format>", methods=["GET"])
+@login_required
+def export(format):
+    query, _ = search()
+    return stream_export(query, Reconciliations, EXPORT_COLUMNS, "rapprochements", format)
+
+
+@bp.route("/statement", methods=["POST"])
+@login_required
+@db.read_only
+def import_statement():
+    file = request.files.get("file")
+    if not file:
+        flash("Aucun fichier", category="warning")
+        return redirect(url_for(".index"))
+
+    lines, errors = parse_statement(file)
+    proposals = propose(lines)
+
+    companies = dict(Companies.query().with_entities(Companies.id, Companies.name))
+    cosdefs = dict(CostsDef.query().with_entities(CostsDef.id, CostsDef.name))
+
+    return render_template(
+        "/reconciliations/statement.html",
+        proposals=proposals,
+        errors=errors,
+        companies=companies,
+        cosdefs=cosdefs,
+    )
+
+
+@bp.route("/statement/confirm", methods=["POST"])
+@login_required
+@invalidate_tenant_cache
+def confirm_statement():
+
+    lines, invalid = [], 0
+    for line in request.form.getlist("line", type=int):
+        item_id = request.form.get(f"item-{line}", type=int)
+        date = request.form.get(f"date-{line}", type=toDate)
+        if item_id is None or date is None:
+            invalid += 1
+            continue
+        lines.append(
+            (request.form.get(f"kind-{line}"), item_id, date, request.form.get(f"label-{line}"))
+        )
+
+    if invalid:
+        flash(f"{invalid} lignes invalides ignorées", category="warning")
+
+    reconciled = len(reconcile(lines))
+
+    try:
+        db.session.commit()
+
+    except ClosedPeriodError as e:
+        db.session.rollback()
+        flash(str(e), category="warning")
+
+    except SQLAlchemyError:
+        current_app.logger.exception("statement reconciliations not saved")
+        db.session.rollback()
+        flash("db error", category="danger")
+
+    else:
+        flash(f"{reconciled} rapprochements ajouter", category="success")
+
+    return redirect(url_for(".index"))
+
+
 @bp.route("/", methods=["POST"])
 @login_required
+@invalidate_tenant_cache
 def add_reconciliations():
 
     company_id = request.form.get("company_id", type=int)
@@ -107,6 +206,10 @@ def add_reconciliations():
         db.session.add(new_reconciliation)
         db.session.commit()
 
+    except ClosedPeriodError as e:
+        db.session.rollback()
+        flash(str(e), category="warning")
+
     except SQLAlchemyError as e:
         print(e)
         db.session.rollback()
@@ -122,7 +225,12 @@ def add_reconciliations():
 @login_required
 def get_reconciliations_by_id(id):
 
-    reconciliation = Reconciliations.query().filter(Reconciliations.id == id).first()
+    reconciliation = (
+        Reconciliations.query()
+        .options(joinedload(Reconciliations.company))
+        .filter(Reconciliations.id == id)
+        .first()
+    )
 
     if not reconciliation:
         flash("Rapprochement n'exist pas !!!", category="warning")
@@ -155,6 +263,7 @@ def get_reconciliations_by_id(id):
 
 @bp.route("/<int:id>", methods=["POST"])
 @login_required
+@invalidate_tenant_cache
 def update_reconciliations(id):
 
     reconciliation = Reconciliations.query().filter(Reconciliations.id == id).first()
@@ -183,6 +292,10 @@ def update_reconciliations(id):
         db.session.commit()
         # upload_file(reconciliation)
 
+    except ClosedPeriodError as e:
+        db.session.rollback()
+        flash(str(e), category="warning")
+
     except SQLAlchemyError as e:
         print(e)
         db.session.rollback()
@@ -196,6 +309,7 @@ def update_reconciliations(id):
 
 @bp.route("/remove/<int:id>", methods=["POST"])
 @login_required
+@invalidate_tenant_cache
 def remove_reconciliations(id):
 
     reconciliation = Reconciliations.query().filter(Reconciliations.id == id).first()
@@ -209,6 +323,10 @@ def remove_reconciliations(id):
         db.session.commit()
         flash("Rapprochement supprimer !!!", category="success")
 
+    except ClosedPeriodError as e:
+        db.session.rollback()
+        flash(str(e), category="warning")
+
     except SQLAlchemyError as e:
         print(e)
         db.session.rollback()
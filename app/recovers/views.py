@@ -1,19 +1,32 @@
 import datetime
 from flask import request, render_template, flash, redirect, url_for
 from flask_login import login_required
-from sqlalchemy import desc
 from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import joinedload, raiseload
 from . import recovers as bp
 from .. import db
+from ..closing import ClosedPeriodError
 from ..models import Recovers, Companies, PaymentMethod, SalesCategories
 from ..utilities.utils import get_sold_clients
+from ..utilities.decorators import invalidate_tenant_cache
+from ..utilities.export import stream_export
+from ..utilities.imports import import_ledger, lookup
+from ..utilities.pagination import paginate
 from ..utilities.utils2 import toDate, compare
 
+EXPORT_COLUMNS = [
+    ("Date", "date"),
+    ("Client", "company.name"),
+    ("Mode de paiement", "paymentmethod.name"),
+    ("Montant", "amount"),
+    ("Commentaire", "comment"),
+    ("Document", "document_number"),
+    ("Echeance", "due_date"),
+]
 
-@bp.route("/", methods=["GET"])
-@login_required
-def index():
 
+def search():
+    """The recovers matching the ``s_*`` request arguments, and those arguments."""
     s_company = request.args.get("s_company", type=int, default=0)
     s_paymentmethod = request.args.get("s_paymentmethod", type=int, default=0)
     s_op = request.args.get("s_op", type=str, default="")
@@ -21,7 +34,9 @@ def index():
     s_start_date = request.args.get("s_start_date", type=toDate, default="")
     s_end_date = request.args.get("s_end_date", type=toDate, default="")
 
-    query = Recovers.query()
+    query = Recovers.query().options(
+        joinedload(Recovers.company), joinedload(Recovers.paymentmethod)
+    )
 
     if s_company > 0:
         query = query.filter(Recovers.company_id == s_company)
@@ -38,7 +53,22 @@ def index():
     if s_end_date:
         query = query.filter(Recovers.date <= s_end_date)
 
-    recovers = query.order_by(desc(Recovers.date)).all()
+    return query, dict(
+        s_company=s_company,
+        s_paymentmethod=s_paymentmethod,
+        s_op=s_op,
+        s_amount=s_amount,
+        s_start_date=s_start_date,
+        s_end_date=s_end_date,
+    )
+
+
+@bp.route("/", methods=["GET"])
+@login_required
+def index():
+
+    query, filters = search()
+    page = paginate(query, Recovers)
 
     companies = Companies.query().filter_by(customer=True).all()
 
@@ -46,20 +76,45 @@ def index():
 
     return render_template(
         "/recovers/index.html",
-        recovers=recovers,
+        recovers=page.items,
+        page=page,
         paymentmethod=paymentmethod,
         companies=companies,
-        s_company=s_company,
-        s_paymentmethod=s_paymentmethod,
-        s_op=s_op,
-        s_amount=s_amount,
-        s_start_date=s_start_date,
-        s_end_date=s_end_date,
+        **filters,
+    )
+
+
+@bp.route("/export.<format>", methods=["GET"])
+@login_required
+def export(format):
+    query, _ = search()
+    return stream_export(query, Recovers, EXPORT_COLUMNS, "recouvrements", format)
+
+
+@bp.route("/import", methods=["POST"])
+@login_required
+@invalidate_tenant_cache
+def import_csv():
+    file = request.files.get("file")
+    if not file:
+        flash("Aucun fichier", category="warning")
+        return redirect(url_for(".index"))
+
+    parties = Companies.query().filter_by(customer=True).with_entities(Companies.id, Companies.name)
+    paymentmethods = db.session.query(PaymentMethod.id, PaymentMethod.name).filter(
+        PaymentMethod.id.notin_([4, 7])
+    )
+    report = import_ledger(
+        file, Recovers, "Client", "company_id", lookup(parties), lookup(paymentmethods)
+    )
+    return render_template(
+        "import.html", report=report, ledger="Recouvrements", back=url_for(".index")
     )
 
 
 @bp.route("/", methods=["POST"])
 @login_required
+@invalidate_tenant_cache
 def add_recovers():
     categorie_id = request.form.get("categorie_id", type=int)
     company_id = request.form.get("company_id", type=int)
@@ -88,6 +143,9 @@ def add_recovers():
         db.session.add(new_recover)
         db.session.commit()
         # upload_file(new_recover) # TODO: uplaod
+    except ClosedPeriodError as e:
+        db.session.rollback()
+        flash(str(e), category="warning")
     except SQLAlchemyError as e:
         print(e)
         db.session.rollback()
@@ -103,7 +161,7 @@ def add_recovers():
 @login_required
 def get_recovers_by_id(id):
 
-    recover = Recovers.query().filter(Recovers.id == id).first()
+    recover = Recovers.query().options(raiseload("*")).filter(Recovers.id == id).first()
 
     if not recover:
         flash("Recouvrement n'exist pas !!!", category="warning")
@@ -122,6 +180,7 @@ def get_recovers_by_id(id):
 
 @bp.route("/<int:id>", methods=["POST"])
 @login_required
+@invalidate_tenant_cache
 def update_recovers(id):
 
     recover = Recovers.query().filter(Recovers.id == id).first()
@@ -153,6 +212,10 @@ def update_recovers(id):
         db.session.commit()
         # upload_file(recover) # TODO: upload
 
+    except ClosedPeriodError as e:
+        db.session.rollback()
+        flash(str(e), category="warning")
+
     except SQLAlchemyError as e:
         print(e)
         db.session.rollback()
@@ -166,6 +229,7 @@ def update_recovers(id):
 
 @bp.route("/remove/<int:id>", methods=["POST"])
 @login_required
+@invalidate_tenant_cache
 def remove_recovers(id):
 
     recover = Recovers.query().filter(Recovers.id == id).first()
@@ -179,6 +243,10 @@ def remove_recovers(id):
         db.session.commit()
         flash("Recouvrement supprimer !!!", category="success")
 
+    except ClosedPeriodError as e:
+        db.session.rollback()
+        flash(str(e), category="warning")
+
     except SQLAlchemyError as e:
         print(e)
         db.session.rollback()
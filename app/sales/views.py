@@ -1,18 +1,32 @@
 import datetime
 from flask import request, render_template, flash, redirect, url_for
 from flask_login import login_required
-from sqlalchemy import desc
 from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import joinedload, raiseload
 from . import sales as bp
 from .. import db
+from ..closing import ClosedPeriodError
 from ..models import Sales, Companies, SalesCategories, PaymentMethod
+from ..utilities.decorators import invalidate_tenant_cache
+from ..utilities.export import stream_export
+from ..utilities.imports import import_ledger, lookup
+from ..utilities.pagination import paginate
 from ..utilities.utils2 import toDate, compare
 
 
-@bp.route("/", methods=["GET"])
-@login_required
-def index():
+EXPORT_COLUMNS = [
+    ("Date", "date"),
+    ("Client", "company.name"),
+    ("Mode de paiement", "paymentmethod.name"),
+    ("Montant", "amount"),
+    ("Commentaire", "comment"),
+    ("Document", "document_number"),
+    ("Echeance", "due_date"),
+]
 
+
+def search():
+    """The sales matching the ``s_*`` request arguments, and those arguments."""
     s_company = request.args.get("s_company", type=int, default=0)
     s_paymentmethod = request.args.get("s_paymentmethod", type=int, default=0)
     s_op = request.args.get("s_op", type=str, default="")
@@ -20,7 +34,7 @@ def index():
     s_start_date = request.args.get("s_start_date", type=toDate, default="")
     s_end_date = request.args.get("s_end_date", type=toDate, default="")
 
-    query = Sales.query()
+    query = Sales.query().options(joinedload(Sales.company), joinedload(Sales.paymentmethod))
 
     if s_company > 0:
         query = query.filter(Sales.company_id == s_company)
@@ -37,27 +51,67 @@ def index():
     if s_end_date:
         query = query.filter(Sales.date <= s_end_date)
 
-    sales = query.order_by(desc(Sales.date)).all()
+    return query, dict(
+        s_company=s_company,
+        s_paymentmethod=s_paymentmethod,
+        s_op=s_op,
+        s_amount=s_amount,
+        s_start_date=s_start_date,
+        s_end_date=s_end_date,
+    )
+
+
+@bp.route("/", methods=["GET"])
+@login_required
+def index():
+
+    query, filters = search()
+    page = paginate(query, Sales)
 
     companies = Companies.query().filter_by(customer=True).all()
     paymentmethod = db.session.query(PaymentMethod).filter(PaymentMethod.id.notin_([7])).all()
 
     return render_template(
         "/sales/index.html",
-        sales=sales,
+        sales=page.items,
+        page=page,
         companies=companies,
         paymentmethod=paymentmethod,
-        s_company=s_company,
-        s_paymentmethod=s_paymentmethod,
-        s_op=s_op,
-        s_amount=s_amount,
-        s_start_date=s_start_date,
-        s_end_date=s_end_date,
+        **filters,
+    )
+
+
+@bp.route("/export.<format>", methods=["GET"])
+@login_required
+def export(format):
+    query, _ = search()
+    return stream_export(query, Sales, EXPORT_COLUMNS, "ventes", format)
+
+
+@bp.route("/import", methods=["POST"])
+@login_required
+@invalidate_tenant_cache
+def import_csv():
+    file = request.files.get("file")
+    if not file:
+        flash("Aucun fichier", category="warning")
+        return redirect(url_for(".index"))
+
+    parties = Companies.query().filter_by(customer=True).with_entities(Companies.id, Companies.name)
+    paymentmethods = db.session.query(PaymentMethod.id, PaymentMethod.name).filter(
+        PaymentMethod.id.notin_([7])
+    )
+    report = import_ledger(
+        file, Sales, "Client", "company_id", lookup(parties), lookup(paymentmethods)
+    )
+    return render_template(
+        "import.html", report=report, ledger="Chiffre d'affaire", back=url_for(".index")
     )
 
 
 @bp.route("/", methods=["POST"])
 @login_required
+@invalidate_tenant_cache
 def add_sales():
 
     company_id = request.form.get("company_id", type=int)
@@ -85,6 +139,10 @@ def add_sales():
         db.session.commit()
         # upload_file(new_sale) #TODO: uplaod file
 
+    except ClosedPeriodError as e:
+        db.session.rollback()
+        flash(str(e), category="warning")
+
     except SQLAlchemyError as e:
         print(e)
         db.session.rollback()
@@ -100,7 +158,7 @@ def add_sales():
 @login_required
 def get_sale_by_id(id):
 
-    sale = Sales.query().filter(Sales.id == id).first()
+    sale = Sales.query().options(raiseload("*")).filter(Sales.id == id).first()
 
     if not sale:
         flash("Chiffre d'affaire n'exist pas !!!")
@@ -121,6 +179,7 @@ def get_sale_by_id(id):
 
 @bp.route("/<int:id>", methods=["POST"])
 @login_required
+@invalidate_tenant_cache
 def update_sales(id):
 
     sale = Sales.query().filter(Sales.id == id).first()
@@ -152,6 +211,10 @@ def update_sales(id):
         db.session.commit()
         # upload_file(sale) #TODO: uplaod file
 
+    except ClosedPeriodError as e:
+        db.session.rollback()
+        flash(str(e), category="warning")
+
     except SQLAlchemyError as e:
         print(e)
         db.session.rollback()
@@ -165,6 +228,7 @@ def update_sales(id):
 
 @bp.route("/remove/<int:id>", methods=["POST"])
 @login_required
+@invalidate_tenant_cache
 def remove_sales(id):
 
     sale = Sales.query().filter(Sales.id == id).first()
@@ -178,6 +242,10 @@ def remove_sales(id):
         db.session.commit()
         flash("Chiffre d'affaire supprimer !!!", category="success")
 
+    except ClosedPeriodError as e:
+        db.session.rollback()
+        flash(str(e), category="warning")
+
     except SQLAlchemyError as e:
         print(e)
         db.session.rollback()
@@ -1,26 +1,39 @@
 import datetime
 from flask import request, render_template, flash, redirect, url_for
 from flask_login import login_required
-from sqlalchemy import desc
 from sqlalchemy.exc import SQLAlchemyError
 from . import stocks as bp
 from .. import db
+from ..closing import ClosedPeriodError
 from ..models import Stocks
+from ..utilities.decorators import invalidate_tenant_cache
+from ..utilities.export import stream_export
+from ..utilities.pagination import paginate
+
+EXPORT_COLUMNS = [("Date", "date"), ("Montant", "amount"), ("Commentaire", "comment")]
 
 
 @bp.route("/", methods=["GET"])
 @login_required
 def index():
-    stocks = Stocks.query().order_by(desc(Stocks.date)).all()
+    page = paginate(Stocks.query(), Stocks)
 
     return render_template(
         "/stocks/index.html",
-        stocks=stocks,
+        stocks=page.items,
+        page=page,
     )
 
 
+@bp.route("/export.<format>", methods=["GET"])
+@login_required
+def export(format):
+    return stream_export(Stocks.query(), Stocks, EXPORT_COLUMNS, "stocks", format)
+
+
 @bp.route("/", methods=["POST"])
 @login_required
+@invalidate_tenant_cache
 def add_stocks():
 
     amount = request.form.get("amount")
@@ -36,6 +49,9 @@ def add_stocks():
     try:
         db.session.add(new_stock)
         db.session.commit()
+    except ClosedPeriodError as e:
+        db.session.rollback()
+        flash(str(e), category="warning")
     except SQLAlchemyError as e:
         print(e)
         db.session.rollback()
@@ -65,6 +81,7 @@ def get_stocks_by_id(id):
 
 @bp.route("/<int:id>", methods=["POST"])
 @login_required
+@invalidate_tenant_cache
 def update_stocks(id):
 
     stock = Stocks.query().filter(Stocks.id == id).first()
@@ -85,6 +102,10 @@ def update_stocks(id):
 
         db.session.commit()
 
+    except ClosedPeriodError as e:
+        db.session.rollback()
+        flash(str(e), category="warning")
+
     except SQLAlchemyError as e:
         print(e)
         db.session.rollback()
@@ -98,6 +119,7 @@ def update_stocks(id):
 
 @bp.route("/remove/<int:id>", methods=["POST"])
 @login_required
+@invalidate_tenant_cache
 def remove_stocks(id):
 
     stock = Stocks.query().filter(Stocks.id == id).first()
@@ -111,6 +133,10 @@ def remove_stocks(id):
         db.session.commit()
         flash("Stock supprimer !!!", category="success")
 
+    except ClosedPeriodError as e:
+        db.session.rollback()
+        flash(str(e), category="warning")
+
     except SQLAlchemyError as e:
         print(e)
         db.session.rollback()
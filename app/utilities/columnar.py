@@ -0,0 +1,345 @@
+"""Columnar in-memory snapshot of a tenant's ledgers, for analytics without SQL round trips.
+
+Each ledger is kept as one NumPy array per column, rows sorted by id: ``day`` the
+date as an ``int32`` number of days since 1970-01-01, ``amount`` as ``float64``
+(the amounts have millimes, the sums are the ones SQL ``SUM()`` gives), the
+``company``, ``cost`` and ``pay_methode`` ids as ``int32`` codes, ``0`` when the
+row has none, and ``cashing`` as ``int8``, ``-1`` when the ledger has no such
+column. A period sum is then a masked sum and a breakdown per key a
+``bincount``, the aggregates of ``utils.py`` are answered from memory.
+
+The snapshot of a tenant is loaded once per process and database engine and
+refreshed incrementally: rows with an id above the last one loaded are appended,
+rows with an ``updatedAt`` on or after the previous refresh are rewritten in
+place and deleted rows are dropped when the ledger's row count and id sum no
+longer match. Both read the primary, a lagging replica would leave rows out
+until the tenant's next write. The refresh is skipped while the tenant's cache
+version is unchanged only when the cache is shared by the workers (uWSGI), an
+in-process cache never sees the other workers' writes and every call checks.
+
+NumPy is pinned in ``requirements.txt``, an install without it still runs:
+``numpy`` is None then and ``snapshot()`` raises ``RuntimeError``.
+"""
+import datetime
+import threading
+import weakref
+
+from sqlalchemy import String, cast, select
+from sqlalchemy.sql import func
+
+from .. import cache, db
+from ..balances import LEDGERS, balance_keys
+from ..models import CostsDef, Payments, Reconciliations, Stocks
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+EPOCH = datetime.date(1970, 1, 1)
+
+# rows fetched at a time when loading a ledger
+CHUNK_SIZE = 50000
+
+# ledger name of every model held in the snapshots, stocks included
+MODELS = {**LEDGERS, Stocks: "stocks"}
+
+CODES = {"company": "company_id", "cost": "cost_id", "pay_methode": "paymentmethod_id"}
+
+# {engine: {tenant_id: LedgerSnapshot}}, dropped with the engine
+SNAPSHOTS = weakref.WeakKeyDictionary()
+LOCK = threading.Lock()
+
+
+def day_number(date):
+    return (date - EPOCH).days
+
+
+def empty_columns():
+    return {
+        "id": numpy.empty(0, numpy.int64),
+        "day": numpy.empty(0, numpy.int32),
+        "amount": numpy.empty(0, numpy.float64),
+        "company": numpy.empty(0, numpy.int32),
+        "cost": numpy.empty(0, numpy.int32),
+        "pay_methode": numpy.empty(0, numpy.int32),
+        "cashing": numpy.empty(0, numpy.int8),
+    }
+
+
+def to_columns(model, rows):
+    """Arrays of ``(id, date, amount, *codes, cashing)`` rows, see ``ledger_query``."""
+    columns = empty_columns()
+    if not rows:
+        return columns
+
+    values = list(zip(*rows))
+    columns["id"] = numpy.array(values[0], numpy.int64)
+    # ISO strings, SQLite may keep a time after the date
+    columns["day"] = numpy.array([date[:10] for date in values[1]], "datetime64[D]").astype(
+        numpy.int32
+    )
+    columns["amount"] = numpy.array([amount or 0.0 for amount in values[2]], numpy.float64)
+
+    index = 3
+    for name, column in CODES.items():
+        if column in model.__table__.c:
+            columns[name] = numpy.array([code or 0 for code in values[index]], numpy.int32)
+            index += 1
+        else:
+            columns[name] = numpy.zeros(len(rows), numpy.int32)
+    if "cashing" in model.__table__.c:
+        columns["cashing"] = numpy.array(
+            [-1 if cashing is None else int(cashing) for cashing in values[index]], numpy.int8
+        )
+    else:
+        columns["cashing"] = numpy.full(len(rows), -1, numpy.int8)
+    return columns
+
+
+def ledger_query(model, tenant_id, *criteria):
+    # a Core select on the table, the ORM would build a row object per ledger row
+    table = model.__table__
+    selected = [table.c.id, cast(table.c.date, String), table.c.amount]
+    selected += [table.c[column] for column in CODES.values() if column in table.c]
+    if "cashing" in table.c:
+        selected.append(table.c.cashing)
+    return (
+        select(*selected)
+        .where(table.c.tenant_id == tenant_id, table.c.date.isnot(None), *criteria)
+        .order_by(table.c.id)
+    )
+
+
+def fetch(model, tenant_id, *criteria):
+    """Columns of the tenant's rows of ``model`` matching ``criteria``, sorted by id.
+
+    ``criteria`` are on the columns of ``model.__table__``.
+    """
+    result = db.session.execute(ledger_query(model, tenant_id, *criteria))
+    chunks = [to_columns(model, rows) for rows in result.partitions(CHUNK_SIZE)]
+    if not chunks:
+        return empty_columns()
+    return {name: numpy.concatenate([chunk[name] for chunk in chunks]) for name in chunks[0]}
+
+
+class LedgerColumns:
+    """The columns of one ledger of a tenant, rows sorted by id."""
+
+    def __init__(self, model, tenant_id):
+        self.model = model
+        self.tenant_id = tenant_id
+        self.columns = fetch(model, tenant_id)
+
+    def __len__(self):
+        return len(self.columns["id"])
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    @property
+    def nbytes(self):
+        return sum(column.nbytes for column in self.columns.values())
+
+    def upsert(self, rows):
+        """Rewrite the rows already held and append the others."""
+        if not len(rows["id"]):
+            return
+        ids = self.columns["id"]
+        positions = numpy.searchsorted(ids, rows["id"])
+        held = positions < len(ids)
+        held[held] = ids[positions[held]] == rows["id"][held]
+
+        for name, column in self.columns.items():
+            column[positions[held]] = rows[name][held]
+        if held.all():
+            return
+
+        fresh = ~held
+        for name in self.columns:
+            self.columns[name] = numpy.concatenate([self.columns[name], rows[name][fresh]])
+        if len(ids) and rows["id"][fresh].min() < ids[-1]:
+            order = numpy.argsort(self.columns["id"], kind="stable")
+            for name in self.columns:
+                self.columns[name] = self.columns[name][order]
+
+    def refresh(self, since):
+        """Catch up with the rows added, changed or deleted since the day ``since``."""
+        model, table = self.model, self.model.__table__
+        last = int(self.columns["id"][-1]) if len(self) else 0
+        self.upsert(fetch(model, self.tenant_id, table.c.id > last))
+        if since is not None:
+            self.upsert(
+                fetch(model, self.tenant_id, table.c.id <= last, table.c.updatedAt >= since)
+            )
+
+        count, total = (
+            db.session.query(func.count(model.id), func.coalesce(func.sum(model.id), 0))
+            .filter(model.tenant_id == self.tenant_id, model.date.isnot(None))
+            .one()
+        )
+        if count != len(self) or total != int(self.columns["id"].sum()):
+            ids = [
+                id
+                for id, in db.session.query(model.id).filter(
+                    model.tenant_id == self.tenant_id, model.date.isnot(None)
+                )
+            ]
+            kept = numpy.isin(self.columns["id"], numpy.array(ids, numpy.int64))
+            for name in self.columns:
+                self.columns[name] = self.columns[name][kept]
+
+
+class LedgerSnapshot:
+    """Columnar copy of every ledger of a tenant, see ``snapshot()``.
+
+    The filters follow the ``get_*`` helpers: ``0`` (or ``None`` for ``cashing``
+    and ``fixed``) means "any", ``start`` and ``end`` are inclusive dates.
+    """
+
+    def __init__(self, tenant_id):
+        self.tenant_id = tenant_id
+        self.version = None
+        self.refreshed = datetime.date.today()
+        self.ledgers = {name: LedgerColumns(model, tenant_id) for model, name in MODELS.items()}
+        self.fixed = self.fixed_costs()
+
+    @property
+    def nbytes(self):
+        return sum(ledger.nbytes for ledger in self.ledgers.values()) + self.fixed.nbytes
+
+    def __len__(self):
+        return sum(len(ledger) for ledger in self.ledgers.values())
+
+    def fixed_costs(self):
+        """``fixed[cost]``: 1 for a fixed cost, 0 for a variable one, -1 for no cost."""
+        costs = (
+            db.session.query(CostsDef.id, CostsDef.fixed)
+            .filter(CostsDef.tenant_id == self.tenant_id)
+            .all()
+        )
+        codes = [int(ledger["cost"].max(initial=0)) for ledger in self.ledgers.values()]
+        size = max([id for id, _ in costs] + codes)
+        fixed = numpy.full(size + 1, -1, numpy.int8)
+        for id, value in costs:
+            fixed[id] = 1 if value else 0
+        return fixed
+
+    def refresh(self):
+        version = cache.tenant_version(self.tenant_id)
+        if cache.shared and version == self.version:
+            return
+        since, self.refreshed = self.refreshed, datetime.date.today()
+        for ledger in self.ledgers.values():
+            ledger.refresh(since)
+        self.fixed = self.fixed_costs()
+        self.version = version
+
+    def mask(
+        self,
+        ledger,
+        start=None,
+        end=None,
+        company=0,
+        cost=0,
+        pay_methode=0,
+        cashing=None,
+        fixed=None,
+    ):
+        columns = self.ledgers[ledger]
+        mask = numpy.ones(len(columns), bool)
+        if start:
+            mask &= columns["day"] >= day_number(start)
+        if end:
+            mask &= columns["day"] <= day_number(end)
+        if company:
+            mask &= columns["company"] == company
+        if cost:
+            mask &= columns["cost"] == cost
+        if pay_methode:
+            mask &= columns["pay_methode"] == pay_methode
+        if cashing is not None:
+            mask &= columns["cashing"] == int(cashing)
+        if fixed is not None:
+            mask &= self.fixed[columns["cost"]] == int(bool(fixed))
+        return mask
+
+    def sum(self, ledger, **filters):
+        """Total amount of the ledger rows matching the filters."""
+        return float(self.ledgers[ledger]["amount"][self.mask(ledger, **filters)].sum())
+
+    def sum_by(self, ledger, key, **filters):
+        """``{code: total}`` of the matching rows per ``company``, ``cost`` or ``pay_methode``."""
+        mask = self.mask(ledger, **filters)
+        codes = self.ledgers[ledger][key][mask]
+        totals = numpy.bincount(codes, weights=self.ledgers[ledger]["amount"][mask])
+        present = numpy.bincount(codes)
+        return {int(code): float(totals[code]) for code in numpy.flatnonzero(present)}
+
+    def daily(self, ledger, start, end, **filters):
+        """Totals of every day from ``start`` to ``end``, an array of ``end - start + 1`` floats."""
+        mask = self.mask(ledger, start=start, end=end, **filters)
+        days = self.ledgers[ledger]["day"][mask] - day_number(start)
+        return numpy.bincount(
+            days, weights=self.ledgers[ledger]["amount"][mask], minlength=(end - start).days + 1
+        )
+
+    def last_stock(self, end=None):
+        """Amount of the last stock count on or before ``end``, 0 without one."""
+        columns = self.ledgers["stocks"]
+        mask = self.mask("stocks", end=end)
+        if not mask.any():
+            return 0.0
+        days = columns["day"][mask]
+        return float(columns["amount"][mask][days == days.max()].sum())
+
+    def balance_rows(self):
+        """``(kind, company_id, cost_id, paymentmethod_id, cashing, amount)`` rows.
+
+        The content of the ``balances`` table, for ``LedgerAggregates.from_balances``.
+        """
+        rows = []
+        for model, name in LEDGERS.items():
+            columns = self.ledgers[name]
+            codes = [columns[name] for name in ("company", "cost", "pay_methode")]
+            codes.append(columns["cashing"] + 1)
+            # one int64 per key, grouping is then a 1-d sort
+            packed, sizes = numpy.zeros(len(columns), numpy.int64), []
+            for code in codes:
+                sizes.append(int(code.max(initial=0)) + 1)
+                packed = packed * sizes[-1] + code
+            groups, inverse = numpy.unique(packed, return_inverse=True)
+            totals = numpy.bincount(inverse.ravel(), weights=columns["amount"])
+
+            for group, amount in zip(groups.tolist(), totals.tolist()):
+                key = []
+                for size in reversed(sizes):
+                    group, code = divmod(group, size)
+                    key.insert(0, code)
+                company, cost, pay_methode, cashing = key
+                values = dict(
+                    company_id=company or None,
+                    cost_id=cost or None,
+                    paymentmethod_id=pay_methode or None,
+                )
+                if model in (Payments, Reconciliations):
+                    values["cashing"] = None if cashing == 0 else cashing == 2
+                for key in balance_keys(model, **values):
+                    rows.append(key + (amount,))
+        return rows
+
+
+def snapshot(tenant_id):
+    """The tenant's snapshot for the current database, loaded on first use and refreshed."""
+    if numpy is None:
+        raise RuntimeError("numpy is required by the columnar snapshots")
+    with LOCK, db.primary():
+        snapshots = SNAPSHOTS.setdefault(db.engine, {})
+        if tenant_id not in snapshots:
+            # read before loading, a write meanwhile is caught by the next refresh
+            version = cache.tenant_version(tenant_id)
+            snapshots[tenant_id] = LedgerSnapshot(tenant_id)
+            snapshots[tenant_id].version = version
+        else:
+            snapshots[tenant_id].refresh()
+        return snapshots[tenant_id]
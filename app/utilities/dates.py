@@ -0,0 +1,111 @@
+"""Calendar helpers of the templates, registered once as Jinja globals by ``create_app``.
+
+Month tables only depend on ``(year, month)`` and are memoized. The helpers about
+today read the date on every call, a worker running past midnight rolls over.
+"""
+import calendar
+import datetime
+from functools import lru_cache
+
+
+def today():
+    return datetime.date.today()
+
+
+def day_delta(day, delta):
+    return day + datetime.timedelta(days=delta)
+
+
+def strftime(value, format):
+    return value.strftime(format)
+
+
+def to_date(year, month, day):
+    return datetime.date(int(year), int(month), int(day))
+
+
+def isocalendar():
+    return today().isocalendar()
+
+
+def format_price(amount, currency="€"):
+    return "{0:.2f}{1}".format(amount, currency)
+
+
+def get_months():
+    return list(calendar.month_name)
+
+
+@lru_cache(maxsize=128)
+def month_dates(year, month):
+    return tuple(calendar.Calendar().itermonthdates(year, month))
+
+
+def get_monthdates(year, month):
+    """Dates of the weeks covering the month, as shown by a calendar page."""
+    return list(month_dates(year, month))
+
+
+@lru_cache(maxsize=128)
+def month_days_with_name(year, month):
+    return tuple(
+        (day, calendar.day_name[calendar.weekday(year, month, day)])
+        for day in range(1, calendar.monthrange(year, month)[1] + 1)
+    )
+
+
+def get_monthdays_with_name(year, month):
+    return [{"number": day, "name": name} for day, name in month_days_with_name(year, month)]
+
+
+@lru_cache(maxsize=64)
+def working_days_from(day):
+    """Weekdays among the month's length of days starting at ``day``."""
+    length = calendar.monthrange(day.year, day.month)[1]
+    return sum(
+        1 for n in range(length) if (day + datetime.timedelta(days=n)).isoweekday() not in (6, 7)
+    )
+
+
+def get_workings_days():
+    return working_days_from(today())
+
+
+def month_end(day):
+    return day.replace(day=calendar.monthrange(day.year, day.month)[1])
+
+
+def month_periods(count, last=None):
+    """``(first day, last day)`` of the ``count`` months up to the month of ``last``, oldest first."""
+    start = (last or today()).replace(day=1)
+    periods = []
+    for _ in range(count):
+        periods.insert(0, (start, month_end(start)))
+        start = (start - datetime.timedelta(days=1)).replace(day=1)
+    return periods
+
+
+def quarter_periods(count, last=None):
+    """``(first day, last day)`` of the ``count`` quarters up to the one of ``last``, oldest first."""
+    last = last or today()
+    start = last.replace(month=3 * ((last.month - 1) // 3) + 1, day=1)
+    periods = []
+    for _ in range(count):
+        periods.insert(0, (start, month_end(start.replace(month=start.month + 2))))
+        start = (start - datetime.timedelta(days=1)).replace(day=1)
+        start = start.replace(month=start.month - 2)
+    return periods
+
+
+TEMPLATE_GLOBALS = dict(
+    format_price=format_price,
+    get_months=get_months,
+    get_monthdates=get_monthdates,
+    get_monthdays_with_name=get_monthdays_with_name,
+    toDate=to_date,
+    today=today,
+    dayDelta=day_delta,
+    isocalendar=isocalendar,
+    strftime=strftime,
+    get_workings_days=get_workings_days,
+)
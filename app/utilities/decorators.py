@@ -1,6 +1,8 @@
+import inspect
 from functools import wraps
-from flask import abort
+from flask import abort, session, g, has_request_context
 from flask_login import current_user
+from .. import cache
 from ..models import Permission
 
 
@@ -19,3 +21,47 @@ def permission_required(permission):
 
 def admin_required(f):
     return permission_required(Permission.ADMIN)(f)
+
+
+def invalidate_tenant_cache(f):
+    """Bump the tenant's cache version once the view has written its ledgers."""
+
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        try:
+            return f(*args, **kwargs)
+        finally:
+            if session.get("tenant") is not None:
+                cache.bump_tenant(session["tenant"])
+
+    return decorated_function
+
+
+def request_memoized(f):
+    """Compute ``f`` once per request and arguments, results are kept on ``flask.g``."""
+    signature = inspect.signature(f)
+
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if not has_request_context():
+            return f(*args, **kwargs)
+
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        key = (f.__name__,) + tuple(bound.arguments.items())
+
+        memo = g.setdefault("memo", {})
+        stats = g.setdefault("memo_stats", {"hits": 0, "misses": 0})
+        if key in memo:
+            stats["hits"] += 1
+        else:
+            stats["misses"] += 1
+            memo[key] = f(*args, **kwargs)
+        return memo[key]
+
+    return decorated_function
+
+
+def memo_stats():
+    """Hits and misses of the ``request_memoized`` helpers during this request."""
+    return dict(g.get("memo_stats", {"hits": 0, "misses": 0}))
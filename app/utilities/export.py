@@ -0,0 +1,94 @@
+"""Downloads of the ledger lists, see the ``export`` view of each blueprint.
+
+Rows are fetched ``EXPORT_CHUNK_SIZE`` at a time with ``yield_per``, a server side
+cursor where the database has one, so an export takes the same memory whatever the
+number of rows. CSV is streamed chunk by chunk as the rows are read. XLSX is not: the
+zipped workbook is only complete once every row is written, so the whole file is built
+in a temporary file before its first byte is sent. Large exports should use CSV.
+"""
+import csv
+import io
+import tempfile
+
+import openpyxl
+from flask import Response, abort, current_app, stream_with_context
+
+from .. import db
+
+FORMATS = ["csv", "xlsx"]
+
+MIMETYPES = {
+    "csv": "text/csv",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+}
+
+
+def value(row, path):
+    """``row.company.name`` for ``"company.name"``, None past a missing relationship."""
+    for name in path.split("."):
+        if row is None:
+            return None
+        row = getattr(row, name)
+    return row
+
+
+def csv_chunks(rows, columns, chunk_size):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    # the byte order mark makes spreadsheets read the accents as UTF-8
+    buffer.write("\ufeff")
+    writer.writerow([header for header, _ in columns])
+
+    for n, row in enumerate(rows, 1):
+        writer.writerow([value(row, path) for _, path in columns])
+        if n % chunk_size == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def xlsx_chunks(rows, columns, chunk_size):
+    """Build the whole workbook on disk, then send it.
+
+    Nothing reaches the client until every row is written, a large export may run
+    into the request timeout of the proxy where the CSV one would not.
+    """
+    # a write-only workbook keeps its rows in a temporary file, not in memory
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append([header for header, _ in columns])
+    for row in rows:
+        sheet.append([value(row, path) for _, path in columns])
+
+    with tempfile.TemporaryFile() as file:
+        workbook.save(file)
+        file.seek(0)
+        while True:
+            chunk = file.read(64 * 1024)
+            if not chunk:
+                break
+            yield chunk
+
+
+def stream_export(query, model, columns, name, format):
+    """Download the rows of ``query`` oldest first as ``<name>.<format>``.
+
+    ``columns`` is a list of ``(header, attribute path)`` pairs.
+    """
+    if format not in FORMATS:
+        abort(404)
+
+    chunk_size = current_app.config["EXPORT_CHUNK_SIZE"]
+    write = csv_chunks if format == "csv" else xlsx_chunks
+
+    def generate():
+        with db.replica():
+            rows = query.order_by(model.date, model.id).yield_per(chunk_size)
+            yield from write(rows, columns, chunk_size)
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype=MIMETYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{name}.{format}"'},
+    )
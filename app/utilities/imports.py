@@ -0,0 +1,191 @@
+"""Bulk import of ledger rows from an uploaded CSV, see the ``import_csv`` views.
+
+The file is read line by line. Every row is checked against in-memory maps of
+the tenant's parties and payment methods, then inserted with executemany
+``IMPORT_BATCH_SIZE`` rows at a time. The file is one transaction: when a row is
+rejected nothing is kept and the report lists every rejected line. The headers
+are those of the CSV exports, an export can be imported back.
+"""
+import csv
+import datetime
+import io
+from collections import defaultdict
+
+from flask import Request, current_app, session
+
+from .. import db, facts
+from ..closing import closed_through
+from ..balances import add_deltas, apply_deltas
+
+DATE_FORMATS = ["%Y-%m-%d", "%d/%m/%Y", "%d-%m-%Y"]
+
+
+class ImportRequest(Request):
+    """Request accepting CSV and statement uploads up to ``IMPORT_MAX_CONTENT_LENGTH``."""
+
+    @property
+    def max_content_length(self):
+        if self.endpoint and self.endpoint.endswith((".import_csv", ".import_statement")):
+            return current_app.config["IMPORT_MAX_CONTENT_LENGTH"]
+        return super().max_content_length
+
+
+class ImportReport:
+    """Outcome of an import: rows inserted or, when a line was rejected, the errors."""
+
+    def __init__(self):
+        self.inserted = 0
+        self.rejected = 0
+        self.errors = []
+
+    def error(self, line, message):
+        self.rejected += 1
+        if len(self.errors) < current_app.config["IMPORT_MAX_ERRORS"]:
+            self.errors.append((line, message))
+
+    @property
+    def ok(self):
+        return self.rejected == 0
+
+
+def normalize(name):
+    return " ".join(str(name).split()).casefold()
+
+
+def lookup(rows):
+    """Map the names and ids of ``(id, name)`` rows to the id."""
+    ids = {}
+    for id, name in rows:
+        ids[str(id)] = id
+        ids[normalize(name)] = id
+    return ids
+
+
+def parse_date(value):
+    for format in DATE_FORMATS:
+        try:
+            return datetime.datetime.strptime(value.strip(), format).date()
+        except ValueError:
+            pass
+    raise ValueError(f"date invalide {value!r}")
+
+
+def parse_amount(value):
+    try:
+        amount = float(value.strip().replace(" ", "").replace(",", "."))
+    except ValueError:
+        raise ValueError(f"montant invalide {value!r}")
+    if amount < 0:
+        raise ValueError(f"montant negatif {value!r}")
+    return amount
+
+
+def open_csv(file):
+    """``DictReader`` over an upload, comma or semicolon separated, BOM or not."""
+    text = io.TextIOWrapper(file.stream, encoding="utf-8-sig", newline="")
+    header = text.readline()
+    delimiter = ";" if header.count(";") > header.count(",") else ","
+    fields = next(csv.reader([header], delimiter=delimiter), [])
+    return csv.DictReader(text, fieldnames=[field.strip() for field in fields], delimiter=delimiter)
+
+
+def import_ledger(file, model, party, party_column, parties, paymentmethods):
+    """Insert the rows of the CSV ``file`` into the ``model`` ledger of the current tenant.
+
+    ``party`` is the header naming the company or cost of a row, looked up in
+    ``parties`` and stored in ``party_column``; ``paymentmethods`` maps the
+    allowed payment methods. Returns an ``ImportReport``.
+    """
+    report = ImportReport()
+    batch_size = current_app.config["IMPORT_BATCH_SIZE"]
+    table = model.__table__
+    tenant_id = int(session["tenant"])
+    today = datetime.date.today()
+    columns = {column.name for column in table.columns}
+    # executemany skips the flush listener refusing rows of closed periods
+    closed = closed_through(tenant_id)
+
+    reader = open_csv(file)
+    missing = [
+        header
+        for header in ["Date", party, "Mode de paiement", "Montant"]
+        if header not in (reader.fieldnames or [])
+    ]
+    if missing:
+        report.error(1, f"colonnes manquantes: {', '.join(missing)}")
+        return report
+
+    deltas = defaultdict(lambda: [0.0, 0])
+    fact_deltas = defaultdict(lambda: [0.0, 0])
+    batch = []
+    for line, row in enumerate(reader, 2):
+        try:
+            date = parse_date(row["Date"] or "")
+            amount = parse_amount(row["Montant"] or "")
+        except ValueError as error:
+            report.error(line, str(error))
+            continue
+        if closed is not None and date <= closed:
+            report.error(line, f"période clôturée au {closed:%d/%m/%Y}")
+            continue
+
+        party_id = parties.get(normalize(row[party] or ""))
+        if party_id is None:
+            report.error(line, f"{party.lower()} inconnu {row[party]!r}")
+            continue
+        paymentmethod_id = paymentmethods.get(normalize(row["Mode de paiement"] or ""))
+        if paymentmethod_id is None:
+            report.error(line, f"mode de paiement refuse {row['Mode de paiement']!r}")
+            continue
+
+        try:
+            due_date = parse_date(row["Echeance"]) if row.get("Echeance") else date
+            month_for = parse_date(row["Mois"]) if row.get("Mois") else date
+        except ValueError as error:
+            report.error(line, str(error))
+            continue
+
+        values = {
+            "tenant_id": tenant_id,
+            party_column: party_id,
+            "paymentmethod_id": paymentmethod_id,
+            "date": date,
+            "amount": amount,
+            "comment": (row.get("Commentaire") or "import")[:50],
+            "document_number": (row.get("Document") or "nop")[:50],
+            "due_date": due_date,
+            "month_for": month_for,
+            "createdAt": today,
+            "updatedAt": today,
+        }
+        values = {column: value for column, value in values.items() if column in columns}
+        batch.append(values)
+        key = {
+            "tenant_id": tenant_id,
+            party_column: party_id,
+            "paymentmethod_id": paymentmethod_id,
+            "amount": amount,
+        }
+        add_deltas(deltas, model, dict(key))
+        facts.add_deltas(fact_deltas, model, dict(key, date=date))
+
+        if len(batch) == batch_size:
+            if report.ok:
+                db.session.execute(table.insert(), batch)
+            report.inserted += len(batch)
+            batch = []
+
+    if batch and report.ok:
+        db.session.execute(table.insert(), batch)
+    report.inserted += len(batch)
+
+    if not report.ok:
+        db.session.rollback()
+        report.inserted = 0
+        return report
+
+    # executemany skips the flush events that keep the balances and daily facts in sync
+    apply_deltas(db.session, deltas)
+    facts.apply_deltas(db.session, fact_deltas)
+    db.session.commit()
+    return report
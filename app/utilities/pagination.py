@@ -0,0 +1,70 @@
+import datetime
+
+from flask import current_app, request
+from sqlalchemy import and_, desc, or_
+from sqlalchemy.sql import func
+
+
+def parse_cursor(value):
+    """``"<date>_<id>"`` of the last row of the previous page, the date is empty when NULL."""
+    date, id = value.split("_")
+    return datetime.date.fromisoformat(date) if date else None, int(id)
+
+
+def format_cursor(item):
+    return f"{item.date.isoformat() if item.date else ''}_{item.id}"
+
+
+class KeysetPage:
+    """One page of a ledger list, newest first, with the totals of the whole filter."""
+
+    def __init__(self, items, count, total, cursor=None, next_cursor=None):
+        self.items = items
+        self.count = count
+        self.total = total
+        self.cursor = cursor
+        self.next_cursor = next_cursor
+
+    @property
+    def is_first(self):
+        return self.cursor is None
+
+
+def paginate(query, model, per_page=None):
+    """Paginate ``query`` on ``(date, id)`` with the ``cursor`` request argument.
+
+    The row count and amount total of the filtered query come from one
+    aggregate, so the page only loads ``per_page`` rows however long the
+    ledger is. Rows without a date come after the dated ones, newest id first.
+    """
+    per_page = per_page or current_app.config["LIST_PER_PAGE"]
+    cursor = request.args.get("cursor", type=parse_cursor, default=None)
+
+    count, total = (
+        query.order_by(None)
+        .with_entities(func.count(model.id), func.coalesce(func.sum(model.amount), 0))
+        .one()
+    )
+
+    items = []
+    if cursor is None or cursor[0] is not None:
+        dated = query.filter(model.date.isnot(None))
+        if cursor:
+            date, id = cursor
+            dated = dated.filter(
+                or_(model.date < date, and_(model.date == date, model.id < id)),
+            )
+        items = dated.order_by(desc(model.date), desc(model.id)).limit(per_page + 1).all()
+
+    if len(items) <= per_page:
+        undated = query.filter(model.date.is_(None))
+        if cursor and cursor[0] is None:
+            undated = undated.filter(model.id < cursor[1])
+        items += undated.order_by(desc(model.id)).limit(per_page + 1 - len(items)).all()
+
+    next_cursor = None
+    if len(items) > per_page:
+        items = items[:per_page]
+        next_cursor = format_cursor(items[-1])
+
+    return KeysetPage(items, count, total, cursor, next_cursor)
@@ -0,0 +1,418 @@
+"""Bank statement import and its matching against the open ledger items.
+
+A statement (CSV or OFX) is parsed into ``StatementLine`` objects. Every line is
+matched against the ledger rows not yet reconciled on the same side: the sales and
+recovers for a credit, the purchases, costs and payments for a debit. The open
+items are bucketed by side and amount in cents, each bucket sorted by the date the
+money is expected on the account, so a line looks up its bucket and bisects its
+date window instead of being compared with every item. A candidate whose
+document number the line quotes wins over the others, then the closest date.
+
+Nothing is written until the proposals are confirmed, see ``reconcile``.
+"""
+import datetime
+import re
+import unicodedata
+from bisect import bisect_left, bisect_right
+from collections import defaultdict, namedtuple
+
+from flask import current_app
+from sqlalchemy import and_, or_
+
+from .. import db
+from ..balances import LEDGERS
+from ..models import (
+    CostsMapping,
+    Payments,
+    Purchasing,
+    ReconciliationItems,
+    Reconciliations,
+    Recovers,
+    Sales,
+)
+from .imports import open_csv, parse_date
+
+# ledgers an account movement may settle and whether they bring money in
+SIDES = [
+    (Sales, True),
+    (Recovers, True),
+    (Purchasing, False),
+    (CostsMapping, False),
+    (Payments, False),
+]
+KINDS = {LEDGERS[model]: (model, cashing) for model, cashing in SIDES}
+
+# every method except credit ends up on the bank account
+PAYMENT_METHODS = (1, 2, 3, 5, 6, 7)
+
+# cheques and traites reach the account on their due date
+DUE_DATE_METHODS = (2, 3)
+
+StatementLine = namedtuple("StatementLine", "line date amount label reference")
+OpenItem = namedtuple(
+    "OpenItem",
+    "kind id cashing company_id cost_id paymentmethod_id amount date expected "
+    "document_number comment",
+)
+Proposal = namedtuple("Proposal", "line item quoted")
+
+
+def cents(amount):
+    return round(abs(amount) * 100)
+
+
+def fold(text):
+    """Lower case, accents removed, to compare headers and labels."""
+    text = unicodedata.normalize("NFKD", str(text))
+    return "".join(char for char in text if not unicodedata.combining(char)).strip().casefold()
+
+
+def parse_signed_amount(value):
+    value = (value or "").strip().replace(" ", "").replace("\u00a0", "").replace(",", ".")
+    if not value:
+        return 0.0
+    try:
+        return float(value)
+    except ValueError:
+        raise ValueError(f"montant invalide {value!r}")
+
+
+class StatementErrors(list):
+    """``(line, message)`` of the rejected lines, the first ``IMPORT_MAX_ERRORS`` are kept."""
+
+    rejected = 0
+
+    def add(self, line, message):
+        self.rejected += 1
+        if len(self) < current_app.config["IMPORT_MAX_ERRORS"]:
+            self.append((line, message))
+
+
+def parse_csv(file, errors):
+    """Lines of a CSV statement: Date, Libellé, Référence and Montant or Débit/Crédit."""
+    reader = open_csv(file)
+    headers = {fold(name): name for name in reader.fieldnames or []}
+    date, label = headers.get("date"), headers.get("libelle")
+    amount, debit, credit = headers.get("montant"), headers.get("debit"), headers.get("credit")
+    reference = headers.get("reference")
+
+    if not date or not label or not (amount or (debit and credit)):
+        errors.add(1, "colonnes attendues: Date, Libellé et Montant ou Débit et Crédit")
+        return []
+
+    lines = []
+    for line, row in enumerate(reader, 2):
+        try:
+            day = parse_date(row[date] or "")
+            if amount:
+                value = parse_signed_amount(row[amount])
+            else:
+                value = abs(parse_signed_amount(row[credit])) - abs(parse_signed_amount(row[debit]))
+        except ValueError as error:
+            errors.add(line, str(error))
+            continue
+        if value:
+            lines.append(
+                StatementLine(
+                    line, day, value, (row[label] or "").strip(), (row.get(reference) or "").strip()
+                )
+            )
+    return lines
+
+
+OFX_TRANSACTION = re.compile(r"<STMTTRN>(.*?)(?=</STMTTRN>|<STMTTRN>|</BANKTRANLIST>)", re.S | re.I)
+OFX_FIELD = re.compile(r"<(\w+)>([^<\r\n]*)")
+
+
+def parse_ofx(file, errors):
+    """Lines of an OFX statement, SGML (1.x) or XML (2.x)."""
+    data = file.read()
+    try:
+        text = data.decode("utf-8")
+    except UnicodeDecodeError:
+        text = data.decode("cp1252", errors="replace")
+
+    lines = []
+    for line, transaction in enumerate(OFX_TRANSACTION.findall(text), 1):
+        fields = {name.upper(): value.strip() for name, value in OFX_FIELD.findall(transaction)}
+        try:
+            day = datetime.datetime.strptime(fields.get("DTPOSTED", "")[:8], "%Y%m%d").date()
+        except ValueError:
+            errors.add(line, f"date invalide {fields.get('DTPOSTED', '')!r}")
+            continue
+        try:
+            value = parse_signed_amount(fields.get("TRNAMT"))
+        except ValueError as error:
+            errors.add(line, str(error))
+            continue
+        label = " ".join(filter(None, [fields.get("NAME"), fields.get("MEMO")]))
+        reference = fields.get("CHECKNUM") or fields.get("REFNUM") or fields.get("FITID", "")
+        if value:
+            lines.append(StatementLine(line, day, value, label, reference))
+    return lines
+
+
+def parse_statement(file):
+    """``(lines, errors)`` of an uploaded statement, OFX by extension or header, else CSV."""
+    errors = StatementErrors()
+    head = file.stream.read(256)
+    file.stream.seek(0)
+    name = (file.filename or "").lower()
+    if name.endswith((".ofx", ".qfx")) or b"OFXHEADER" in head or b"<OFX>" in head.upper():
+        return parse_ofx(file.stream, errors), errors
+    return parse_csv(file, errors), errors
+
+
+def expected_date(paymentmethod_id, date, due_date):
+    if paymentmethod_id in DUE_DATE_METHODS and due_date:
+        return due_date
+    return date
+
+
+def open_items(start, end, days):
+    """Ledger rows of the current tenant not reconciled yet, expected around ``start``..``end``."""
+    low = start - datetime.timedelta(days=days)
+    high = end + datetime.timedelta(days=days)
+
+    items = []
+    for model, cashing in SIDES:
+        kind = LEDGERS[model]
+        columns = [
+            getattr(model, name)
+            for name in [
+                "id",
+                "company_id",
+                "cost_id",
+                "paymentmethod_id",
+                "amount",
+                "date",
+                "due_date",
+                "document_number",
+                "comment",
+            ]
+            if hasattr(model, name)
+        ]
+        query = (
+            model.query()
+            .outerjoin(
+                ReconciliationItems,
+                and_(ReconciliationItems.kind == kind, ReconciliationItems.item_id == model.id),
+            )
+            .filter(
+                ReconciliationItems.id == None,
+                model.paymentmethod_id.in_(PAYMENT_METHODS),
+                model.date <= high,
+                or_(model.date >= low, model.due_date >= low),
+            )
+            .with_entities(*columns)
+        )
+        for row in query:
+            row = row._asdict()
+            items.append(
+                OpenItem(
+                    kind=kind,
+                    id=row["id"],
+                    cashing=cashing,
+                    company_id=row.get("company_id"),
+                    cost_id=row.get("cost_id"),
+                    paymentmethod_id=row["paymentmethod_id"],
+                    amount=row["amount"] or 0.0,
+                    date=row["date"],
+                    expected=expected_date(row["paymentmethod_id"], row["date"], row["due_date"]),
+                    document_number=row["document_number"],
+                    comment=row["comment"],
+                )
+            )
+    return unmatched_by_hand(items, low, high, days)
+
+
+def unmatched_by_hand(items, low, high, days):
+    """``items`` less those a reconciliation entered by hand already books.
+
+    Those reconciliations have no ``ReconciliationItems`` link. Each one covers
+    a single item on the same side with the same party, payment method and
+    amount, expected within ``days`` of its date, the earliest expected first.
+    """
+    manual = defaultdict(list)
+    query = (
+        Reconciliations.query()
+        .outerjoin(ReconciliationItems)
+        .filter(
+            ReconciliationItems.id == None,
+            Reconciliations.date >= low - datetime.timedelta(days=days),
+            Reconciliations.date <= high + datetime.timedelta(days=days),
+        )
+        .with_entities(
+            Reconciliations.cashing,
+            Reconciliations.company_id,
+            Reconciliations.cost_id,
+            Reconciliations.paymentmethod_id,
+            Reconciliations.amount,
+            Reconciliations.date,
+        )
+        .order_by(Reconciliations.date, Reconciliations.id)
+    )
+    for cashing, company_id, cost_id, paymentmethod_id, amount, date in query:
+        manual[(cashing, company_id, cost_id, paymentmethod_id, cents(amount or 0))].append(date)
+
+    if not manual:
+        return items
+
+    window = datetime.timedelta(days=days)
+    kept = []
+    for item in sorted(items, key=lambda item: (item.expected or item.date, item.id)):
+        dates = manual.get(
+            (
+                item.cashing,
+                item.company_id,
+                item.cost_id,
+                item.paymentmethod_id,
+                cents(item.amount),
+            ),
+            [],
+        )
+        expected = item.expected or item.date
+        covered = next((date for date in dates if abs(date - expected) <= window), None)
+        if covered is None:
+            kept.append(item)
+        else:
+            dates.remove(covered)
+    return kept
+
+
+class AmountIndex:
+    """Open items by side and amount in cents, each bucket sorted by expected date."""
+
+    def __init__(self, items):
+        buckets = defaultdict(list)
+        for item in items:
+            if item.expected is not None:
+                buckets[(item.cashing, cents(item.amount))].append(item)
+
+        self.buckets = {}
+        for key, bucket in buckets.items():
+            bucket.sort(key=lambda item: (item.expected, item.id))
+            self.buckets[key] = ([item.expected for item in bucket], bucket)
+
+    def candidates(self, line, days):
+        dates, bucket = self.buckets.get((line.amount > 0, cents(line.amount)), ((), ()))
+        window = datetime.timedelta(days=days)
+        return bucket[
+            bisect_left(dates, line.date - window) : bisect_right(dates, line.date + window)
+        ]
+
+
+def is_word(char):
+    return char.isalnum() or char == "_"
+
+
+def quotes(text, document_number):
+    """Whether the folded ``text`` of a line contains ``document_number`` as a word."""
+    document_number = fold(document_number or "")
+    if not document_number or document_number == "nop":
+        return False
+
+    start = text.find(document_number)
+    while start >= 0:
+        end = start + len(document_number)
+        if (start == 0 or not is_word(text[start - 1])) and (
+            end == len(text) or not is_word(text[end])
+        ):
+            return True
+        start = text.find(document_number, start + 1)
+    return False
+
+
+def match(lines, items, days):
+    """One ``Proposal`` per line, ``item`` is None when no open item fits.
+
+    Every item is proposed once. The lines quoting the document number of a
+    candidate pick first, then every line takes its closest candidate in time.
+    """
+    index = AmountIndex(items)
+    taken = set()
+    found = {}
+
+    for by_document in (True, False):
+        for position, line in enumerate(lines):
+            if position in found:
+                continue
+
+            best = None
+            text = fold(f"{line.label} {line.reference}")
+            for item in index.candidates(line, days):
+                if (item.kind, item.id) in taken:
+                    continue
+                quoted = quotes(text, item.document_number)
+                if by_document and not quoted:
+                    continue
+                rank = (abs((item.expected - line.date).days), item.id)
+                if best is None or rank < best[0]:
+                    best = (rank, item, quoted)
+
+            if best is not None:
+                _, item, quoted = best
+                taken.add((item.kind, item.id))
+                found[position] = (item, quoted)
+
+    return [
+        Proposal(line, *found.get(position, (None, False))) for position, line in enumerate(lines)
+    ]
+
+
+def propose(lines):
+    """Match ``lines`` against the open items of the current tenant."""
+    if not lines:
+        return []
+    days = current_app.config["RECONCILIATION_MATCH_DAYS"]
+    dates = [line.date for line in lines]
+    return match(lines, open_items(min(dates), max(dates), days), days)
+
+
+def reconcile(lines):
+    """Book the account movements settling the ``(kind, item_id, date, label)`` lines.
+
+    The rows of every kind are loaded with one query and their links with
+    another. Returns the new ``Reconciliations``, a line whose row does not exist
+    or is already reconciled books nothing. The caller commits.
+    """
+    lines = [line for line in lines if line[0] in KINDS]
+    ids = defaultdict(set)
+    for kind, item_id, date, label in lines:
+        ids[kind].add(item_id)
+
+    items = {}
+    for kind, item_ids in ids.items():
+        model = KINDS[kind][0]
+        for item in model.query().filter(model.id.in_(item_ids)):
+            items[(kind, item.id)] = item
+
+    taken = set(
+        ReconciliationItems.query()
+        .filter(
+            ReconciliationItems.item_id.in_({id for item_ids in ids.values() for id in item_ids})
+        )
+        .with_entities(ReconciliationItems.kind, ReconciliationItems.item_id)
+    )
+
+    reconciliations = []
+    for kind, item_id, date, label in lines:
+        item = items.get((kind, item_id))
+        if item is None or (kind, item_id) in taken:
+            continue
+        taken.add((kind, item_id))
+
+        company_id = getattr(item, "company_id", None)
+        reconciliation = Reconciliations(
+            cost_id=None if company_id else item.cost_id,
+            cashing=KINDS[kind][1],
+            company_id=company_id,
+            paymentmethod_id=item.paymentmethod_id,
+            date=date,
+            amount=item.amount,
+            comment=(label or item.comment or "")[:50],
+        )
+        reconciliation.items.append(ReconciliationItems(kind=kind, item_id=item_id))
+        db.session.add(reconciliation)
+        reconciliations.append(reconciliation)
+    return reconciliations
@@ -1,9 +1,21 @@
 import datetime
+from collections import defaultdict
+from itertools import product
+
+from flask import current_app, g
 from sqlalchemy.sql import func
 from sqlalchemy import extract
 
-from .. import db
+from .. import db, cache
+from . import columnar
+from .decorators import request_memoized
+from ..balances import LEDGERS, balance_keys, key_columns
 from ..models import (
+    current_tenant,
+    Balances,
+    ClosingBalances,
+    DailyFacts,
+    PeriodCloses,
     Payments,
     Sales,
     Recovers,
@@ -15,58 +27,181 @@ from ..models import (
 )
 
 
-def get_sum_sales(company_id=0, pay_methode_id=0):
-    query = Sales.query_sum()
+# ********************************** aggregation ********************************
+
+# the helpers querying the ledgers read from the replica (``DATABASE_REPLICA_URI``)
+# during GET requests, see ``SQLITE.replica``
+
+
+class LedgerAggregates:
+    """Tenant totals of every ledger, answered from the ``balances`` table.
+
+    With ``LEDGER_COLUMNAR`` and NumPy installed they are grouped from the
+    tenant's in-memory snapshot instead, see ``columnar.py``.
+
+    Each total is indexed under every combination of its keys where ``0`` (or
+    ``None`` for ``cashing``) means "any", the same convention the ``get_*``
+    helpers use for their filters, so answering a helper is a dict lookup.
+    Payments and reconciliations are split into a companies and a costs ledger
+    because the helpers never mix both sides.
+    """
+
+    def __init__(self):
+        self.totals = defaultdict(float)
+
+    def add(self, ledger, amount, party=0, pay_methode=0, cashing=None):
+        for key in set(product((party, 0), (pay_methode, 0), (cashing, None))):
+            self.totals[(ledger,) + key] += amount
+
+    def sum(self, ledger, party=0, pay_methode=0, cashing=None):
+        return self.totals.get((ledger, party or 0, pay_methode or 0, cashing), 0.0)
+
+    @classmethod
+    def from_balances(cls, rows):
+        """Build from ``(kind, company_id, cost_id, paymentmethod_id, cashing, amount)`` rows."""
+        aggregates = cls()
+        for kind, company_id, cost_id, pay_methode, cashing, amount in rows:
+            party = company_id if company_id is not None else cost_id
+            aggregates.add(kind, amount, party, pay_methode, cashing)
+        return aggregates
+
+    @classmethod
+    @db.on_replica
+    def load(cls):
+        if current_app.config["LEDGER_COLUMNAR"] and columnar.numpy is not None:
+            return cls.from_balances(columnar.snapshot(current_tenant()).balance_rows())
+        if current_app.config["LEDGER_BALANCES"]:
+            return cls.from_balances(
+                Balances.query().with_entities(
+                    Balances.kind,
+                    Balances.company_id,
+                    Balances.cost_id,
+                    Balances.paymentmethod_id,
+                    Balances.cashing,
+                    Balances.amount,
+                )
+            )
+        return cls.from_ledgers()
+
+    @classmethod
+    def from_ledgers(cls):
+        # one GROUP BY per ledger table from the latest close, for databases without a
+        # built balances table
+        close = get_close()
+        rows = [row for row in closing_rows(close) if row[0] != "stocks"] if close else []
+        for model in LEDGERS:
+            columns = key_columns(model)
+            query = model.query_sum_by(*columns)
+            if close:
+                query = query.filter(model.date > close)
+            for row in query:
+                values = dict(zip([column.key for column in columns], row))
+                for key in balance_keys(model, **values):
+                    rows.append(key + (row[-1],))
+        return cls.from_balances(rows)
+
+
+def get_close(day=None):
+    """Last day of the latest closed period on or before ``day``, None without one."""
+    query = PeriodCloses.query().with_entities(func.max(PeriodCloses.date))
+    if day:
+        query = query.filter(PeriodCloses.date <= day)
+    return query.scalar()
+
+
+def closing_rows(close):
+    return (
+        ClosingBalances.query()
+        .filter(ClosingBalances.date == close)
+        .with_entities(
+            ClosingBalances.kind,
+            ClosingBalances.company_id,
+            ClosingBalances.cost_id,
+            ClosingBalances.paymentmethod_id,
+            ClosingBalances.cashing,
+            ClosingBalances.amount,
+        )
+    )
 
-    if company_id:
-        query = query.filter(Sales.company_id == company_id)
 
-    if pay_methode_id:
-        query = query.filter(Sales.paymentmethod_id == pay_methode_id)
+@request_memoized
+@db.on_replica
+def get_closing(day=None):
+    """``(close, aggregates)`` of the latest period close on or before ``day``.
 
-    return round(query.scalar(), 3)
+    The balance helpers add the rows dated after ``close`` to these aggregates
+    instead of summing the whole history, ``close`` is None when no period is
+    closed and the aggregates are empty.
+    """
+    close = get_close(day)
+    if close is None:
+        return None, LedgerAggregates()
+    return close, LedgerAggregates.from_balances(closing_rows(close))
 
 
-def get_sum_recovers(company_id=0, pay_methode_id=0):
-    query = Recovers.query_sum()
+def closing_bank(aggregates):
+    def movements(cashing):
+        return sum(
+            aggregates.sum(ledger, cashing=cashing)
+            for ledger in ("reconciliations_companies", "reconciliations_costs", "reconciliations")
+        )
 
-    if company_id:
-        query = query.filter(Recovers.company_id == company_id)
+    return movements(True) - movements(False)
 
-    if pay_methode_id:
-        query = query.filter(Recovers.paymentmethod_id == pay_methode_id)
 
-    return round(query.scalar(), 3)
+def ledger_source(model):
+    """Entity the period sums of ``model`` are read from and the criteria selecting its rows.
 
+    With ``LEDGER_DAILY_FACTS`` that is the daily facts, one row per day and key,
+    it has the ``date``, ``paymentmethod_id``, ``cashing`` and ``fixed`` columns
+    the helpers filter on.
+    """
+    if current_app.config["LEDGER_DAILY_FACTS"]:
+        return DailyFacts, [DailyFacts.ledger == LEDGERS[model]]
+    return model, []
 
-def get_sum_reconciliations(company_id=0, pay_methode_id=0, cashing=True):
-    query = Reconciliations.query_sum().filter(Reconciliations.cashing == cashing)
 
-    if company_id:
-        query = query.filter(Reconciliations.company_id == company_id)
-    else:
-        query = query.filter(Reconciliations.company_id.isnot(None))
+def get_ledger_aggregates():
+    # loaded once per request, every helper below reads the same snapshot
+    if "ledger_aggregates" not in g:
+        g.ledger_aggregates = cache.tenant_cached(
+            current_tenant(), "ledger_aggregates", LedgerAggregates.load
+        )
+    return g.ledger_aggregates
 
-    if pay_methode_id:
-        query = query.filter(Reconciliations.paymentmethod_id == pay_methode_id)
 
-    return round(query.scalar(), 3)
+@request_memoized
+def get_sum_sales(company_id=0, pay_methode_id=0):
+    return round(get_ledger_aggregates().sum("sales", company_id, pay_methode_id), 3)
 
 
-def get_sum_reconciliations_costs(cost_id=0, pay_methode_id=0, cashing=True):
-    query = Reconciliations.query_sum().filter(Reconciliations.cashing == cashing)
+@request_memoized
+def get_sum_recovers(company_id=0, pay_methode_id=0):
+    return round(get_ledger_aggregates().sum("recovers", company_id, pay_methode_id), 3)
 
-    if pay_methode_id:
-        query = query.filter(Reconciliations.paymentmethod_id == pay_methode_id)
 
-    if cost_id:
-        query = query.filter(Reconciliations.cost_id == cost_id)
-    else:
-        query = query.filter(Reconciliations.cost_id.isnot(None))
+@request_memoized
+def get_sum_reconciliations(company_id=0, pay_methode_id=0, cashing=True):
+    res = get_ledger_aggregates().sum(
+        "reconciliations_companies", company_id, pay_methode_id, cashing
+    )
+    return round(res, 3)
 
-    return round(query.scalar(), 3)
+
+@request_memoized
+def get_sum_reconciliations_costs(cost_id=0, pay_methode_id=0, cashing=True):
+    res = get_ledger_aggregates().sum("reconciliations_costs", cost_id, pay_methode_id, cashing)
+    return round(res, 3)
+
+
+@request_memoized
+def get_sum_reconciliations_other(pay_methode_id=0, cashing=True):
+    # booked on neither a company nor a cost, a cash deposit for instance
+    res = get_ledger_aggregates().sum("reconciliations", 0, pay_methode_id, cashing)
+    return round(res, 3)
 
 
+@request_memoized
 def get_sold_clients(company=0):
 
     sum_credits = get_sum_sales(company_id=company, pay_methode_id=4)  # credit
@@ -78,6 +213,7 @@ def get_sold_clients(company=0):
     return round(sum_credits - sum_recovers - sum_reconciliations, 3)
 
 
+@request_memoized
 def get_ticket():
 
     sum_credits = get_sum_sales(pay_methode_id=6)  # ticket resto
@@ -105,6 +241,7 @@ def get_ticket():
 
 
 # TODO: Fix erro on Ticket resto
+@request_memoized
 def get_sold_portefeuille(company=0, pay_methode=0):
     # le raprochement doit etre pris en compte
     sum_sales = get_sum_sales(company, pay_methode)
@@ -121,41 +258,43 @@ def get_sold_portefeuille(company=0, pay_methode=0):
     return round(sum_sales + sum_recovers - sum_encaissements - cost_and_purchasing, 3)
 
 
+@request_memoized
 def get_impayees(pay_methode=1):
     return round(0, 3)
 
 
+@request_memoized
 def get_banque():
-    sum_encaissements = Reconciliations.query_sum().filter(Reconciliations.cashing == True).scalar()
+    sum_encaissements = (
+        get_sum_reconciliations(cashing=True)
+        + get_sum_reconciliations_costs(cashing=True)
+        + get_sum_reconciliations_other(cashing=True)
+    )
     sum_decaissements = (
-        Reconciliations.query_sum().filter(Reconciliations.cashing == False).scalar()
+        get_sum_reconciliations(cashing=False)
+        + get_sum_reconciliations_costs(cashing=False)
+        + get_sum_reconciliations_other(cashing=False)
     )
 
     return round(sum_encaissements - sum_decaissements, 3)
 
 
+@request_memoized
 def get_caisse():
 
-    sum_sales = Sales.query_sum().filter(Sales.paymentmethod_id == 1).scalar()
+    sum_sales = get_sum_sales(pay_methode_id=1)
 
-    sum_reconciliations = Recovers.query_sum().filter(Recovers.paymentmethod_id == 1).scalar()
+    sum_reconciliations = get_sum_recovers(pay_methode_id=1)
 
-    sum_cost = CostsMapping.query_sum().filter(CostsMapping.paymentmethod_id == 1).scalar()
+    sum_cost = get_costs(pay_methode=1)
 
-    sum_purchasing = Purchasing.query_sum().filter(Purchasing.paymentmethod_id == 1).scalar()
+    sum_purchasing = get_purchasing(pay_methode=1)
     # TODO: add decaissement to the sum
-    sum_decaissements = (
-        Reconciliations.query_sum().filter(Reconciliations.cashing == False).scalar()
-    )
-
-    sum_decaissements = (
-        Reconciliations.query_sum().filter(Reconciliations.cashing == False).scalar()
-    )
 
     sum_encaissements_especes = (
-        Reconciliations.query_sum()
-        .filter(Reconciliations.cashing == True, Reconciliations.paymentmethod_id == 1)
-        .scalar()
+        get_sum_reconciliations(pay_methode_id=1, cashing=True)
+        + get_sum_reconciliations_costs(pay_methode_id=1, cashing=True)
+        + get_sum_reconciliations_other(pay_methode_id=1, cashing=True)
     )
 
     return round(
@@ -163,79 +302,55 @@ def get_caisse():
     )
 
 
+@request_memoized
+@db.on_replica
 def get_stock():
     today = datetime.date.today()
-    res = (
-        Stocks.query_sum()
-        .filter(Stocks.date <= today)
-        .order_by(Stocks.date.desc())
-        .group_by(Stocks.date)
-        .all()
-    )
-    if len(res) > 0:
-        return round(res[0][0], 3)
+    close, closing = get_closing(today)
+    query = Stocks.query_sum().filter(Stocks.date <= today)
+    if close:
+        query = query.filter(Stocks.date > close)
+
+    res = query.order_by(Stocks.date.desc()).group_by(Stocks.date).first()
+    if res is not None:
+        return round(res[0], 3)
     else:
-        return round(0, 3)
+        return round(closing.sum("stocks"), 3)
 
 
+@request_memoized
 def get_costs(cost=0, pay_methode=0):
 
-    query = CostsMapping.query_sum()
-    if pay_methode:
-        query = query.filter(CostsMapping.paymentmethod_id == pay_methode)
-    if cost:
-        query = query.filter(CostsMapping.cost_id == cost)
-
-    sum_cost = query.scalar()
+    sum_cost = get_ledger_aggregates().sum("costs", cost, pay_methode)
 
     # sum_decaissements = get_sum_reconciliations(pay_methode_id=pay_methode, cashing=False)
 
     return round(sum_cost, 3)
 
 
+@request_memoized
 def get_purchasing(company=0, pay_methode=0):
 
-    query = Purchasing.query_sum()
-
-    if company:
-        query = query.filter(Purchasing.company_id == company)
-
-    if pay_methode:
-        query = query.filter(Purchasing.paymentmethod_id == pay_methode)
-
-    sum_purchasing = query.scalar()
+    sum_purchasing = get_ledger_aggregates().sum("purchasing", company, pay_methode)
 
     return round(sum_purchasing, 3)
 
 
+@request_memoized
 def get_payments_per_company(company=0, pay_methode=0):
-    query = Payments.query_sum().filter(Payments.company_id.isnot(None))
-
-    if company:
-        query = query.filter(Payments.company_id == company)
-
-    if pay_methode:
-        query = query.filter(Payments.paymentmethod_id == pay_methode)
-
-    sum_payments = query.scalar()
+    sum_payments = get_ledger_aggregates().sum("payments_companies", company, pay_methode)
 
     return round(sum_payments, 3)
 
 
+@request_memoized
 def get_payments_per_cost(cost=0, pay_methode=0):
-    query = Payments.query_sum().filter(Payments.cost_id.isnot(None))
-
-    if cost:
-        query = query.filter(Payments.cost_id == cost)
-
-    if pay_methode:
-        query = query.filter(Payments.paymentmethod_id == pay_methode)
-
-    sum_payments = query.scalar()
+    sum_payments = get_ledger_aggregates().sum("payments_costs", cost, pay_methode)
 
     return round(sum_payments, 3)
 
 
+@request_memoized
 def get_liabilites_per_company(company=0, pay_methode=0):
 
     sum_purchasing = get_purchasing(company=company, pay_methode=pay_methode)
@@ -250,6 +365,7 @@ def get_liabilites_per_company(company=0, pay_methode=0):
     return round(sum_purchasing + sum_payments - sum_decaissements, 3)
 
 
+@request_memoized
 def get_liabilites_per_cost(cost=0, pay_methode=0):
 
     sum_costs = get_costs(cost == cost, pay_methode=pay_methode)
@@ -264,6 +380,7 @@ def get_liabilites_per_cost(cost=0, pay_methode=0):
     return round(sum_costs + sum_payments - sum_decaissements, 3)
 
 
+@request_memoized
 def get_debt_per_company(company=0):
 
     sum_purchasing = get_purchasing(company=company, pay_methode=4)
@@ -273,6 +390,7 @@ def get_debt_per_company(company=0):
     return round(sum_purchasing - sum_payments, 3)
 
 
+@request_memoized
 def get_debt_per_cost(cost=0):
 
     sum_costs = get_costs(cost=cost, pay_methode=4)
@@ -282,22 +400,19 @@ def get_debt_per_cost(cost=0):
     return round(sum_costs - sum_payments, 3)
 
 
+@request_memoized
 def get_debt():
     print(get_purchasing(pay_methode=4), get_payments_per_company(), get_debt_per_company())
     return round(get_debt_per_company() + get_debt_per_cost(), 3)
 
 
+@request_memoized
 def get_all_liabilities():  # tout les engagements/dettes
 
-    sum_cost = (
-        CostsMapping.query_sum()
-        .filter(CostsMapping.paymentmethod_id.notin_([1, 6]))  # TODO: to be verified
-        .scalar()
-    )
+    # TODO: to be verified, everything but Espèce (1) and Ticket Resto (6)
+    sum_cost = get_costs() - get_costs(pay_methode=1) - get_costs(pay_methode=6)
     sum_purchasing = (
-        Purchasing.query_sum()
-        .filter(Purchasing.paymentmethod_id.notin_([1, 6]))  # TODO: to be verified
-        .scalar()
+        get_purchasing() - get_purchasing(pay_methode=1) - get_purchasing(pay_methode=6)
     )
 
     sum_decaissements = get_sum_reconciliations(cashing=False)
@@ -305,6 +420,7 @@ def get_all_liabilities():  # tout les engagements/dettes
     return round(sum_cost + sum_purchasing - sum_decaissements, 3)
 
 
+@request_memoized
 def get_economic_situation():
     res = (
         get_sold_clients()
@@ -321,26 +437,30 @@ def get_economic_situation():
     return round(res, 3)
 
 
+@request_memoized
 def get_financial_capacity():
 
     return round(get_banque() + get_caisse() - get_all_liabilities(), 3)
 
 
+@request_memoized
+@db.on_replica
 def get_chiffre_affaire(cum=False, pay_methode=0):
     today = datetime.date.today()
     currentMonth = datetime.datetime.now().month
     # if cum:
     #     date_ = [datetime.date.today(),datetime.date.today()]
-    sale_query = Sales.query_sum()
+    table, criteria = ledger_source(Sales)
+    sale_query = table.query_sum().filter(*criteria)
 
     if cum:
-        sale_query = sale_query.filter(extract("month", Sales.date) == currentMonth)
+        sale_query = sale_query.filter(extract("month", table.date) == currentMonth)
     else:
-        sale_query = sale_query.filter(Sales.date == today)
+        sale_query = sale_query.filter(table.date == today)
 
     if pay_methode:
 
-        sale_query = sale_query.filter(Sales.paymentmethod_id == pay_methode)
+        sale_query = sale_query.filter(table.paymentmethod_id == pay_methode)
 
     sum_sales = sale_query.scalar()
 
@@ -349,34 +469,43 @@ def get_chiffre_affaire(cum=False, pay_methode=0):
 
 # ********************************** exploitation ********************************
 
+OPERATING_INCOME_TAX = 0.25
 
+
+@request_memoized
+@db.on_replica
 def get_sales_on_date(start=None, end=None, cum=0, today=0):
-    query = Sales.query_sum()
+    table, criteria = ledger_source(Sales)
+    query = table.query_sum().filter(*criteria)
 
     if cum:
         start = datetime.datetime.today().replace(day=1).date()
-        query = query.filter(Sales.date >= start)
+        query = query.filter(table.date >= start)
     else:
         if today:
             start = datetime.date.today()
-            query = query.filter(Sales.date == start)
+            query = query.filter(table.date == start)
         else:
             if start:
-                query = query.filter(Sales.date >= start)
+                query = query.filter(table.date >= start)
 
             if end:
-                query = query.filter(Sales.date <= end)
+                query = query.filter(table.date <= end)
 
     return round(query.scalar(), 3)
 
 
+@request_memoized
+@db.on_replica
 def get_stock_on_date(initial=0, cum=0, today=0):
 
     query = Stocks.query_sum()
+    until = None
 
     if cum:
         start = datetime.datetime.today().replace(day=1).date()  # first day of the  month
         query = query.filter(Stocks.date <= start)
+        until = start
     else:
         if today:
             start = datetime.date.today()
@@ -386,34 +515,43 @@ def get_stock_on_date(initial=0, cum=0, today=0):
     if initial:
         today = today - datetime.timedelta(days=1)
 
-    res = query.order_by(Stocks.date.desc()).group_by(Stocks.date).all()
+    # counts before the latest close are in its snapshot
+    close, closing = get_closing(until)
+    if close:
+        query = query.filter(Stocks.date > close)
+
+    res = query.order_by(Stocks.date.desc()).group_by(Stocks.date).first()
 
-    if len(res) > 0:
-        return round(res[0][0], 3)
+    if res is not None:
+        return round(res[0], 3)
     else:
-        return round(0, 3)
+        return round(closing.sum("stocks"), 3)
 
 
+@request_memoized
+@db.on_replica
 def get_purchasing_on_date(start=None, end=None, cum=0, today=0):
 
-    query = Purchasing.query_sum()
+    table, criteria = ledger_source(Purchasing)
+    query = table.query_sum().filter(*criteria)
 
     if cum:
         start = datetime.datetime.today().replace(day=1).date()
-        query = query.filter(Purchasing.date >= start)
+        query = query.filter(table.date >= start)
     else:
         if today:
             start = datetime.date.today()
-            query = query.filter(Purchasing.date == start)
+            query = query.filter(table.date == start)
         else:
             if start:
-                query = query.filter(Purchasing.date >= start)
+                query = query.filter(table.date >= start)
             if end:
-                query = query.filter(Purchasing.date <= end)
+                query = query.filter(table.date <= end)
 
     return round(query.scalar(), 3)
 
 
+@request_memoized
 def get_costo_goods_sold(cum=0, today=0):
     res = (get_stock_on_date(initial=True) - get_stock_on_date()) + get_purchasing_on_date(
         cum=cum, today=today
@@ -421,31 +559,40 @@ def get_costo_goods_sold(cum=0, today=0):
     return round(res, 3)
 
 
+@request_memoized
 def get_gross_margin(cum=0, today=0):
     res = get_sales_on_date(cum=cum, today=today) - get_costo_goods_sold(cum=cum, today=today)
     return round(res, 3)
 
 
+@request_memoized
+@db.on_replica
 def get_costs_on_date(start=None, end=None, cum=0, today=0, fixed=0):
 
-    query = CostsMapping.query_sum().join(CostsDef).filter(CostsDef.fixed == fixed)
+    table, criteria = ledger_source(CostsMapping)
+    query = table.query_sum().filter(*criteria)
+    if table is DailyFacts:
+        query = query.filter(DailyFacts.fixed == bool(fixed))
+    else:
+        query = query.join(CostsDef).filter(CostsDef.fixed == fixed)
 
     if cum:
         start = datetime.datetime.today().replace(day=1).date()
-        query = query.filter(CostsMapping.date >= start)
+        query = query.filter(table.date >= start)
     else:
         if today:
             start = datetime.date.today()
-            query = query.filter(CostsMapping.date == start)
+            query = query.filter(table.date == start)
         else:
             if start:
-                query = query.filter(CostsMapping.date >= start)
+                query = query.filter(table.date >= start)
             if end:
-                query = query.filter(CostsMapping.date <= end)
+                query = query.filter(table.date <= end)
 
     return round(query.scalar(), 3)
 
 
+@request_memoized
 def get_gross_operating_income(cum=0, today=0):
     res = get_gross_margin(cum=cum, today=today) - (
         get_costs_on_date(cum=cum, today=today)
@@ -454,11 +601,13 @@ def get_gross_operating_income(cum=0, today=0):
     return round(res, 3)
 
 
+@request_memoized
 def get_tax_gross_operating_income(cum=0, today=0):
-    res = 0.25 * get_gross_operating_income(cum=cum, today=today)
+    res = OPERATING_INCOME_TAX * get_gross_operating_income(cum=cum, today=today)
     return round(res, 3)
 
 
+@request_memoized
 def get_net_operating_income(cum=0, today=0):
     amorti = 0
     res = (
@@ -469,22 +618,199 @@ def get_net_operating_income(cum=0, today=0):
     return round(res, 3)
 
 
+@request_memoized
+def get_exploit_figures():
+    """Every figure of the exploitation page, for today and the month to date."""
+    figures = {
+        "stock_initial": get_stock_on_date(initial=True),
+        "stock_final": get_stock_on_date(),
+        "fixed_costs": {
+            "today": get_costs_on_date(today=True, fixed=True),
+            "cum": get_costs_on_date(cum=True, fixed=True),
+        },
+        "variable_costs": {
+            "today": get_costs_on_date(today=True),
+            "cum": get_costs_on_date(cum=True),
+        },
+    }
+
+    for name, helper in [
+        ("sales", get_sales_on_date),
+        ("purchasing", get_purchasing_on_date),
+        ("costo_goods_sold", get_costo_goods_sold),
+        ("gross_margin", get_gross_margin),
+        ("gross_operating_income", get_gross_operating_income),
+        ("tax_gross_operating_income", get_tax_gross_operating_income),
+        ("net_operating_income", get_net_operating_income),
+    ]:
+        figures[name] = {"today": helper(today=True), "cum": helper(cum=True)}
+
+    return figures
+
+
+@db.on_replica
+def get_income_statement(periods):
+    """Income statement of every ``(start, end)`` period, in the order given.
+
+    The sales, purchases and costs are read with one query grouped by day (one
+    per ledger without ``LEDGER_DAILY_FACTS``) and the stock counts with two,
+    whatever the number of periods, each period then sums its days. The cost of
+    goods sold is the stock variation from the last count before the period to
+    the last one in it, plus the purchases.
+    """
+    periods = list(periods)
+    first = min(start for start, _ in periods)
+    last = max(end for _, end in periods)
+
+    daily = defaultdict(float)
+    if current_app.config["LEDGER_DAILY_FACTS"]:
+        rows = DailyFacts.query_sum_by(DailyFacts.ledger, DailyFacts.date, DailyFacts.fixed).filter(
+            DailyFacts.ledger.in_(["sales", "purchasing", "costs"]),
+            DailyFacts.date >= first,
+            DailyFacts.date <= last,
+        )
+    else:
+        rows = []
+        for model in (Sales, Purchasing):
+            query = model.query_sum_by(model.date).filter(model.date >= first, model.date <= last)
+            rows += [(LEDGERS[model], date, None, amount) for date, amount in query]
+        query = (
+            CostsMapping.query_sum_by(CostsMapping.date, CostsDef.fixed)
+            .join(CostsDef)
+            .filter(CostsMapping.date >= first, CostsMapping.date <= last)
+        )
+        rows += [("costs", date, fixed, amount) for date, fixed, amount in query]
+
+    for ledger, date, fixed, amount in rows:
+        if ledger == "costs":
+            ledger = "fixed_costs" if fixed else "variable_costs"
+        daily[(ledger, date)] += amount
+
+    counts = list(
+        Stocks.query_sum_by(Stocks.date)
+        .filter(Stocks.date >= first, Stocks.date <= last)
+        .order_by(Stocks.date)
+    )
+    # the last count before the periods, from the latest close when it is older
+    close, closing = get_closing(first - datetime.timedelta(days=1))
+    query = Stocks.query_sum_by(Stocks.date).filter(Stocks.date < first)
+    if close:
+        query = query.filter(Stocks.date > close)
+    before = query.order_by(Stocks.date.desc()).first()
+    opening = before[1] if before is not None else closing.sum("stocks")
+
+    def stock_at(day):
+        stock = opening
+        for date, amount in counts:
+            if date > day:
+                break
+            stock = amount
+        return stock
+
+    statement = []
+    for start, end in periods:
+        figures = defaultdict(float)
+        for (ledger, date), amount in daily.items():
+            if start <= date <= end:
+                figures[ledger] += amount
+
+        stock_initial = stock_at(start - datetime.timedelta(days=1))
+        stock_final = stock_at(end)
+        costo_goods_sold = stock_initial - stock_final + figures["purchasing"]
+        gross_margin = figures["sales"] - costo_goods_sold
+        gross_operating_income = gross_margin - figures["fixed_costs"] - figures["variable_costs"]
+        tax = OPERATING_INCOME_TAX * gross_operating_income
+        amorti = 0
+
+        lines = dict(
+            sales=figures["sales"],
+            stock_initial=stock_initial,
+            stock_final=stock_final,
+            purchasing=figures["purchasing"],
+            costo_goods_sold=costo_goods_sold,
+            gross_margin=gross_margin,
+            fixed_costs=figures["fixed_costs"],
+            variable_costs=figures["variable_costs"],
+            gross_operating_income=gross_operating_income,
+            tax_gross_operating_income=tax,
+            net_operating_income=gross_operating_income - tax - amorti,
+        )
+        statement.append(
+            dict({name: round(value, 3) for name, value in lines.items()}, start=start, end=end)
+        )
+
+    return statement
+
+
 # ********************************** Tresorerie ********************************
 
 
+@request_memoized
+@db.on_replica
 def get_banque_on_date(start=None, end=None, today=0):
-    query = Reconciliations.query_sum()
+    table, criteria = ledger_source(Reconciliations)
+    query = table.query_sum().filter(*criteria)
+    opening = 0
 
     if today:
         start = datetime.date.today()
-        query = query.filter(Reconciliations.date == start)
+        query = query.filter(table.date == start)
     else:
         if start:
-            query = query.filter(Reconciliations.date >= start)
+            query = query.filter(table.date >= start)
+        else:
+            # the balance up to the latest close is in its snapshot
+            close, closing = get_closing(end)
+            if close:
+                opening = closing_bank(closing)
+                query = query.filter(table.date > close)
         if end:
-            query = query.filter(Reconciliations.date <= end)
-
-    sum_encaissements = query.filter(Reconciliations.cashing == True).scalar()
-    sum_decaissements = query.filter(Reconciliations.cashing == False).scalar()
-
-    return round(sum_encaissements - sum_decaissements, 3)
+            query = query.filter(table.date <= end)
+
+    sum_encaissements = query.filter(table.cashing == True).scalar()
+    sum_decaissements = query.filter(table.cashing == False).scalar()
+
+    return round(opening + sum_encaissements - sum_decaissements, 3)
+
+
+@request_memoized
+@db.on_replica
+def get_treasury_week(first_day, pay_methodes=(1, 2, 3, 5, 6, 7)):
+    """Daily cashing/debt per payment method and running bank balances for a week.
+
+    One GROUP BY over (date, paymentmethod_id, cashing) gives every daily sum and
+    one more query gives the balance before ``first_day``, opening and closing
+    balances are then running sums over the seven days.
+    """
+    days = [first_day + datetime.timedelta(days=n) for n in range(7)]
+
+    table, criteria = ledger_source(Reconciliations)
+    # the opening balance starts from the latest close before the week
+    close, closing = get_closing(first_day - datetime.timedelta(days=1))
+    balance = closing_bank(closing)
+    opening = table.query_sum_by(table.cashing).filter(*criteria, table.date < first_day)
+    if close:
+        opening = opening.filter(table.date > close)
+    for cashing, amount in opening:
+        if cashing == True:
+            balance += amount
+        elif cashing == False:
+            balance -= amount
+
+    sums = defaultdict(float)
+    for date, pay_methode, cashing, amount in table.query_sum_by(
+        table.date, table.paymentmethod_id, table.cashing
+    ).filter(*criteria, table.date >= days[0], table.date <= days[-1]):
+        sums[(date, pay_methode, cashing)] += amount
+        sums[(date, 0, cashing)] += amount
+
+    init_sold, end_sold, caching, debt = [], [], [], []
+    for day in days:
+        init_sold.append(round(balance, 3))
+        balance += sums[(day, 0, True)] - sums[(day, 0, False)]
+        end_sold.append(round(balance, 3))
+
+        caching.append([round(sums[(day, pm, True)], 3) for pm in pay_methodes])
+        debt.append([round(sums[(day, pm, False)], 3) for pm in pay_methodes])
+
+    return dict(init_sold=init_sold, end_sold=end_sold, caching=caching, debt=debt)
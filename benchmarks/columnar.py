@@ -0,0 +1,208 @@
+"""Period aggregates from the columnar snapshot against the SQL helpers of ``utils.py``.
+
+    python -m benchmarks.columnar --size 1x220x10 --database /tmp/columnar.db
+
+Needs NumPy. Each operation is run ``--repeat`` times for random periods of the
+tenant's history, once through the ``get_*`` helpers (one or more SQL queries
+per call, on the daily facts or the ledgers as configured) and once on the
+snapshot of ``columnar.py``. The JSON output also holds the snapshot's load
+time, memory and the cost of an incremental refresh after one write.
+"""
+import argparse
+import datetime
+import json
+import logging
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+from flask import g, session
+from flask_login import login_user
+from sqlalchemy.sql import func
+
+from app import cache, create_app, db
+from app.models import Sales, User, load_user
+from app.utilities import columnar, utils
+from benchmarks.data import generate
+
+
+def make_app(uri, facts):
+    app = create_app("testing")
+    app.config.update(
+        SECRET_KEY="benchmark",
+        DATABASE_URI=uri,
+        SQL_INSTRUMENTATION=False,
+        LAZY_LOAD_GUARD=None,
+        LEDGER_DAILY_FACTS=facts,
+        CACHE_TYPE="lru",
+    )
+    app.logger.setLevel(logging.WARNING)
+    db.init_app(app)
+    cache.init_app(app)
+    return app
+
+
+def sql_operations():
+    """``{name: f(start, end)}`` answered by the helpers, a fresh request memo each call."""
+
+    def fresh(f):
+        def call(start, end):
+            g.pop("memo", None)
+            return f(start, end)
+
+        return call
+
+    return {
+        "sales": fresh(lambda start, end: utils.get_sales_on_date(start=start, end=end)),
+        "fixed costs": fresh(
+            lambda start, end: utils.get_costs_on_date(start=start, end=end, fixed=True)
+        ),
+        "bank balance": fresh(lambda start, end: utils.get_banque_on_date(end=end)),
+        "treasury week": fresh(lambda start, end: utils.get_treasury_week(start)),
+        "balances": fresh(lambda start, end: utils.LedgerAggregates.from_ledgers()),
+    }
+
+
+def columnar_operations(snapshot):
+    def bank(start, end):
+        return snapshot.sum("reconciliations", end=end, cashing=True) - snapshot.sum(
+            "reconciliations", end=end, cashing=False
+        )
+
+    def week(start, end):
+        end = start + datetime.timedelta(days=6)
+        opening = bank(None, start - datetime.timedelta(days=1))
+        flows = snapshot.daily("reconciliations", start, end, cashing=True) - snapshot.daily(
+            "reconciliations", start, end, cashing=False
+        )
+        by_methode = [
+            snapshot.daily("reconciliations", start, end, pay_methode=pay_methode, cashing=cashing)
+            for pay_methode in (1, 2, 3, 5, 6, 7)
+            for cashing in (True, False)
+        ]
+        return opening + flows.cumsum(), by_methode
+
+    return {
+        "sales": lambda start, end: snapshot.sum("sales", start=start, end=end),
+        "fixed costs": lambda start, end: snapshot.sum("costs", start=start, end=end, fixed=True),
+        "bank balance": bank,
+        "treasury week": week,
+        "balances": lambda start, end: utils.LedgerAggregates.from_balances(
+            snapshot.balance_rows()
+        ),
+    }
+
+
+def time_operation(operation, periods):
+    timings = []
+    for start, end in periods:
+        started = time.perf_counter()
+        operation(start, end)
+        timings.append(time.perf_counter() - started)
+    return round(statistics.mean(timings) * 1000, 3)
+
+
+def run(args):
+    uri = f"sqlite:///{args.database}"
+    app = make_app(uri, not args.ledgers)
+    with app.test_request_context():
+        if not os.path.exists(args.database) or not os.path.getsize(args.database):
+            db.create_all()
+            tenants, companies, years = args.size.split("x")
+            generate(tenants=int(tenants), companies=int(companies), years=float(years))
+
+        # the helpers read the tenant of the logged in user's session
+        login_user(load_user(db.session.query(User.id).filter_by(email="user1@test.com").scalar()))
+        sale = db.session.query(Sales).order_by(Sales.id).first()
+        tenant_id = session["tenant"] = sale.tenant_id
+        first_day = db.session.query(func.min(Sales.date)).scalar()
+        today = datetime.date.today()
+
+        # with the in-process cache a refresh still checks the ledgers, nothing changed or not
+        cache.bump_tenant(tenant_id)
+        started = time.perf_counter()
+        snapshot = columnar.snapshot(tenant_id)
+        load = time.perf_counter() - started
+
+        started = time.perf_counter()
+        columnar.snapshot(tenant_id)
+        noop = time.perf_counter() - started
+
+        db.session.add(Sales(sale.company_id, 1, today, 10.0, "benchmark"))
+        db.session.commit()
+        cache.bump_tenant(tenant_id)
+        started = time.perf_counter()
+        columnar.snapshot(tenant_id)
+        refresh = time.perf_counter() - started
+
+        rng = random.Random(0)
+        span = (today - first_day).days
+        periods = []
+        for _ in range(args.repeat):
+            start = first_day + datetime.timedelta(days=rng.randrange(span))
+            periods.append((start, min(today, start + datetime.timedelta(days=30))))
+
+        sql, memory = sql_operations(), columnar_operations(snapshot)
+        operations = []
+        for name in sql:
+            # the full GROUP BY is slow, a few runs are enough
+            runs = periods[:3] if name == "balances" else periods
+            sql_ms, columnar_ms = time_operation(sql[name], runs), time_operation(
+                memory[name], runs
+            )
+            operations.append(
+                {
+                    "operation": name,
+                    "sql_ms": sql_ms,
+                    "columnar_ms": columnar_ms,
+                    "speedup": round(sql_ms / columnar_ms, 1) if columnar_ms else None,
+                }
+            )
+            print(
+                f"{name:14} {sql_ms:9.3f} ms sql {columnar_ms:9.3f} ms columnar",
+                file=sys.stderr,
+            )
+
+        return {
+            "rows": len(snapshot),
+            "source": "ledgers" if args.ledgers else "daily facts",
+            "load_s": round(load, 3),
+            "noop_refresh_ms": round(noop * 1000, 3),
+            "refresh_ms": round(refresh * 1000, 3),
+            "memory_mb": round(snapshot.nbytes / 1e6, 1),
+            "operations": operations,
+        }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--size", default="1x220x10", help="tenants x companies x years")
+    parser.add_argument("--database", help="SQLite file, generated when missing or empty")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--ledgers", action="store_true", help="helpers read the ledger tables")
+    parser.add_argument("--output", help="JSON file, stdout by default")
+    args = parser.parse_args(argv)
+
+    if columnar.numpy is None:
+        parser.error("numpy is not installed")
+
+    if args.database:
+        report = run(args)
+    else:
+        with tempfile.TemporaryDirectory() as directory:
+            args.database = os.path.join(directory, "columnar.db")
+            report = run(args)
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(report, output, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""Compare two ``benchmarks.run`` reports, exits with 1 on a regression.
+
+    python -m benchmarks.compare base.json head.json --threshold 1.25
+"""
+import argparse
+import json
+import sys
+
+
+def size_label(size):
+    return f"{size['tenants']}x{size['companies']}x{size['years']:g}"
+
+
+def pages(report):
+    return {
+        (size_label(size["size"]), page["path"]): page
+        for size in report["sizes"]
+        for page in size["pages"]
+    }
+
+
+def compare(base, head, threshold=1.25):
+    """Rows of ``(size, path, base, head, ratio, regression)`` for the pages of both reports.
+
+    A page regresses when its median latency grows by more than ``threshold``
+    or when it issues more queries.
+    """
+    base_pages, head_pages = pages(base), pages(head)
+    rows = []
+    for key in sorted(base_pages.keys() & head_pages.keys()):
+        before, after = base_pages[key], head_pages[key]
+        ratio = after["median_ms"] / before["median_ms"] if before["median_ms"] else 1.0
+        regression = ratio > threshold or after["queries"] > before["queries"]
+        rows.append((*key, before, after, ratio, regression))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("base")
+    parser.add_argument("head")
+    parser.add_argument("--threshold", type=float, default=1.25)
+    args = parser.parse_args(argv)
+
+    with open(args.base) as base, open(args.head) as head:
+        rows = compare(json.load(base), json.load(head), args.threshold)
+
+    for size, path, before, after, ratio, regression in rows:
+        print(
+            f"{'!!' if regression else '  '} {size:10} {path:25} "
+            f"{before['median_ms']:9.2f} -> {after['median_ms']:9.2f} ms ({ratio:5.2f}x) "
+            f"{before['queries']:4} -> {after['queries']:4} queries"
+        )
+
+    return 1 if any(row[-1] for row in rows) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,181 @@
+"""Read and write throughput of several processes sharing one SQLite file.
+
+    python -m benchmarks.concurrency --readers 4 --writers 2 --seconds 5
+
+Every profile runs against the same synthetic database: ``default`` is SQLite out of
+the box (rollback journal, deferred transactions, no retries), ``tuned`` the
+configuration's ``SQLITE_PRAGMAS`` with BEGIN IMMEDIATE and busy retries. Readers
+sum the sales of the tenant like the dashboards, writers add a sale per transaction.
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+from flask import current_app, session
+
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.sql import func
+
+from app import create_app, db
+from app.models import Sales
+from benchmarks.data import generate
+
+PROFILES = {
+    "default": dict(
+        SQLITE_PRAGMAS={"journal_mode": "delete", "synchronous": "full"},
+        SQLITE_BEGIN_IMMEDIATE=False,
+        SQLITE_BUSY_RETRIES=0,
+    ),
+    "tuned": {},
+}
+
+
+def make_app(uri, profile):
+    app = create_app("testing")
+    app.config.update(
+        SECRET_KEY="benchmark", DATABASE_URI=uri, SQL_INSTRUMENTATION=False, **PROFILES[profile]
+    )
+    app.logger.setLevel(logging.WARNING)
+    db.init_app(app)
+    return app
+
+
+def read(tenant_id):
+    db.session.info["read_only"] = True
+    try:
+        return (
+            db.session.query(func.sum(Sales.amount)).filter(Sales.tenant_id == tenant_id).scalar()
+        )
+    finally:
+        db.session.rollback()
+
+
+def write(sale):
+    db.session.info["immediate"] = current_app.config["SQLITE_BEGIN_IMMEDIATE"]
+    try:
+        db.session.add(Sales(**sale, comment="benchmark"))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+
+def worker(role, uri, profile, seconds, start, results):
+    app = make_app(uri, profile)
+    # the ledger models take their tenant from the session
+    with app.test_request_context():
+        sale = db.session.query(Sales).first()
+        session["tenant"] = sale.tenant_id
+        sale = dict(
+            company_id=sale.company_id,
+            paymentmethod_id=sale.paymentmethod_id,
+            date=sale.date,
+            amount=sale.amount,
+        )
+        db.session.rollback()
+
+        start.wait()
+        operations, errors, latencies = 0, 0, []
+        deadline = time.perf_counter() + seconds
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                read(session["tenant"]) if role == "reader" else write(sale)
+            except OperationalError:
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - started)
+            operations += 1
+        db.session.remove()
+
+    latencies.sort()
+    results.put(
+        {
+            "role": role,
+            "operations": operations,
+            "errors": errors,
+            "p95_ms": round(latencies[int(0.95 * (len(latencies) - 1))] * 1000, 2)
+            if latencies
+            else None,
+        }
+    )
+
+
+def run_profile(path, profile, readers, writers, seconds):
+    uri = f"sqlite:///{path}"
+    app = make_app(uri, profile)
+    with app.app_context():
+        # switches the journal mode, which is stored in the file
+        db.session.execute("SELECT 1")
+        db.session.remove()
+        db.engine.dispose()
+
+    start = multiprocessing.Event()
+    results = multiprocessing.Queue()
+    processes = [
+        multiprocessing.Process(target=worker, args=(role, uri, profile, seconds, start, results))
+        for role in ["reader"] * readers + ["writer"] * writers
+    ]
+    for process in processes:
+        process.start()
+    start.set()
+    # a worker that died never answers
+    workers = [results.get(timeout=seconds + 60) for _ in processes]
+    for process in processes:
+        process.join()
+
+    summary = {"profile": profile}
+    for role in ("reader", "writer"):
+        done = [result for result in workers if result["role"] == role]
+        summary[f"{role}s_per_s"] = round(sum(r["operations"] for r in done) / seconds, 1)
+        summary[f"{role}_errors"] = sum(r["errors"] for r in done)
+        summary[f"{role}_p95_ms"] = max((r["p95_ms"] or 0 for r in done), default=None)
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--writers", type=int, default=2)
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--size", default="1x10x1", help="tenants x companies x years")
+    parser.add_argument("--profile", action="append", choices=PROFILES, help="default both")
+    parser.add_argument("--output", help="JSON file, stdout by default")
+    args = parser.parse_args(argv)
+
+    tenants, companies, years = args.size.split("x")
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "concurrency.db")
+        app = make_app(f"sqlite:///{path}", "tuned")
+        with app.app_context():
+            db.create_all()
+            generate(tenants=int(tenants), companies=int(companies), years=float(years))
+            db.session.remove()
+            db.engine.dispose()
+
+        report = []
+        for profile in args.profile or list(PROFILES):
+            summary = run_profile(path, profile, args.readers, args.writers, args.seconds)
+            report.append(summary)
+            print(
+                f"{profile:8} {summary['readers_per_s']:9.1f} reads/s "
+                f"{summary['writers_per_s']:8.1f} writes/s "
+                f"{summary['reader_errors'] + summary['writer_errors']:5} busy errors",
+                file=sys.stderr,
+            )
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(report, output, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,235 @@
+"""Deterministic synthetic ledgers: N tenants x M companies x Y years up to today.
+
+Rows are inserted with executemany on the tables, the balances table and the
+daily facts are rebuilt afterwards since bulk inserts skip the session's flush events.
+"""
+import datetime
+import random
+
+from app import balances, db, facts, init_data
+from app.models import (
+    Companies,
+    CostsDef,
+    CostsMapping,
+    Payments,
+    Purchasing,
+    Reconciliations,
+    Recovers,
+    Sales,
+    Stocks,
+    TenantUsers,
+    Tenants,
+    User,
+)
+
+COSTS = [("loyer", True), ("salaires", True), ("electricite", False), ("transport", False)]
+
+# payment methods of the sales: espece, cheque, traite, credit, TPE, ticket resto
+SALES_METHODS = [1, 1, 1, 2, 3, 4, 4, 5, 6]
+PURCHASING_METHODS = [1, 2, 3, 4, 4]
+
+
+def insert(model, rows):
+    """Insert ``rows`` and return their ids, in order."""
+    ids = []
+    for row in rows:
+        ids.append(db.session.execute(model.__table__.insert(), row).inserted_primary_key[0])
+    return ids
+
+
+def insert_many(model, rows):
+    if rows:
+        db.session.execute(model.__table__.insert(), rows)
+
+
+def ledger_row(tenant_id, date, amount, comment, paymentmethod_id, **columns):
+    return dict(
+        tenant_id=tenant_id,
+        date=date,
+        amount=round(amount, 3),
+        comment=comment,
+        paymentmethod_id=paymentmethod_id,
+        createdAt=date,
+        updatedAt=date,
+        **columns,
+    )
+
+
+def document_row(tenant_id, date, amount, comment, paymentmethod_id, **columns):
+    """Ledgers with documents, cheques and traites fall due 30 days later."""
+    due_date = date + datetime.timedelta(days=30) if paymentmethod_id in [2, 3] else date
+    return ledger_row(
+        tenant_id,
+        date,
+        amount,
+        comment,
+        paymentmethod_id,
+        due_date=due_date,
+        document_number=f"{comment}-{date.isoformat()}",
+        **columns,
+    )
+
+
+def tenant_rows(tenant_id, customers, suppliers, costs, days, rng):
+    """Every ledger row of one tenant, per ledger model."""
+    rows = {
+        model: []
+        for model in [Sales, Recovers, Purchasing, CostsMapping, Payments, Reconciliations, Stocks]
+    }
+
+    for day in days:
+        weekday = day.isoweekday()
+        if weekday == 7:
+            continue
+
+        for company in customers:
+            method = rng.choice(SALES_METHODS)
+            amount = rng.uniform(50, 500)
+            rows[Sales].append(
+                document_row(tenant_id, day, amount, "vente", method, company_id=company)
+            )
+            if method in [1, 2, 5, 6]:
+                rows[Reconciliations].append(
+                    ledger_row(
+                        tenant_id,
+                        day,
+                        amount,
+                        "encaissement",
+                        method,
+                        cashing=True,
+                        company_id=company,
+                        cost_id=None,
+                    )
+                )
+            if weekday == 5:
+                amount = rng.uniform(100, 1000)
+                rows[Recovers].append(
+                    document_row(tenant_id, day, amount, "recouvrement", 1, company_id=company)
+                )
+                rows[Reconciliations].append(
+                    ledger_row(
+                        tenant_id,
+                        day,
+                        amount,
+                        "recouvrement",
+                        7,
+                        cashing=True,
+                        company_id=company,
+                        cost_id=None,
+                    )
+                )
+
+        if weekday in [1, 4]:
+            for company in suppliers:
+                method = rng.choice(PURCHASING_METHODS)
+                amount = rng.uniform(100, 1500)
+                rows[Purchasing].append(
+                    document_row(
+                        tenant_id, day, amount, "achat", method, company_id=company, month_for=day
+                    )
+                )
+                if weekday == 4:
+                    amount = rng.uniform(100, 1000)
+                    rows[Payments].append(
+                        document_row(
+                            tenant_id, day, amount, "paiement", 2, company_id=company, cost_id=None
+                        )
+                    )
+                    rows[Reconciliations].append(
+                        ledger_row(
+                            tenant_id,
+                            day,
+                            amount,
+                            "decaissement",
+                            2,
+                            cashing=False,
+                            company_id=company,
+                            cost_id=None,
+                        )
+                    )
+
+        if day.day == 1:
+            for cost in costs:
+                amount = rng.uniform(200, 3000)
+                rows[CostsMapping].append(
+                    document_row(tenant_id, day, amount, "charge", 3, cost_id=cost)
+                )
+                rows[Payments].append(
+                    document_row(
+                        tenant_id, day, amount / 2, "paiement", 1, company_id=None, cost_id=cost
+                    )
+                )
+                rows[Reconciliations].append(
+                    ledger_row(
+                        tenant_id,
+                        day,
+                        amount / 2,
+                        "charge",
+                        1,
+                        cashing=False,
+                        company_id=None,
+                        cost_id=cost,
+                    )
+                )
+
+        rows[Stocks].append(
+            dict(
+                tenant_id=tenant_id,
+                date=day,
+                amount=round(rng.uniform(1000, 5000), 3),
+                comment="inventaire",
+                createdAt=day,
+                updatedAt=day,
+            )
+        )
+
+    return rows
+
+
+def generate(tenants=1, companies=10, years=1, seed=0, today=None):
+    """Seed an empty database and fill every tenant's ledgers, returns the row count.
+
+    The admin user of ``init_data`` is a member of every tenant, tenants and
+    their memberships share their ids like the seeded first tenant.
+    """
+    rng = random.Random(seed)
+    today = today or datetime.date.today()
+    first_day = today - datetime.timedelta(days=int(365 * years))
+    days = [first_day + datetime.timedelta(days=n) for n in range((today - first_day).days + 1)]
+
+    init_data()
+    admin = db.session.query(User).filter_by(email="user1@test.com").one()
+    for n in range(2, tenants + 1):
+        tenant = Tenants(name=f"Tenant {n}", email=f"tenant{n}@test.com")
+        db.session.add(tenant)
+        db.session.add(TenantUsers(user=admin, tenant=tenant))
+    db.session.commit()
+
+    count = 0
+    for tenant_id in range(1, tenants + 1):
+        ids = insert(
+            Companies,
+            [
+                dict(
+                    tenant_id=tenant_id,
+                    name=f"t{tenant_id} company {n}",
+                    customer=n % 2 == 0,
+                    supplier=n % 2 == 1,
+                )
+                for n in range(companies)
+            ],
+        )
+        customers, suppliers = ids[::2], ids[1::2]
+        costs = insert(
+            CostsDef,
+            [dict(tenant_id=tenant_id, name=name, fixed=fixed) for name, fixed in COSTS],
+        )
+
+        for model, rows in tenant_rows(tenant_id, customers, suppliers, costs, days, rng).items():
+            insert_many(model, rows)
+            count += len(rows)
+
+    db.session.commit()
+    balances.rebuild()
+    facts.rebuild()
+    return count
@@ -0,0 +1,177 @@
+"""Time the dashboards and ledger lists on synthetic data of several sizes.
+
+    python -m benchmarks.run --size 1x10x1 --size 2x40x3 --output head.json
+    python -m benchmarks.compare base.json head.json
+
+Every page is requested through the test client, once to warm up then
+``--repeat`` times. The JSON output holds per page and size the latency
+percentiles, the query count and SQL time from the instrumentation headers.
+"""
+import argparse
+import datetime
+import json
+import logging
+import platform
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+import sqlalchemy
+
+from app import create_app, db
+from benchmarks.data import generate
+
+PAGES = [
+    "/dashboards/dashboard",
+    "/dashboards/exploit",
+    "/dashboards/tresor",
+    "/sales/",
+    "/purchasings/",
+    "/recovers/",
+    "/costs/",
+    "/payments/",
+    "/payments/costs",
+    "/reconciliations/",
+    "/stocks/",
+    "/companies/",
+]
+
+
+def parse_size(value):
+    """``"<tenants>x<companies>x<years>"``"""
+    tenants, companies, years = value.split("x")
+    return {"tenants": int(tenants), "companies": int(companies), "years": float(years)}
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def make_app(config_name, database_uri):
+    app = create_app(config_name)
+    instrumented = app.config["SQL_INSTRUMENTATION"]
+    app.config.update(
+        SECRET_KEY="benchmark",
+        SESSION_COOKIE_NAME="session",
+        SESSION_COOKIE_SECURE=False,
+        SQL_INSTRUMENTATION=True,
+        LAZY_LOAD_GUARD=None,
+    )
+    # the per request log lines would drown the results
+    app.logger.setLevel(logging.WARNING)
+    if database_uri:
+        app.config["DATABASE_URI"] = database_uri
+        db.init_app(app)
+    elif not instrumented:
+        # the testing configuration leaves it off
+        db.init_instrumentation(app)
+    return app
+
+
+def time_page(client, path, repeat):
+    client.get(path)
+
+    timings, queries, db_times = [], [], []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        response = client.get(path)
+        timings.append((time.perf_counter() - started) * 1000)
+
+        if response.status_code != 200:
+            raise RuntimeError(f"{path} answered {response.status_code}")
+        queries.append(int(response.headers.get("X-DB-Queries", 0)))
+        db_time = re.search(r"db;dur=([\d.]+)", response.headers.get("Server-Timing", ""))
+        db_times.append(float(db_time.group(1)) if db_time else 0.0)
+
+    return {
+        "path": path,
+        "median_ms": round(statistics.median(timings), 2),
+        "p95_ms": round(percentile(timings, 0.95), 2),
+        "min_ms": round(min(timings), 2),
+        "queries": max(queries),
+        "db_ms": round(statistics.median(db_times), 2),
+    }
+
+
+def run_size(size, pages, repeat, seed, config_name="testing", database_uri=None):
+    app = make_app(config_name, database_uri)
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        started = time.perf_counter()
+        rows = generate(seed=seed, **size)
+        generated = time.perf_counter() - started
+        db.session.remove()
+
+    client = app.test_client()
+    client.post("/login", data={"email": "user1@test.com", "password": "test"})
+
+    results = []
+    for path in pages:
+        result = time_page(client, path, repeat)
+        results.append(dict(result, size=size, rows=rows))
+        print(
+            f"{size['tenants']}x{size['companies']}x{size['years']:g} {path:25} "
+            f"{result['median_ms']:9.2f} ms {result['queries']:4} queries",
+            file=sys.stderr,
+        )
+
+    with app.app_context():
+        db.drop_all()
+        db.session.remove()
+
+    return {"size": size, "rows": rows, "generate_s": round(generated, 2), "pages": results}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--size",
+        action="append",
+        type=parse_size,
+        help="tenants x companies x years, may be repeated (default 1x10x1 and 2x20x2)",
+    )
+    parser.add_argument("--page", action="append", help="only time these paths")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--config", default="testing", help="configuration of create_app")
+    parser.add_argument("--database", help="database URI, the configuration's by default")
+    parser.add_argument("--output", help="JSON file, stdout by default")
+    args = parser.parse_args(argv)
+
+    sizes = args.size or [parse_size("1x10x1"), parse_size("2x20x2")]
+    report = {
+        "commit": git_commit(),
+        "date": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "sqlalchemy": sqlalchemy.__version__,
+        "repeat": args.repeat,
+        "seed": args.seed,
+        "sizes": [
+            run_size(size, args.page or PAGES, args.repeat, args.seed, args.config, args.database)
+            for size in sizes
+        ],
+    }
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(report, output, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+    return report
+
+
+if __name__ == "__main__":
+    main()
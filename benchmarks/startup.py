@@ -0,0 +1,139 @@
+"""Time to first response of a freshly started worker, with and without compiled templates.
+
+    python -m benchmarks.startup --workers 3
+
+Every worker is a new interpreter, like a uWSGI worker after a deploy. Modes:
+``none`` compiles every template on first use, ``cold`` starts with an empty
+``TEMPLATE_CACHE_DIR``, ``warm`` finds it filled by an earlier worker and
+``precompiled`` loads every template from the filled cache at startup, what
+wsgi.py does in the uWSGI master before forking.
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+PAGES = [
+    "/dashboards/dashboard",
+    "/dashboards/exploit",
+    "/sales/",
+    "/reconciliations/",
+]
+
+MODES = ["none", "cold", "warm", "precompiled"]
+
+
+def worker(mode, cache_dir, pages, results):
+    started = time.perf_counter()
+
+    from app import create_app, db
+    from app.commands import compile_templates
+    from benchmarks.data import generate
+
+    app = create_app("testing")
+    app.config.update(
+        SECRET_KEY="benchmark",
+        SESSION_COOKIE_NAME="session",
+        SESSION_COOKIE_SECURE=False,
+        SQL_INSTRUMENTATION=False,
+        LAZY_LOAD_GUARD=None,
+    )
+    if mode != "none":
+        from jinja2 import FileSystemBytecodeCache
+
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(cache_dir)
+    if mode == "precompiled":
+        compile_templates(app)
+    startup = time.perf_counter() - started
+
+    # the data is not part of the startup, a deployed worker finds it in the database
+    with app.app_context():
+        db.create_all()
+        generate(tenants=1, companies=5, years=0.1)
+        db.session.remove()
+    app.logger.setLevel(logging.WARNING)
+
+    client = app.test_client()
+    client.post("/login", data={"email": "user1@test.com", "password": "test"})
+    first = {}
+    for path in pages:
+        started = time.perf_counter()
+        response = client.get(path)
+        first[path] = (time.perf_counter() - started) * 1000
+        if response.status_code != 200:
+            raise RuntimeError(f"{path} answered {response.status_code}")
+
+    results.put({"startup_ms": startup * 1000, "first_response_ms": first})
+
+
+def run_worker(mode, cache_dir, pages):
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    process = context.Process(target=worker, args=(mode, cache_dir, pages, results))
+    process.start()
+    # a worker that died never answers
+    result = results.get(timeout=300)
+    process.join()
+    return result
+
+
+def run_mode(mode, workers, pages):
+    cache_dir = tempfile.mkdtemp()
+    try:
+        if mode in ("warm", "precompiled"):
+            run_worker(mode, cache_dir, pages)
+        runs = []
+        for _ in range(workers):
+            if mode == "cold":
+                shutil.rmtree(cache_dir)
+                os.mkdir(cache_dir)
+            runs.append(run_worker(mode, cache_dir, pages))
+    finally:
+        shutil.rmtree(cache_dir)
+
+    summary = {
+        "mode": mode,
+        "startup_ms": round(statistics.median(run["startup_ms"] for run in runs), 2),
+        "pages": {
+            path: round(statistics.median(run["first_response_ms"][path] for run in runs), 2)
+            for path in pages
+        },
+    }
+    summary["first_responses_ms"] = round(sum(summary["pages"].values()), 2)
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--workers", type=int, default=3, help="fresh workers per mode")
+    parser.add_argument("--mode", action="append", choices=MODES, help="default all")
+    parser.add_argument("--page", action="append", help="only time these paths")
+    parser.add_argument("--output", help="JSON file, stdout by default")
+    args = parser.parse_args(argv)
+
+    report = []
+    for mode in args.mode or MODES:
+        summary = run_mode(mode, args.workers, args.page or PAGES)
+        report.append(summary)
+        print(
+            f"{mode:12} startup {summary['startup_ms']:8.1f} ms "
+            f"first responses {summary['first_responses_ms']:8.1f} ms",
+            file=sys.stderr,
+        )
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(report, output, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+    return report
+
+
+if __name__ == "__main__":
+    main()
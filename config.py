@@ -27,6 +27,76 @@ class Config:
 
     CLIENT_NAME = environ.get("CLIENT_NAME")
 
+    # read dashboard figures from the balances table, see `flask balances rebuild`
+    LEDGER_BALANCES = environ.get("LEDGER_BALANCES", "true").lower() == "true"
+    # read the period sums of the reports from the daily facts, see `flask facts rebuild`
+    LEDGER_DAILY_FACTS = environ.get("LEDGER_DAILY_FACTS", "true").lower() == "true"
+    # answer the dashboard balances from a per process NumPy copy of the ledgers, it is
+    # only spared the check of the ledgers on every request with CACHE_TYPE "uwsgi"
+    LEDGER_COLUMNAR = environ.get("LEDGER_COLUMNAR", "false").lower() == "true"
+
+    # dashboard figures cache: "lru" (per process), "uwsgi" (shared, see app.ini) or "null"
+    CACHE_TYPE = environ.get("CACHE_TYPE") or "lru"
+    CACHE_LRU_SIZE = 1024
+    CACHE_UWSGI_NAME = "dashboard"
+    # the versions of the cached entries, apart so the figures never evict them
+    CACHE_UWSGI_VERSIONS_NAME = "dashboard_versions"
+    CACHE_DEFAULT_TIMEOUT = 3600
+    # logged in users, also dropped when a user, role or membership changes
+    PRINCIPAL_CACHE_TIMEOUT = 300
+
+    # compiled templates shared by the workers and kept across restarts, None to disable
+    TEMPLATE_CACHE_DIR = environ.get("TEMPLATE_CACHE_DIR")
+    # compile every template when wsgi.py loads the app, before uWSGI forks the workers
+    TEMPLATE_PRECOMPILE = False
+
+    # rows per page of the ledger lists, totals always cover the whole filter
+    LIST_PER_PAGE = int(environ.get("LIST_PER_PAGE") or 50)
+
+    # ledger rows fetched and written at a time by the CSV/XLSX exports, only CSV is
+    # streamed, an XLSX file is built whole before it is sent
+    EXPORT_CHUNK_SIZE = 1000
+
+    # CSV imports of the ledgers: upload size, rows per executemany, errors reported
+    IMPORT_MAX_CONTENT_LENGTH = 32 * 1000 * 1000
+    IMPORT_BATCH_SIZE = 1000
+    IMPORT_MAX_ERRORS = 100
+
+    # days between a statement line and the date a ledger row is expected on the account
+    RECONCILIATION_MATCH_DAYS = 10
+
+    # relationships lazy loaded while rendering a template: "raise", "warn" or None
+    LAZY_LOAD_GUARD = None
+
+    # per request query count and time headers, log line and the admin routes panel
+    SQL_INSTRUMENTATION = environ.get("SQL_INSTRUMENTATION", "true").lower() == "true"
+    # a statement repeated this many times in one request is reported as a likely N+1
+    SQL_N_PLUS_ONE_THRESHOLD = 5
+
+    # connection pool of PostgreSQL and SQLite files, per process
+    DATABASE_POOL_SIZE = int(environ.get("DATABASE_POOL_SIZE") or 5)
+    DATABASE_MAX_OVERFLOW = int(environ.get("DATABASE_MAX_OVERFLOW") or 10)
+    DATABASE_POOL_TIMEOUT = 30
+    # below the server's idle timeout, and ping so a restarted server is noticed
+    DATABASE_POOL_RECYCLE = 1800
+    DATABASE_POOL_PRE_PING = True
+    # read-only copy answering the dashboard figures of GET requests, primary when unset
+    DATABASE_REPLICA_URI = None
+
+    # applied to every new SQLite connection: readers no longer wait for writers under WAL
+    SQLITE_PRAGMAS = {
+        "busy_timeout": 5000,
+        "journal_mode": "wal",
+        "synchronous": "normal",
+        "cache_size": -64000,
+        "mmap_size": 256 * 1024 * 1024,
+        "temp_store": "memory",
+    }
+    # writing requests take the write lock at BEGIN, retried this often when it is busy
+    SQLITE_BEGIN_IMMEDIATE = True
+    SQLITE_BUSY_RETRIES = 5
+    SQLITE_BUSY_BACKOFF = 0.05
+
     @staticmethod
     def init_app(app):
         pass
@@ -36,18 +106,28 @@ class ProductionConfig(Config):
     DEBUG = False
     TESTING = False
     DATABASE_URI = environ.get("PROD_DATABASE_URI") or "sqlite:///test.db"
+    DATABASE_REPLICA_URI = environ.get("PROD_DATABASE_REPLICA_URI")
+    CACHE_TYPE = environ.get("CACHE_TYPE") or "uwsgi"
+    TEMPLATE_CACHE_DIR = environ.get("TEMPLATE_CACHE_DIR") or path.join(basedir, ".jinja_cache")
+    TEMPLATE_PRECOMPILE = True
 
 
 class DevelopmentConfig(Config):
     DEBUG = True
     TESTING = True
     DATABASE_URI = environ.get("DEV_DATABASE_URI") or "sqlite:///test.db"
+    DATABASE_REPLICA_URI = environ.get("DEV_DATABASE_REPLICA_URI")
+    LAZY_LOAD_GUARD = "warn"
 
 
 class TestingConfig(Config):
     DEBUG = True
     TESTING = True
     DATABASE_URI = environ.get("TEST_DATABASE_URI") or "sqlite://"
+    DATABASE_REPLICA_URI = environ.get("TEST_DATABASE_REPLICA_URI")
+    CACHE_TYPE = "null"
+    LAZY_LOAD_GUARD = "raise"
+    SQL_INSTRUMENTATION = False
 
 
 config = {
@@ -1,5 +1,7 @@
 import unittest
-from app import create_app, db
+from flask import session
+from flask_login import login_user
+from app import create_app, db, init_data
 
 
 class BasicsTestCase(unittest.TestCase):
@@ -13,3 +15,44 @@ class BasicsTestCase(unittest.TestCase):
         db.session.remove()
         db.drop_all()
         self.app_context.pop()
+
+
+class TenantTestCase(BasicsTestCase):
+    """Seeded database with the admin user logged in on the first tenant."""
+
+    def setUp(self):
+        super().setUp()
+        self.app.config["SECRET_KEY"] = "testing"
+        init_data()
+
+        from app.models import User, load_user
+
+        user = db.session.query(User.id).filter_by(email="user1@test.com").scalar()
+        self.user = load_user(user)
+        self.request_context = self.app.test_request_context()
+        self.request_context.push()
+        login_user(self.user)
+        session["tenant"] = self.user.tenants[0].id
+
+    def tearDown(self):
+        self.request_context.pop()
+        super().tearDown()
+
+
+class ClientTestCase(TenantTestCase):
+    """TenantTestCase with ``self.http``, a test client logged in as the admin user.
+
+    Put it first to combine it with a TenantTestCase subclass, the fixtures of the
+    other one are then in place before the login.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.app.config["SESSION_COOKIE_NAME"] = "session"
+        self.app.config["SESSION_COOKIE_SECURE"] = False
+        self.add_views()
+        self.http = self.app.test_client()
+        self.http.post("/login", data={"email": "user1@test.com", "password": "test"})
+
+    def add_views(self):
+        """Register the views of the test case, the app takes none after its first request."""
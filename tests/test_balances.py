@@ -0,0 +1,95 @@
+import datetime
+
+from flask import g
+
+from tests.test_utils import LedgerTestCase
+from app import db, balances
+from app.commands import balances_cli, db_cli
+from app.models import Balances, Payments, Reconciliations, Sales
+from app.utilities import utils
+
+
+def add_unchecked(*rows):
+    """Add rows the CHECK constraints refuse, as a database not enforcing them holds."""
+    connection = db.session.connection().connection.dbapi_connection
+    connection.execute("PRAGMA ignore_check_constraints = ON")
+    try:
+        db.session.add_all(rows)
+        db.session.commit()
+    finally:
+        connection.execute("PRAGMA ignore_check_constraints = OFF")
+
+
+class BalancesTestCase(LedgerTestCase):
+    def figures(self):
+        g.pop("ledger_aggregates", None)
+        g.pop("memo", None)
+        return [
+            utils.get_sold_clients(),
+            utils.get_banque(),
+            utils.get_caisse(),
+            utils.get_all_liabilities(),
+            utils.get_debt(),
+            utils.get_liabilites_per_company(self.supplier.id, 2),
+        ]
+
+    def test_inserts_are_applied(self):
+        self.assertEqual(balances.check(), [])
+        sales = db.session.query(Balances).filter_by(kind="sales", paymentmethod_id=4).one()
+        self.assertEqual((sales.amount, sales.count), (100.0, 1))
+
+    def test_updates_and_deletes_are_applied(self):
+        sale = db.session.query(Sales).filter_by(paymentmethod_id=4).one()
+        sale.amount = "70.5"
+        sale.paymentmethod_id = 2
+        payment = db.session.query(Payments).filter(Payments.cost_id.isnot(None)).one()
+        db.session.delete(payment)
+        db.session.add(
+            Reconciliations(None, False, self.supplier.id, 2, datetime.date.today(), 3.0, "x")
+        )
+        db.session.commit()
+
+        self.assertEqual(balances.check(), [])
+        self.assertEqual(db.session.query(Balances).filter_by(kind="payments_costs").one().count, 0)
+
+    def test_balances_answer_like_ledgers(self):
+        from_balances = self.figures()
+        self.app.config["LEDGER_BALANCES"] = False
+        self.assertEqual(self.figures(), from_balances)
+
+    def test_reconciliations_without_a_party(self):
+        bank, cash = utils.get_banque(), utils.get_caisse()
+        day = datetime.date.today()
+        add_unchecked(
+            Reconciliations(None, True, None, 1, day, 25.0, "versement"),
+            Reconciliations(None, False, None, 2, day, 5.0, "agios"),
+        )
+
+        self.assertEqual(balances.check(), [])
+        g.pop("ledger_aggregates", None)
+        g.pop("memo", None)
+        self.assertEqual((utils.get_banque(), utils.get_caisse()), (bank + 20.0, cash - 25.0))
+        from_balances = self.figures()
+        self.app.config["LEDGER_BALANCES"] = False
+        self.assertEqual(self.figures(), from_balances)
+
+    def test_rebuild(self):
+        db.session.query(Balances).delete()
+        db.session.commit()
+        self.assertNotEqual(balances.check(), [])
+
+        result = self.app.test_cli_runner().invoke(balances_cli, ["rebuild"])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("balances match the ledgers", result.output)
+        self.assertEqual(balances.check(), [])
+
+    def test_init_fills_a_new_table(self):
+        expected = self.figures()
+        db.session.close()
+        Balances.__table__.drop(db.engine)
+
+        result = self.app.test_cli_runner().invoke(db_cli, ["init"])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("balances match the ledgers", result.output)
+        self.assertEqual(balances.check(), [])
+        self.assertEqual(self.figures(), expected)
@@ -0,0 +1,77 @@
+import datetime
+import unittest
+
+from tests.basic import BasicsTestCase
+from app import balances, db
+from app.models import Sales, Stocks
+from app.utilities.columnar import numpy
+from benchmarks import columnar, compare, concurrency, run, startup
+from benchmarks.data import generate
+
+TODAY = datetime.date(2022, 6, 30)
+
+
+class GenerateTestCase(BasicsTestCase):
+    def test_deterministic_and_consistent(self):
+        rows = generate(tenants=2, companies=4, years=0.25, today=TODAY)
+        amounts = [amount for amount, in db.session.query(Sales.amount).order_by(Sales.id)]
+
+        self.assertEqual(balances.check(), [])
+        self.assertEqual(db.session.query(Stocks).filter(Stocks.tenant_id == 2).count(), 79)
+
+        db.drop_all()
+        db.create_all()
+        self.assertEqual(generate(tenants=2, companies=4, years=0.25, today=TODAY), rows)
+        self.assertEqual(
+            [amount for amount, in db.session.query(Sales.amount).order_by(Sales.id)], amounts
+        )
+
+
+class RunTestCase(BasicsTestCase):
+    def test_report(self):
+        report = run.main(
+            ["--size", "1x2x0.1", "--repeat", "1", "--page", "/sales/", "--output", "/dev/null"]
+        )
+
+        (size,) = report["sizes"]
+        (page,) = size["pages"]
+        self.assertEqual(page["path"], "/sales/")
+        self.assertGreater(page["queries"], 0)
+
+        slower = {"sizes": [dict(size, pages=[dict(page, queries=page["queries"] + 1)])]}
+        ((*_, regression),) = compare.compare(report, slower)
+        self.assertTrue(regression)
+
+
+class ConcurrencyTestCase(unittest.TestCase):
+    def test_report(self):
+        report = concurrency.main(
+            ["--size", "1x2x0.1", "--seconds", "0.3", "--readers", "1", "--writers", "1"]
+            + ["--output", "/dev/null"]
+        )
+
+        self.assertEqual([summary["profile"] for summary in report], ["default", "tuned"])
+        for summary in report:
+            self.assertGreater(summary["readers_per_s"], 0)
+            self.assertGreater(summary["writers_per_s"], 0)
+
+
+class StartupTestCase(unittest.TestCase):
+    def test_report(self):
+        (summary,) = startup.main(
+            ["--workers", "1", "--mode", "warm", "--page", "/sales/", "--output", "/dev/null"]
+        )
+        self.assertEqual(summary["mode"], "warm")
+        self.assertGreater(summary["pages"]["/sales/"], 0)
+
+
+@unittest.skipIf(numpy is None, "numpy is not installed")
+class ColumnarTestCase(unittest.TestCase):
+    def test_report(self):
+        report = columnar.main(["--size", "1x2x0.1", "--repeat", "2", "--output", "/dev/null"])
+
+        self.assertGreater(report["rows"], 0)
+        self.assertEqual(
+            [operation["operation"] for operation in report["operations"]],
+            ["sales", "fixed costs", "bank balance", "treasury week", "balances"],
+        )
@@ -0,0 +1,94 @@
+import time
+import unittest
+
+from tests.basic import ClientTestCase
+from app import cache, db
+from app.cache import LRUCache
+from app.commands import balances_cli, facts_cli
+from app.models import Companies, Tenants
+
+
+class LRUCacheTestCase(unittest.TestCase):
+    def test_evicts_least_recently_used(self):
+        lru = LRUCache(maxsize=2)
+        lru.set("a", 1)
+        lru.set("b", 2)
+        lru.get("a")
+        lru.set("c", 3)
+        self.assertEqual((lru.get("a"), lru.get("b"), lru.get("c")), (1, None, 3))
+
+    def test_timeout(self):
+        lru = LRUCache()
+        lru.set("a", 1, timeout=0.01)
+        time.sleep(0.02)
+        self.assertIsNone(lru.get("a"))
+
+    def test_unbounded(self):
+        lru = LRUCache(maxsize=None)
+        for n in range(2000):
+            lru.set(n, n)
+        self.assertEqual(lru.get(0), 0)
+
+
+class TenantCacheTestCase(ClientTestCase):
+    def setUp(self):
+        super().setUp()
+        self.app.config["CACHE_TYPE"] = "lru"
+        cache.init_app(self.app)
+        self.calls = 0
+
+    def compute(self):
+        self.calls += 1
+        return self.calls
+
+    def test_bump_invalidates(self):
+        self.assertEqual(cache.tenant_cached(1, "view", self.compute, week=1), 1)
+        self.assertEqual(cache.tenant_cached(1, "view", self.compute, week=1), 1)
+        self.assertEqual(cache.tenant_cached(1, "view", self.compute, week=2), 2)
+        self.assertEqual(cache.tenant_cached(2, "view", self.compute, week=1), 3)
+
+        cache.bump_tenant(1)
+        self.assertEqual(cache.tenant_cached(1, "view", self.compute, week=1), 4)
+        self.assertEqual(cache.tenant_cached(2, "view", self.compute, week=1), 3)
+
+    def test_write_views_bump_version(self):
+        version = cache.tenant_version(1)
+        self.http.post("/stocks/", data={"amount": "10", "date": "2022-01-01", "comment": "x"})
+        self.assertNotEqual(cache.tenant_version(1), version)
+
+    def test_company_delete_bumps_version(self):
+        company = Companies(name="client", customer=True)
+        db.session.add(company)
+        db.session.commit()
+
+        version = cache.tenant_version(1)
+        self.http.post(f"/companies/remove/{company.id}")
+        self.assertNotEqual(cache.tenant_version(1), version)
+
+    def test_rebuilds_bump_every_tenant(self):
+        db.session.add(Tenants(name="other", email="other@test.com"))
+        db.session.commit()
+        runner = self.app.test_cli_runner()
+
+        for cli in [balances_cli, facts_cli]:
+            versions = [cache.tenant_version(1), cache.tenant_version(2)]
+            result = runner.invoke(cli, ["rebuild"])
+            self.assertEqual(result.exit_code, 0, result.output)
+            self.assertNotEqual(cache.tenant_version(1), versions[0])
+            self.assertNotEqual(cache.tenant_version(2), versions[1])
+
+    def test_versions_survive_a_full_cache(self):
+        self.assertEqual(cache.tenant_cached(1, "view", self.compute), 1)
+        cache.bump_tenant(1)
+        version = cache.tenant_version(1)
+        # the figures fill the backend, the versions are kept apart
+        for n in range(2 * self.app.config["CACHE_LRU_SIZE"]):
+            cache.backend.set(f"filler:{n}", n)
+        self.assertEqual(cache.tenant_version(1), version)
+
+    def test_lost_version_never_comes_back(self):
+        self.assertEqual(cache.tenant_cached(1, "view", self.compute), 1)
+        cache.versions.delete("version:1")
+        cache.bump_tenant(1)
+        cache.versions.delete("version:1")
+        self.assertEqual(cache.tenant_cached(1, "view", self.compute), 2)
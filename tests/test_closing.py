@@ -0,0 +1,133 @@
+import datetime
+import io
+
+from flask import g
+
+from tests.test_balances import add_unchecked
+from tests.basic import ClientTestCase
+from tests.test_utils import LedgerTestCase
+from app import db
+from app.closing import ClosedPeriodError, close_period, reopen_period
+from app.commands import periods_cli
+from app.models import ClosingBalances, Reconciliations, Sales, Stocks
+from app.utilities import utils
+
+MAY = datetime.date(2022, 5, 1)
+
+
+class ClosingTestCase(ClientTestCase, LedgerTestCase):
+    def setUp(self):
+        super().setUp()
+        client, supplier = self.client.id, self.supplier.id
+        db.session.add_all(
+            [
+                Sales(client, 4, datetime.date(2022, 4, 20), 200.0, "credit"),
+                Sales(client, 4, datetime.date(2022, 5, 10), 300.0, "credit"),
+                Reconciliations(None, True, client, 7, datetime.date(2022, 4, 2), 100.0, "v"),
+                Reconciliations(None, False, supplier, 2, datetime.date(2022, 5, 3), 30.0, "c"),
+                Stocks(500.0, datetime.date(2022, 4, 30), "inventaire"),
+                Stocks(400.0, datetime.date(2022, 5, 31), "inventaire"),
+            ]
+        )
+        db.session.commit()
+
+    def figures(self):
+        g.pop("memo", None)
+        g.pop("ledger_aggregates", None)
+        return [
+            utils.get_banque_on_date(end=datetime.date(2022, 6, 15)),
+            utils.get_banque_on_date(),
+            utils.get_treasury_week(datetime.date(2022, 6, 6))["init_sold"],
+            utils.get_stock(),
+            utils.get_sold_clients(),
+            utils.get_debt(),
+        ]
+
+    def test_balances_start_from_the_close(self):
+        before = self.figures()
+        self.app.config["LEDGER_BALANCES"] = False
+        self.assertEqual(self.figures(), before)
+
+        close_period(1, datetime.date(2022, 4, 1))
+        close_period(1, MAY)
+        self.assertEqual(self.figures(), before)
+        self.app.config["LEDGER_BALANCES"] = True
+        self.assertEqual(self.figures(), before)
+
+        stock = db.session.query(ClosingBalances).filter_by(kind="stocks").all()
+        self.assertEqual(sorted(row.amount for row in stock), [400.0, 500.0])
+
+        # rows of the closed months are read from the snapshot only
+        db.session.execute(
+            Reconciliations.__table__.delete().where(Reconciliations.amount == 100.0)
+        )
+        self.assertEqual(utils.get_banque_on_date(end=datetime.date(2022, 6, 15)), 70.0)
+
+    def test_close_keeps_reconciliations_without_a_party(self):
+        add_unchecked(Reconciliations(None, True, None, 1, datetime.date(2022, 4, 5), 25.0, "v"))
+        before = self.figures()
+
+        close_period(1, MAY)
+        self.assertEqual(self.figures(), before)
+
+    def test_closed_rows_are_frozen(self):
+        close_period(1, MAY)
+
+        sale = db.session.query(Sales).filter_by(amount=300.0).one()
+        sale.amount = 1.0
+        self.assertRaises(ClosedPeriodError, db.session.commit)
+        db.session.rollback()
+
+        sale = db.session.query(Sales).filter_by(amount=100.0).one()
+        sale.date = datetime.date(2022, 5, 31)
+        self.assertRaises(ClosedPeriodError, db.session.commit)
+        db.session.rollback()
+
+        db.session.delete(db.session.query(Stocks).filter_by(amount=500.0).one())
+        self.assertRaises(ClosedPeriodError, db.session.commit)
+        db.session.rollback()
+
+        db.session.add(Sales(self.client.id, 1, datetime.date(2022, 6, 1), 5.0, "open"))
+        db.session.commit()
+
+        reopen_period(1, MAY)
+        db.session.query(Sales).filter_by(amount=300.0).one().amount = 1.0
+        db.session.commit()
+
+    def test_import_rejects_closed_rows(self):
+        close_period(1, MAY)
+        response = self.http.post(
+            "/sales/import",
+            data={
+                "file": (
+                    io.BytesIO(b"Date,Client,Mode de paiement,Montant\n2022-05-31,client,1,10\n"),
+                    "sales.csv",
+                )
+            },
+            content_type="multipart/form-data",
+        )
+        self.assertIn("période clôturée au 31/05/2022", response.get_data(as_text=True))
+
+    def test_rejected_edit_is_flashed(self):
+        close_period(1, MAY)
+        sale = db.session.query(Sales).filter_by(amount=300.0).one()
+        response = self.http.post(f"/sales/remove/{sale.id}", follow_redirects=True)
+        html = response.get_data(as_text=True)
+        self.assertIn("période clôturée au 31/05/2022, écriture du 10/05/2022", html)
+        self.assertNotIn("db error", html)
+        self.assertEqual(db.session.query(Sales).filter_by(amount=300.0).count(), 1)
+
+    def test_cli(self):
+        runner = self.app.test_cli_runner()
+        result = runner.invoke(periods_cli, ["close", "--tenant", "1", "--month", "2022-05"])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("2022-05 closed", result.output)
+
+        result = runner.invoke(periods_cli, ["close", "--tenant", "1", "--month", "2022-04"])
+        self.assertIn("période déjà clôturée au 31/05/2022", result.output)
+        this_month = f"{datetime.date.today():%Y-%m}"
+        result = runner.invoke(periods_cli, ["close", "--tenant", "1", "--month", this_month])
+        self.assertIn("n'est pas terminé", result.output)
+
+        result = runner.invoke(periods_cli, ["reopen", "--tenant", "1", "--month", "2022-01"])
+        self.assertIn("1 periods reopened", result.output)
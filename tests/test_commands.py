@@ -0,0 +1,51 @@
+import os
+import shutil
+import tempfile
+
+from jinja2 import FileSystemBytecodeCache
+from sqlalchemy import event, inspect
+
+from tests.basic import BasicsTestCase
+from app import db
+from app.commands import db_cli, templates_cli
+from app.models import PaymentMethod, User
+
+
+class DatabaseCommandsTestCase(BasicsTestCase):
+    def setUp(self):
+        super().setUp()
+        db.drop_all()
+        self.runner = self.app.test_cli_runner()
+
+    def test_init_then_seed(self):
+        result = self.runner.invoke(db_cli, ["init"])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("sales", inspect(db.engine).get_table_names())
+
+        for _ in range(2):
+            result = self.runner.invoke(db_cli, ["seed"])
+            self.assertEqual(result.exit_code, 0, result.output)
+        self.assertEqual(db.session.query(User).count(), 1)
+        self.assertEqual(db.session.query(PaymentMethod).filter_by(name="Espèce").count(), 1)
+
+    def test_first_request_touches_no_database(self):
+        statements = []
+        event.listen(db.engine, "before_cursor_execute", lambda *args: statements.append(args))
+
+        response = self.app.test_client().get("/login")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(statements, [])
+        self.assertEqual(inspect(db.engine).get_table_names(), [])
+
+
+class TemplatesCommandsTestCase(BasicsTestCase):
+    def test_compile_fills_the_bytecode_cache(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.app.jinja_env.bytecode_cache = FileSystemBytecodeCache(directory)
+
+        result = self.app.test_cli_runner().invoke(templates_cli, ["compile"])
+        self.assertEqual(result.exit_code, 0, result.output)
+        compiled = int(result.output.split()[0])
+        self.assertGreater(compiled, 30)
+        self.assertEqual(len(os.listdir(directory)), compiled)
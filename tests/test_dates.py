@@ -0,0 +1,56 @@
+import datetime
+import unittest
+from unittest import mock
+
+from flask import render_template_string
+
+from tests.basic import BasicsTestCase
+from app.utilities import dates
+
+
+class DatesTestCase(unittest.TestCase):
+    def test_working_days_count_a_month_long_window_from_the_day(self):
+        # 2022-06-15 is a Wednesday, the 30 days up to 2022-07-14 hold 22 weekdays
+        self.assertEqual(dates.working_days_from(datetime.date(2022, 6, 15)), 22)
+        self.assertEqual(dates.working_days_from(datetime.date(2022, 2, 1)), 20)
+
+    def test_today_rolls_over(self):
+        with mock.patch.object(dates, "today", return_value=datetime.date(2022, 6, 15)):
+            self.assertEqual(dates.get_workings_days(), 22)
+        with mock.patch.object(dates, "today", return_value=datetime.date(2022, 2, 1)):
+            self.assertEqual(dates.get_workings_days(), 20)
+
+    def test_month_tables(self):
+        days = dates.get_monthdays_with_name(2022, 2)
+        self.assertEqual(len(days), 28)
+        self.assertEqual(days[0], {"number": 1, "name": "Tuesday"})
+
+        monthdates = dates.get_monthdates(2022, 2)
+        self.assertEqual(
+            (monthdates[0], monthdates[-1]), (datetime.date(2022, 1, 31), datetime.date(2022, 3, 6))
+        )
+        self.assertIsNot(monthdates, dates.get_monthdates(2022, 2))
+
+    def test_periods(self):
+        day = datetime.date(2022, 2, 15)
+        self.assertEqual(
+            dates.month_periods(3, day),
+            [
+                (datetime.date(2021, 12, 1), datetime.date(2021, 12, 31)),
+                (datetime.date(2022, 1, 1), datetime.date(2022, 1, 31)),
+                (datetime.date(2022, 2, 1), datetime.date(2022, 2, 28)),
+            ],
+        )
+        quarters = dates.quarter_periods(8, day)
+        self.assertEqual(len(quarters), 8)
+        self.assertEqual(quarters[0], (datetime.date(2020, 4, 1), datetime.date(2020, 6, 30)))
+        self.assertEqual(quarters[-1], (datetime.date(2022, 1, 1), datetime.date(2022, 3, 31)))
+
+
+class TemplateGlobalsTestCase(BasicsTestCase):
+    def test_registered_once_on_the_environment(self):
+        self.assertIs(self.app.jinja_env.globals["get_workings_days"], dates.get_workings_days)
+        self.assertEqual(
+            render_template_string('{{ strftime(dayDelta(toDate(2022, 6, 30), 1), "%d-%m-%Y") }}'),
+            "01-07-2022",
+        )
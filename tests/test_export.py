@@ -0,0 +1,51 @@
+import csv
+import io
+
+import openpyxl
+
+from tests.basic import ClientTestCase
+from tests.test_utils import LedgerTestCase
+
+
+class ExportTestCase(ClientTestCase, LedgerTestCase):
+    def rows(self, response):
+        return list(csv.reader(io.StringIO(response.get_data(as_text=True).lstrip("\ufeff"))))
+
+    def test_csv_honours_the_filters(self):
+        response = self.http.get("/sales/export.csv?s_paymentmethod=4")
+        self.assertEqual(response.mimetype, "text/csv")
+        self.assertIn('filename="ventes.csv"', response.headers["Content-Disposition"])
+
+        header, *rows = self.rows(response)
+        self.assertEqual(header[:4], ["Date", "Client", "Mode de paiement", "Montant"])
+        self.assertEqual([(row[1], row[3]) for row in rows], [("client", "100.0")])
+
+    def test_rows_are_streamed_in_chunks(self):
+        self.app.config["EXPORT_CHUNK_SIZE"] = 2
+        response = self.http.get("/reconciliations/export.csv")
+        self.assertTrue(response.is_streamed)
+
+        chunks = [chunk for chunk in response.response if chunk]
+        self.assertEqual(len(chunks), 2)
+        response.close()
+
+    def test_payments_of_costs(self):
+        header, *rows = self.rows(self.http.get("/payments/costs/export.csv"))
+        self.assertEqual(header[1], "Charge")
+        self.assertEqual([row[1] for row in rows], ["loyer"])
+
+    def test_unknown_format(self):
+        response = self.http.get("/stocks/export.pdf")
+        self.assertNotIn("Content-Disposition", response.headers)
+
+    def test_xlsx(self):
+        response = self.http.get("/sales/export.xlsx")
+        self.assertIn('filename="ventes.xlsx"', response.headers["Content-Disposition"])
+        sheet = openpyxl.load_workbook(io.BytesIO(response.get_data())).active
+        self.assertEqual(
+            [row[3] for row in sheet.iter_rows(min_row=2, values_only=True)], [100.0, 50.0, 30.0]
+        )
+
+    def test_xlsx_button_points_large_exports_to_csv(self):
+        page = self.http.get("/sales/").get_data(as_text=True)
+        self.assertIn("préférez le CSV pour les gros exports", page)
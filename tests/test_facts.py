@@ -0,0 +1,96 @@
+import datetime
+import io
+
+from flask import g
+
+from tests.basic import ClientTestCase
+from tests.test_utils import LedgerTestCase
+from app import db, facts
+from app.commands import db_cli, facts_cli
+from app.models import CostsDef, CostsMapping, DailyFacts, Sales
+from app.utilities import utils
+
+
+class DailyFactsTestCase(ClientTestCase, LedgerTestCase):
+    def figures(self):
+        g.pop("memo", None)
+        week = utils.get_treasury_week(datetime.date.today() - datetime.timedelta(days=3))
+        return [
+            utils.get_exploit_figures(),
+            utils.get_banque_on_date(),
+            utils.get_banque_on_date(today=True),
+            utils.get_chiffre_affaire(cum=True, pay_methode=4),
+            week,
+        ]
+
+    def test_inserts_are_applied(self):
+        self.assertEqual(facts.check(), [])
+        fact = db.session.query(DailyFacts).filter_by(ledger="costs", paymentmethod_id=3).one()
+        self.assertEqual((fact.amount, fact.count, fact.fixed), (15.0, 1, True))
+
+    def test_updates_and_deletes_are_applied(self):
+        sale = db.session.query(Sales).filter_by(paymentmethod_id=4).one()
+        sale.amount = 70.5
+        sale.date = datetime.datetime.now() - datetime.timedelta(days=40)
+        db.session.delete(db.session.query(Sales).filter_by(paymentmethod_id=1).one())
+        db.session.commit()
+        self.assertEqual(facts.check(), [])
+
+        cost = db.session.query(CostsDef).get(self.cost.id)
+        cost.fixed = False
+        db.session.commit()
+        self.assertEqual(facts.check(), [])
+        self.assertFalse(db.session.query(DailyFacts).filter_by(cost_id=cost.id).first().fixed)
+
+    def test_facts_answer_like_ledgers(self):
+        db.session.add(
+            CostsMapping(
+                self.cost.id, 1, 12.0, datetime.date.today() - datetime.timedelta(days=2), "cash"
+            )
+        )
+        db.session.commit()
+
+        from_facts = self.figures()
+        self.app.config["LEDGER_DAILY_FACTS"] = False
+        self.assertEqual(self.figures(), from_facts)
+        self.assertEqual(from_facts[0]["fixed_costs"]["today"], 20.0)
+
+    def test_import_keeps_the_facts(self):
+        self.http.post(
+            "/sales/import",
+            data={
+                "file": (
+                    io.BytesIO(b"Date,Client,Mode de paiement,Montant\n2022-06-01,client,1,10\n"),
+                    "sales.csv",
+                )
+            },
+            content_type="multipart/form-data",
+        )
+        self.assertEqual(
+            db.session.query(DailyFacts).filter_by(date=datetime.date(2022, 6, 1)).count(), 1
+        )
+        self.assertEqual(facts.check(), [])
+
+    def test_rebuild_a_period(self):
+        today = datetime.date.today()
+        db.session.query(DailyFacts).delete()
+        db.session.commit()
+        self.assertNotEqual(facts.check(), [])
+
+        result = self.app.test_cli_runner().invoke(
+            facts_cli, ["rebuild", "--tenant", "1", "--start", str(today), "--end", str(today)]
+        )
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("daily facts match the ledgers", result.output)
+        self.assertEqual(facts.check(), [])
+
+    def test_init_fills_a_new_table(self):
+        expected = self.figures()
+        db.session.close()
+        DailyFacts.__table__.drop(db.engine)
+
+        result = self.app.test_cli_runner().invoke(db_cli, ["init"])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("daily facts match the ledgers", result.output)
+        self.assertEqual(facts.check(), [])
+        self.assertEqual(self.figures(), expected)
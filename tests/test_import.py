@@ -0,0 +1,57 @@
+import io
+
+from tests.basic import ClientTestCase
+from tests.test_utils import LedgerTestCase
+from app import balances, db
+from app.models import CostsMapping, Sales
+
+
+class ImportTestCase(ClientTestCase, LedgerTestCase):
+    def upload(self, path, text):
+        return self.http.post(
+            path,
+            data={"file": (io.BytesIO(text.encode("utf-8")), "ledger.csv")},
+            content_type="multipart/form-data",
+        )
+
+    def count(self, model):
+        return db.session.query(model).count()
+
+    def test_rows_are_inserted_with_their_balances(self):
+        response = self.upload(
+            "/sales/import",
+            "Date,Client,Mode de paiement,Montant,Commentaire\n"
+            "2022-06-01,client,Espèce,10.5,caisse\n"
+            f'01/06/2022,{self.client.id},4,"1,5",\n',
+        )
+        self.assertIn("2 lignes importées", response.get_data(as_text=True))
+        self.assertEqual(self.count(Sales), 5)
+        self.assertEqual(balances.check(), [])
+
+    def test_one_bad_row_rejects_the_file(self):
+        response = self.upload(
+            "/sales/import",
+            "Date;Client;Mode de paiement;Montant\n"
+            "2022-06-01;client;Espèce;10\n"
+            "2022-06-31;client;Espèce;10\n"
+            "2022-06-01;supplier;Espèce;10\n"
+            "2022-06-01;client;Reconciliation;x\n",
+        )
+        html = response.get_data(as_text=True)
+        self.assertIn("3 lignes refusées", html)
+        for message in ["date invalide", "client inconnu", "montant invalide"]:
+            self.assertIn(message, html)
+        self.assertEqual(self.count(Sales), 3)
+
+    def test_missing_columns(self):
+        response = self.upload("/costs/import", "Date,Montant\n2022-06-01,10\n")
+        self.assertIn(
+            "colonnes manquantes: Charge, Mode de paiement", response.get_data(as_text=True)
+        )
+
+    def test_export_imports_back(self):
+        self.app.config["IMPORT_BATCH_SIZE"] = 1
+        exported = self.http.get("/costs/export.csv").get_data(as_text=True)
+        self.upload("/costs/import", exported)
+        self.assertEqual(self.count(CostsMapping), 4)
+        self.assertEqual(balances.check(), [])
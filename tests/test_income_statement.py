@@ -0,0 +1,105 @@
+import datetime
+
+from flask import g
+from sqlalchemy import event
+
+from tests.basic import ClientTestCase
+from tests.test_utils import LedgerTestCase
+from app import db
+from app.closing import close_period
+from app.models import CostsDef, CostsMapping, Purchasing, Sales, Stocks
+from app.utilities import utils
+from app.utilities.dates import month_periods, quarter_periods
+
+MAY = datetime.date(2022, 5, 1)
+
+
+class IncomeStatementTestCase(ClientTestCase, LedgerTestCase):
+    def setUp(self):
+        super().setUp()
+        transport = CostsDef(name="transport", fixed=False)
+        db.session.add(transport)
+        db.session.commit()
+
+        client, supplier = self.client.id, self.supplier.id
+        db.session.add_all(
+            [
+                Sales(client, 1, datetime.date(2022, 4, 10), 200.0, "cash"),
+                Sales(client, 4, datetime.date(2022, 5, 10), 300.0, "credit"),
+                Purchasing(4, supplier, 100.0, datetime.date(2022, 5, 5), "credit"),
+                CostsMapping(self.cost.id, 1, 40.0, datetime.date(2022, 5, 15), "loyer"),
+                CostsMapping(transport.id, 1, 10.0, datetime.date(2022, 4, 20), "transport"),
+                Stocks(50.0, datetime.date(2022, 3, 31), "inventaire"),
+                Stocks(80.0, datetime.date(2022, 4, 30), "inventaire"),
+                Stocks(60.0, datetime.date(2022, 5, 31), "inventaire"),
+            ]
+        )
+        db.session.commit()
+
+    def statement(self, periods):
+        g.pop("memo", None)
+        return utils.get_income_statement(periods)
+
+    def test_monthly_statement(self):
+        march, april, may = self.statement(month_periods(3, MAY))
+
+        self.assertEqual((march["stock_final"], march["costo_goods_sold"]), (50.0, -50.0))
+        self.assertEqual(april["variable_costs"], 10.0)
+        self.assertEqual(april["net_operating_income"], 165.0)
+        self.assertEqual(
+            may,
+            dict(
+                start=MAY,
+                end=datetime.date(2022, 5, 31),
+                sales=300.0,
+                stock_initial=80.0,
+                stock_final=60.0,
+                purchasing=100.0,
+                costo_goods_sold=120.0,
+                gross_margin=180.0,
+                fixed_costs=40.0,
+                variable_costs=0.0,
+                gross_operating_income=140.0,
+                tax_gross_operating_income=35.0,
+                net_operating_income=105.0,
+            ),
+        )
+
+        (quarter,) = self.statement(quarter_periods(1, MAY))
+        self.assertEqual((quarter["sales"], quarter["stock_initial"]), (500.0, 50.0))
+
+    def test_same_from_ledgers_and_closes(self):
+        periods = month_periods(3, MAY)
+        from_facts = self.statement(periods)
+        self.app.config["LEDGER_DAILY_FACTS"] = False
+        self.assertEqual(self.statement(periods), from_facts)
+
+        # the stock before May is read from the April close
+        close_period(1, datetime.date(2022, 4, 1))
+        db.session.execute(Stocks.__table__.delete().where(Stocks.amount == 80.0))
+        self.assertEqual(self.statement([periods[-1]]), from_facts[-1:])
+
+    def test_query_count_is_constant(self):
+        statements = []
+
+        def count(*args):
+            statements.append(args)
+
+        event.listen(db.engine, "before_cursor_execute", count)
+        try:
+            self.statement(month_periods(3, MAY))
+            three = len(statements)
+            self.statement(month_periods(12, MAY) + quarter_periods(8, MAY))
+        finally:
+            event.remove(db.engine, "before_cursor_execute", count)
+
+        self.assertEqual(len(statements), 2 * three)
+
+    def test_exploit_page(self):
+        html = self.http.get("/dashboards/exploit").get_data(as_text=True)
+        self.assertIn("Compte de résultat", html)
+        self.assertIn(f"{datetime.date.today():%m/%Y}", html)
+
+        html = self.http.get("/dashboards/exploit?periodes=trimestres").get_data(as_text=True)
+        start, _ = quarter_periods(8)[0]
+        self.assertIn(f"T{(start.month - 1) // 3 + 1} {start.year}", html)
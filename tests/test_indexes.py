@@ -0,0 +1,30 @@
+from sqlalchemy import inspect
+
+from tests.basic import BasicsTestCase
+from app import db, init_data
+from app.commands import db_cli
+from app.models import Sales
+
+
+class IndexesTestCase(BasicsTestCase):
+    def test_missing_indexes_are_created(self):
+        index = next(i for i in Sales.__table__.indexes if i.name == "ix_sales_tenant_date")
+        index.drop(bind=db.engine)
+        self.assertNotIn(
+            "ix_sales_tenant_date", [i["name"] for i in inspect(db.engine).get_indexes("sales")]
+        )
+
+        result = self.app.test_cli_runner().invoke(db_cli, ["indexes"])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn(
+            "ix_sales_tenant_date", [i["name"] for i in inspect(db.engine).get_indexes("sales")]
+        )
+
+    def test_hot_queries_use_indexes(self):
+        self.app.config["SECRET_KEY"] = "testing"
+        init_data()
+        db.session.commit()
+        result = self.app.test_cli_runner().invoke(db_cli, ["explain"])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("OK   sales list", result.output)
+        self.assertIn("OK   tresor week", result.output)
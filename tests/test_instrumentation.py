@@ -0,0 +1,83 @@
+import datetime
+import os
+import unittest
+
+from flask_login import login_user
+
+from tests.basic import ClientTestCase
+from app import db
+from app.database import RouteStats, normalize_sql
+from app.models import Companies, Role, Sales, User, load_user
+
+
+class NormalizeSqlTestCase(unittest.TestCase):
+    def test_statements_with_different_values_share_a_shape(self):
+        self.assertEqual(
+            normalize_sql("SELECT *\n  FROM sales WHERE id IN (?, ?, ?) LIMIT 10"),
+            normalize_sql("SELECT * FROM sales WHERE id IN (?) LIMIT 20"),
+        )
+
+    def test_route_stats_order(self):
+        stats = RouteStats()
+        stats.add("GET /fast", 0.01, 2, 0.001, [])
+        stats.add("GET /slow", 0.5, 40, 0.2, ["SELECT ?"])
+        stats.add("GET /slow", 0.3, 20, 0.1, [])
+
+        slow, fast = stats.slowest()
+        self.assertEqual((slow["route"], slow["requests"], slow["n_plus_one"]), ("GET /slow", 2, 1))
+        self.assertAlmostEqual(slow["mean_time"], 400.0)
+        self.assertEqual(slow["mean_queries"], 30)
+        self.assertEqual(fast["route"], "GET /fast")
+
+
+class InstrumentationTestCase(ClientTestCase):
+    def add_views(self):
+        self.app.config["SQL_INSTRUMENTATION"] = True
+        db.init_instrumentation(self.app)
+
+        @self.app.route("/n-plus-one")
+        def n_plus_one():
+            for id in range(6):
+                db.session.query(Sales).filter(Sales.id == id).all()
+            return "ok"
+
+        @self.app.route("/ledger-write", methods=["POST"])
+        def ledger_write():
+            company = Companies(name="client", customer=True)
+            db.session.add(company)
+            db.session.flush()
+            for day in range(1, 7):
+                db.session.add(Sales(company.id, 1, datetime.date(2022, 6, day), 5.0, "open"))
+            db.session.flush()
+            return "ok"
+
+    def test_headers(self):
+        response = self.http.get("/sales/")
+        self.assertGreater(int(response.headers["X-DB-Queries"]), 0)
+        self.assertTrue(response.headers["Server-Timing"].startswith("db;dur="))
+        self.assertNotIn("X-DB-N-Plus-One", response.headers)
+
+    def test_repeated_statements_are_flagged(self):
+        response = self.http.get("/n-plus-one")
+        self.assertEqual(response.headers["X-DB-N-Plus-One"], "1")
+
+    def test_ledger_listeners_are_not_flagged(self):
+        with self.assertLogs(self.app.logger, "WARNING") as logs:
+            response = self.http.post("/ledger-write")
+        # the sales inserts of the route, not the daily facts of the flush listeners
+        self.assertEqual(response.headers["X-DB-N-Plus-One"], "1")
+        self.assertNotIn("daily_facts", "".join(logs.output))
+
+    def test_admin_panel(self):
+        self.http.get("/n-plus-one")
+        response = self.http.get("/dashboards/queries")
+        self.assertIn(b"GET /n-plus-one", response.data)
+        self.assertIn(f"processus {os.getpid()}".encode(), response.data)
+
+        user = db.session.query(User).get(self.user.id)
+        user.role = db.session.query(Role).filter_by(name="User").first()
+        db.session.commit()
+        # the test client shares the test's flask.g, where the principal is kept
+        login_user(load_user(self.user.id))
+        response = self.http.get("/dashboards/queries")
+        self.assertNotIn(b"GET /n-plus-one", response.data)
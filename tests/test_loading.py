@@ -0,0 +1,78 @@
+from flask import render_template_string
+from sqlalchemy import event
+
+from tests.basic import ClientTestCase
+from tests.test_utils import LedgerTestCase
+from app import db
+from app.database import LazyLoadError
+from app.models import (
+    Companies,
+    CostsMapping,
+    Payments,
+    Purchasing,
+    Reconciliations,
+    Recovers,
+    Sales,
+)
+
+LIST_VIEWS = [
+    "/sales/",
+    "/purchasings/",
+    "/recovers/",
+    "/costs/",
+    "/payments/",
+    "/payments/costs",
+    "/reconciliations/",
+    "/stocks/",
+    "/companies/",
+]
+
+
+class LazyLoadGuardTestCase(ClientTestCase, LedgerTestCase):
+    def test_guard_raises_in_templates(self):
+        company = Companies.query().first()
+        with self.assertRaises(LazyLoadError):
+            render_template_string("{{ company.sales | length }}", company=company)
+
+    def test_list_views_render_without_lazy_loads(self):
+        for path in LIST_VIEWS:
+            response = self.http.get(path)
+            self.assertEqual(response.status_code, 200, path)
+
+    def test_detail_views_render_without_lazy_loads(self):
+        for prefix, model in [
+            ("/sales", Sales),
+            ("/purchasings", Purchasing),
+            ("/recovers", Recovers),
+            ("/costs", CostsMapping),
+            ("/reconciliations", Reconciliations),
+        ]:
+            row = model.query().first()
+            response = self.http.get(f"{prefix}/{row.id}")
+            self.assertEqual(response.status_code, 200, prefix)
+
+        for prefix, column in [("purchasings", Payments.company_id), ("costs", Payments.cost_id)]:
+            payment = Payments.query().filter(column.isnot(None)).first()
+            response = self.http.get(f"/payments/{prefix}/{payment.id}")
+            self.assertEqual(response.status_code, 200, prefix)
+
+    def test_query_count_does_not_grow_with_rows(self):
+        statements = []
+
+        def count(*args):
+            statements.append(args)
+
+        def queries(path):
+            statements.clear()
+            event.listen(db.engine, "before_cursor_execute", count)
+            try:
+                self.http.get(path)
+            finally:
+                event.remove(db.engine, "before_cursor_execute", count)
+            return len(statements)
+
+        before = queries("/sales/")
+        client = self.client.id
+        db.session.add_all([Sales(client, 1, sale.date, 1.0, "more") for sale in Sales.query()])
+        db.session.commit()
+        self.assertEqual(queries("/sales/"), before)
@@ -0,0 +1,75 @@
+import datetime
+
+from tests.basic import ClientTestCase
+from app import db
+from app.models import Companies, Sales
+from app.utilities.pagination import paginate
+
+
+class PaginationTestCase(ClientTestCase):
+    def setUp(self):
+        super().setUp()
+        client = Companies(name="client", customer=True)
+        db.session.add(client)
+        db.session.commit()
+
+        day = datetime.date(2022, 3, 1)
+        # three rows share a date so the id breaks the tie
+        dates = [day, day, day, day - datetime.timedelta(days=1), day + datetime.timedelta(days=1)]
+        db.session.add_all(
+            [Sales(client.id, 1, date, float(n + 1), "") for n, date in enumerate(dates)]
+        )
+        db.session.commit()
+
+    def walk(self, query, per_page):
+        pages, cursor = [], None
+        while True:
+            path = f"/?cursor={cursor}" if cursor else "/"
+            with self.app.test_request_context(path):
+                page = paginate(query, Sales, per_page=per_page)
+            pages.append(page)
+            cursor = page.next_cursor
+            if not cursor:
+                return pages
+
+    def test_pages_cover_every_row_once(self):
+        expected = [
+            sale.id for sale in Sales.query().order_by(Sales.date.desc(), Sales.id.desc()).all()
+        ]
+
+        pages = self.walk(Sales.query(), per_page=2)
+
+        self.assertEqual([len(page.items) for page in pages], [2, 2, 1])
+        self.assertEqual([sale.id for page in pages for sale in page.items], expected)
+        self.assertTrue(pages[0].is_first)
+        self.assertFalse(pages[1].is_first)
+
+    def test_rows_without_a_date_come_last(self):
+        client_id = db.session.query(Sales.company_id).first()[0]
+        undated = [Sales(client_id, 1, None, 1.0, "") for _ in range(3)]
+        db.session.add_all(undated)
+        db.session.flush()
+        for sale in undated:
+            sale.date = None
+        db.session.commit()
+
+        for per_page in (2, 3, 5):
+            pages = self.walk(Sales.query(), per_page=per_page)
+            ids = [sale.id for page in pages for sale in page.items]
+            self.assertEqual(len(ids), 8)
+            self.assertEqual(ids[5:], sorted((sale.id for sale in undated), reverse=True))
+            self.assertEqual(pages[-1].count, 8)
+
+    def test_totals_cover_the_whole_filter(self):
+        pages = self.walk(Sales.query().filter(Sales.amount > 1), per_page=2)
+
+        for page in pages:
+            self.assertEqual((page.count, page.total), (4, 14.0))
+
+    def test_list_view(self):
+        self.app.config["LIST_PER_PAGE"] = 2
+        response = self.http.get("/sales/?s_paymentmethod=1")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b"2 / 5", response.data)
+        self.assertIn(b"15.0", response.data)
+        self.assertIn(b"cursor=", response.data)
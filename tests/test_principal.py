@@ -0,0 +1,74 @@
+import pickle
+
+from sqlalchemy import event
+
+from tests.basic import TenantTestCase
+from app import cache, db
+from app.models import Permission, Role, TenantUsers, Tenants, User, load_user
+
+
+class PrincipalTestCase(TenantTestCase):
+    def setUp(self):
+        super().setUp()
+        self.app.config["CACHE_TYPE"] = "lru"
+        cache.init_app(self.app)
+        self.statements = []
+
+    def count(self, *args):
+        self.statements.append(args)
+
+    def load(self):
+        self.statements.clear()
+        event.listen(db.engine, "before_cursor_execute", self.count)
+        try:
+            return load_user(self.user.id)
+        finally:
+            event.remove(db.engine, "before_cursor_execute", self.count)
+
+    def test_cached_principal_needs_no_query(self):
+        principal = self.load()
+        self.assertTrue(self.statements)
+
+        self.assertIs(self.load(), principal)
+        self.assertEqual(self.statements, [])
+        self.assertTrue(principal.is_administrator())
+        self.assertEqual(principal.tenants[0].tenant.name, "Hodling")
+
+    def test_role_change_invalidates(self):
+        self.load()
+        role = db.session.query(Role).filter_by(name="Administrator").one()
+        role.remove_permission(Permission.ADMIN)
+        db.session.commit()
+
+        principal = self.load()
+        self.assertTrue(self.statements)
+        self.assertFalse(principal.is_administrator())
+
+    def test_membership_change_invalidates(self):
+        self.load()
+        tenant = Tenants(name="second", email="second@test.com")
+        user = db.session.query(User).get(self.user.id)
+        db.session.add(TenantUsers(user=user, tenant=tenant))
+        db.session.commit()
+
+        self.assertEqual(len(self.load().tenants), 2)
+
+    def test_tenant_change_invalidates(self):
+        self.load()
+        db.session.query(Tenants).get(1).name = "renamed"
+        db.session.commit()
+
+        self.assertEqual(self.load().tenants[0].tenant.name, "renamed")
+
+    def test_rollback_keeps_the_cache(self):
+        self.load()
+        version = cache.version("principals")
+        db.session.query(User).get(self.user.id).name = "renamed"
+        db.session.flush()
+        db.session.rollback()
+        self.assertEqual(cache.version("principals"), version)
+
+    def test_pickle(self):
+        principal = pickle.loads(pickle.dumps(self.load()))
+        self.assertEqual(principal.get_id(), self.user.id)
+        self.assertTrue(principal.can(Permission.WRITE))
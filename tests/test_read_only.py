@@ -0,0 +1,50 @@
+from sqlalchemy.exc import OperationalError
+
+from tests.basic import ClientTestCase
+from app import db
+from app.models import Tenants
+
+
+class ReadOnlyTestCase(ClientTestCase):
+    def add_views(self):
+        @self.app.route("/rename", methods=["GET", "POST"])
+        def rename():
+            tenant = db.session.query(Tenants).get(1)
+            tenant.name = "renamed"
+            try:
+                db.session.flush()
+            except OperationalError:
+                return "refused"
+            return "ok"
+
+        @self.app.route("/preview", methods=["POST"])
+        @db.read_only
+        def preview():
+            return rename()
+
+    def name(self):
+        return db.session.query(Tenants.name).filter(Tenants.id == 1).scalar()
+
+    def test_get_cannot_write(self):
+        self.assertEqual(self.http.get("/rename").data, b"refused")
+        self.assertEqual(self.name(), "Hodling")
+
+    def test_read_only_post_cannot_write(self):
+        self.assertEqual(self.http.post("/preview").data, b"refused")
+        self.assertEqual(self.name(), "Hodling")
+        self.assertTrue(self.app.view_functions["reconciliations.import_statement"].read_only)
+
+    def test_post_commits(self):
+        self.assertEqual(self.http.post("/rename").data, b"ok")
+        db.session.remove()
+        self.assertEqual(self.name(), "renamed")
+
+    def test_connection_is_writable_after_a_read(self):
+        self.http.get("/sales/")
+        db.session.add(Tenants(name="second", email="second@test.com"))
+        db.session.commit()
+
+    def test_app_context_does_not_commit(self):
+        with self.app.app_context():
+            db.session.add(Tenants(name="second", email="second@test.com"))
+        self.assertIsNone(db.session.query(Tenants).filter_by(name="second").first())
@@ -0,0 +1,84 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from tests.test_utils import LedgerTestCase
+from app import cache, db
+from app.database import engine_options
+from app.models import Sales
+from app.utilities import columnar, utils
+from app.utilities.utils import LedgerAggregates
+
+
+class EngineOptionsTestCase(unittest.TestCase):
+    config = dict(
+        DATABASE_POOL_SIZE=5,
+        DATABASE_MAX_OVERFLOW=10,
+        DATABASE_POOL_TIMEOUT=30,
+        DATABASE_POOL_RECYCLE=1800,
+        DATABASE_POOL_PRE_PING=True,
+    )
+
+    def test_postgresql_pool(self):
+        options = engine_options("postgresql://dashboard@db/dashboard", self.config)
+        self.assertEqual(options["pool_size"], 5)
+        self.assertEqual(options["pool_recycle"], 1800)
+        self.assertTrue(options["pool_pre_ping"])
+        self.assertNotIn("connect_args", options)
+
+    def test_sqlite_memory_is_not_pooled(self):
+        self.assertEqual(
+            engine_options("sqlite://", self.config), {"connect_args": {"check_same_thread": False}}
+        )
+
+
+class ReplicaTestCase(LedgerTestCase):
+    """An empty SQLite file stands in for a replica, whatever reads it sees no sales."""
+
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+
+        uri = f"sqlite:///{os.path.join(directory, 'replica.db')}"
+        db.replica_engine = db.make_engine(self.app, uri)
+        db.metadata.create_all(bind=db.replica_engine)
+        db.session.remove()
+        db.session.configure(replica_bind=db.replica_engine)
+        self.addCleanup(db.replica_engine.dispose)
+        self.addCleanup(db.session.configure, replica_bind=None)
+        self.addCleanup(db.session.remove)
+
+    def sales(self):
+        return LedgerAggregates.load().sum("sales")
+
+    def test_read_only_sessions_read_the_replica(self):
+        db.session.info["read_only"] = True
+        self.assertEqual(self.sales(), 0.0)
+
+    def test_writing_sessions_stay_on_the_primary(self):
+        self.assertEqual(self.sales(), 180.0)
+
+    def test_other_reads_stay_on_the_primary(self):
+        db.session.info["read_only"] = True
+        self.assertEqual(db.session.query(Sales).count(), 3)
+        with db.replica():
+            self.assertEqual(db.session.query(Sales).count(), 0)
+
+    def test_cached_figures_are_computed_on_the_primary(self):
+        # the replica lags behind every write, a figure cached under the version the
+        # write bumped must not be the replica's
+        self.app.config["CACHE_TYPE"] = "lru"
+        cache.init_app(self.app)
+        db.session.info["read_only"] = True
+
+        self.assertEqual(utils.get_sum_sales(), 180.0)
+        self.assertEqual(cache.tenant_cached(1, "sales", self.sales), 180.0)
+        self.assertEqual(self.sales(), 0.0)
+
+    @unittest.skipIf(columnar.numpy is None, "numpy is not installed")
+    def test_columnar_snapshot_is_loaded_from_the_primary(self):
+        db.session.info["read_only"] = True
+        with db.replica():
+            self.assertEqual(columnar.snapshot(1).sum("sales"), 180.0)
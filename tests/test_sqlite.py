@@ -0,0 +1,52 @@
+import os
+import tempfile
+import threading
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.exc import OperationalError
+
+from tests.basic import BasicsTestCase
+from app.database import begin_immediate, sqlite_pragmas
+
+
+class SqliteProfileTestCase(BasicsTestCase):
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.mkdtemp()
+        self.path = os.path.join(directory, "test.db")
+        self.addCleanup(os.rmdir, directory)
+        self.addCleanup(os.remove, self.path)
+
+    def engine(self, **pragmas):
+        engine = create_engine(f"sqlite:///{self.path}", connect_args={"check_same_thread": False})
+        event.listen(engine, "connect", sqlite_pragmas(pragmas))
+        self.addCleanup(engine.dispose)
+        return engine
+
+    def test_pragmas_are_applied_on_connect(self):
+        engine = self.engine(**dict(self.app.config["SQLITE_PRAGMAS"], busy_timeout=1234))
+        with engine.connect() as connection:
+            pragma = lambda name: connection.exec_driver_sql(f"PRAGMA {name}").scalar()
+            self.assertEqual(pragma("journal_mode"), "wal")
+            self.assertEqual(pragma("busy_timeout"), 1234)
+            self.assertEqual(pragma("synchronous"), 1)
+
+    def test_busy_writer_retries(self):
+        engine = self.engine(busy_timeout=0, journal_mode="wal")
+        self.app.config.update(SQLITE_BUSY_RETRIES=8, SQLITE_BUSY_BACKOFF=0.01)
+        with engine.connect() as writer, engine.connect() as other:
+            writer.exec_driver_sql("BEGIN IMMEDIATE")
+            threading.Timer(0.05, writer.connection.commit).start()
+
+            begin_immediate(other)
+            other.exec_driver_sql("CREATE TABLE t (id INTEGER)")
+            other.connection.commit()
+
+    def test_gives_up_after_the_retries(self):
+        engine = self.engine(busy_timeout=0)
+        self.app.config.update(SQLITE_BUSY_RETRIES=2, SQLITE_BUSY_BACKOFF=0.001)
+        with engine.connect() as writer, engine.connect() as other:
+            writer.exec_driver_sql("BEGIN IMMEDIATE")
+            with self.assertRaises(OperationalError):
+                begin_immediate(other)
+            writer.connection.rollback()
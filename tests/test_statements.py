@@ -0,0 +1,193 @@
+import datetime
+import io
+import random
+import unittest
+
+from sqlalchemy import event
+
+from tests.basic import ClientTestCase
+from tests.test_utils import LedgerTestCase
+from app import balances, db
+from app.models import ReconciliationItems, Reconciliations, Sales
+from app.utilities.statements import OpenItem, StatementLine, match, reconcile
+
+DAY = datetime.date(2022, 6, 1)
+
+
+def item(kind, id, amount, days=0, cashing=True, document_number="nop"):
+    date = DAY + datetime.timedelta(days=days)
+    return OpenItem(kind, id, cashing, 1, None, 2, amount, date, date, document_number, "")
+
+
+class MatchTestCase(unittest.TestCase):
+    def test_amount_side_and_window(self):
+        items = [
+            item("sales", 1, 30.0, days=40),
+            item("purchasing", 2, 30.0, cashing=False),
+            item("sales", 3, 30.0, days=3),
+        ]
+        (proposal,) = match([StatementLine(2, DAY, 30.0, "remise", "")], items, 10)
+        self.assertEqual((proposal.item.kind, proposal.item.id), ("sales", 3))
+
+        (proposal,) = match([StatementLine(2, DAY, -30.001, "cheque", "")], items, 10)
+        self.assertEqual(proposal.item.id, 2)
+
+        (proposal,) = match([StatementLine(2, DAY, 31.0, "remise", "")], items, 10)
+        self.assertIsNone(proposal.item)
+
+    def test_quoted_document_number_wins(self):
+        items = [item("sales", 1, 30.0), item("sales", 2, 30.0, days=5, document_number="F-102")]
+        lines = [
+            StatementLine(2, DAY, 30.0, "remise", ""),
+            StatementLine(3, DAY, 30.0, "f-102", ""),
+        ]
+        first, second = match(lines, items, 10)
+        self.assertEqual((first.item.id, first.quoted), (1, False))
+        self.assertEqual((second.item.id, second.quoted), (2, True))
+
+        (proposal,) = match([StatementLine(2, DAY, 30.0, "F-1020", "")], items, 10)
+        self.assertFalse(proposal.quoted)
+
+    def test_every_item_is_proposed_once(self):
+        items = [item("sales", id, 10.0, days=id) for id in range(1, 4)]
+        lines = [StatementLine(n, DAY, 10.0, "", "") for n in range(5)]
+        proposed = [proposal.item.id for proposal in match(lines, items, 10) if proposal.item]
+        self.assertEqual(proposed, [1, 2, 3])
+
+    def test_a_year_of_items(self):
+        rng = random.Random(1)
+        items = [
+            item("sales", id, rng.randint(1, 50000) / 100, days=rng.randint(0, 365))
+            for id in range(20000)
+        ]
+        lines = [
+            StatementLine(n, item.date + datetime.timedelta(days=2), item.amount, "", "")
+            for n, item in enumerate(rng.sample(items, 3000))
+        ]
+        proposals = match(lines, items, 10)
+        self.assertTrue(all(proposal.item for proposal in proposals))
+        self.assertTrue(all(p.item.amount == p.line.amount for p in proposals))
+
+
+class StatementTestCase(ClientTestCase, LedgerTestCase):
+    def upload(self, text, name="releve.csv"):
+        return self.http.post(
+            "/reconciliations/statement",
+            data={"file": (io.BytesIO(text.encode("utf-8")), name)},
+            content_type="multipart/form-data",
+        )
+
+    def test_csv_proposals_are_confirmed(self):
+        today = datetime.date.today()
+        later = today + datetime.timedelta(days=40)
+        response = self.upload(
+            "Date;Libellé;Débit;Crédit\n"
+            f"{today:%d/%m/%Y};REMISE CHEQUE;;30,00\n"
+            f"{today:%d/%m/%Y};VIR FOURNISSEUR;25,00;\n"
+            f"{today:%d/%m/%Y};PRLV LOYER;5,00;\n"
+            f"{later:%d/%m/%Y};REMISE;;20,00\n"
+            "32/01/2022;ERREUR;;1\n"
+        )
+        html = response.get_data(as_text=True)
+        self.assertIn("4 lignes lues, 3 rapprochements proposés", html)
+        self.assertIn("date invalide", html)
+
+        data = {"line": ["2", "3", "4"]}
+        for n, kind, amount in [(2, "sales", 30.0), (3, "payments", 25.0), (4, "costs", 5.0)]:
+            self.assertIn(f'name="kind-{n}" value="{kind}"', html)
+            data.update({f"kind-{n}": kind, f"date-{n}": str(today), f"label-{n}": "releve"})
+            data[f"item-{n}"] = html.split(f'name="item-{n}" value="')[1].split('"')[0]
+
+        self.http.post("/reconciliations/statement/confirm", data=data)
+        self.assertEqual(db.session.query(Reconciliations).count(), 7)
+        self.assertEqual(db.session.query(ReconciliationItems).count(), 3)
+        self.assertEqual(balances.check(), [])
+
+        # confirming twice books nothing, the items are settled
+        self.http.post("/reconciliations/statement/confirm", data=data)
+        self.assertEqual(db.session.query(Reconciliations).count(), 7)
+        html = self.upload(f"Date,Libellé,Montant\n{today},REMISE CHEQUE,30\n").get_data(
+            as_text=True
+        )
+        self.assertIn("1 lignes lues, 0 rapprochements proposés", html)
+
+    def test_deleting_the_reconciliation_frees_the_item(self):
+        today = datetime.date.today()
+        html = self.upload(f"Date,Libellé,Montant\n{today},REMISE CHEQUE,30\n").get_data(
+            as_text=True
+        )
+        item_id = html.split('name="item-2" value="')[1].split('"')[0]
+        self.http.post(
+            "/reconciliations/statement/confirm",
+            data={"line": "2", "kind-2": "sales", "item-2": item_id, "date-2": str(today)},
+        )
+        reconciliation = db.session.query(ReconciliationItems).one().reconciliation
+        self.http.post(f"/reconciliations/remove/{reconciliation.id}")
+        self.assertEqual(db.session.query(ReconciliationItems).count(), 0)
+
+    def test_ofx(self):
+        today = datetime.date.today()
+        html = self.upload(
+            "OFXHEADER:100\nDATA:OFXSGML\n\n<OFX><BANKMSGSRSV1><STMTTRNRS><STMTRS><BANKTRANLIST>\n"
+            f"<STMTTRN>\n<TRNTYPE>CHECK\n<DTPOSTED>{today:%Y%m%d}120000\n<TRNAMT>-10.00\n"
+            "<FITID>1\n<CHECKNUM>123\n<NAME>CHEQUE\n</STMTTRN>\n"
+            f"<STMTTRN>\n<TRNTYPE>CREDIT\n<DTPOSTED>{today:%Y%m%d}\n<TRNAMT>999.00\n"
+            "<NAME>VIREMENT\n</STMTTRN>\n</BANKTRANLIST></STMTRS></STMTTRNRS></BANKMSGSRSV1></OFX>\n",
+            name="releve.ofx",
+        ).get_data(as_text=True)
+        self.assertIn("2 lignes lues, 1 rapprochements proposés", html)
+        self.assertIn('name="kind-1" value="purchasing"', html)
+
+    def test_invalid_lines_are_skipped(self):
+        today = datetime.date.today()
+        sale = db.session.query(Sales).filter_by(paymentmethod_id=2).one()
+        response = self.http.post(
+            "/reconciliations/statement/confirm",
+            data={
+                "line": ["1", "2", "3"],
+                "kind-1": "sales",
+                "item-1": str(sale.id),
+                "kind-2": "sales",
+                "item-2": str(sale.id),
+                "date-2": "32/01/2022",
+                "kind-3": "sales",
+                "item-3": "x",
+                "date-3": str(today),
+            },
+        )
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(db.session.query(ReconciliationItems).count(), 0)
+
+    def test_lines_are_loaded_in_one_query_per_kind(self):
+        today = datetime.date.today()
+        db.session.add_all([Sales(self.client.id, 2, today, 5.0, "") for _ in range(10)])
+        db.session.commit()
+        sales = db.session.query(Sales.id).filter_by(amount=5.0).all()
+        lines = [("sales", id, today, None) for id, in sales]
+        lines.append(("sales", sales[0].id, today, "twice"))
+
+        statements = []
+        listener = lambda *args: statements.append(args[2])
+        event.listen(db.engine, "before_cursor_execute", listener)
+        self.addCleanup(event.remove, db.engine, "before_cursor_execute", listener)
+        reconciliations = reconcile(lines)
+        self.assertEqual(len(statements), 2)
+
+        self.assertEqual(len(reconciliations), 10)
+        self.assertEqual(reconciliations[0].comment, "")
+        db.session.commit()
+        self.assertEqual(reconcile(lines), [])
+
+    def test_items_reconciled_by_hand_are_not_proposed(self):
+        today = datetime.date.today()
+        statement = f"Date,Libellé,Montant\n{today},PRLV LOYER,-15\n{today},CHEQUE,-40\n"
+        self.assertIn(
+            "2 lignes lues, 0 rapprochements proposés",
+            self.upload(statement).get_data(as_text=True),
+        )
+
+        manual = db.session.query(Reconciliations).filter_by(amount=15.0).one()
+        self.http.post(f"/reconciliations/remove/{manual.id}")
+        html = self.upload(statement).get_data(as_text=True)
+        self.assertIn("2 lignes lues, 1 rapprochements proposés", html)
+        self.assertIn('name="kind-2" value="costs"', html)
@@ -0,0 +1,48 @@
+from flask import session
+from sqlalchemy import event
+from sqlalchemy.sql import func
+
+from tests.test_utils import LedgerTestCase
+from app import db
+from app.models import Sales, current_tenant
+
+
+class TenantFilterTestCase(LedgerTestCase):
+    def setUp(self):
+        super().setUp()
+        db.session.execute(
+            Sales.__table__.insert(),
+            dict(
+                tenant_id=2,
+                company_id=self.client.id,
+                paymentmethod_id=1,
+                date=Sales.query().first().date,
+                amount=1000.0,
+                comment="other tenant",
+            ),
+        )
+        db.session.commit()
+
+    def test_selects_are_limited_to_the_tenant(self):
+        self.assertEqual(db.session.query(Sales).count(), 3)
+        self.assertEqual(db.session.query(func.sum(Sales.amount)).scalar(), 180.0)
+        self.assertNotIn(2, {sale.tenant_id for sale in self.client.sales})
+
+    def test_foreign_tenant_matches_nothing(self):
+        session["tenant"] = 2
+        self.assertEqual(db.session.query(Sales).count(), 0)
+
+    def test_membership_is_resolved_once(self):
+        statements = []
+
+        def count(*args):
+            statements.append(args)
+
+        current_tenant()
+        event.listen(db.engine, "before_cursor_execute", count)
+        try:
+            for _ in range(100):
+                current_tenant()
+        finally:
+            event.remove(db.engine, "before_cursor_execute", count)
+        self.assertEqual(statements, [])
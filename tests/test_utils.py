@@ -0,0 +1,140 @@
+import datetime
+
+from sqlalchemy import event
+
+from tests.basic import TenantTestCase
+from app import db
+from app.models import (
+    Companies,
+    CostsDef,
+    CostsMapping,
+    Payments,
+    Purchasing,
+    Reconciliations,
+    Recovers,
+    Sales,
+)
+from app.utilities import utils
+from app.utilities.decorators import memo_stats
+
+
+class LedgerTestCase(TenantTestCase):
+    def setUp(self):
+        super().setUp()
+        day = datetime.date.today()
+
+        self.client = Companies(name="client", customer=True)
+        self.supplier = Companies(name="supplier", customer=False, supplier=True)
+        self.cost = CostsDef(name="loyer", fixed=True)
+        db.session.add_all([self.client, self.supplier, self.cost])
+        db.session.commit()
+
+        client, supplier, cost = self.client.id, self.supplier.id, self.cost.id
+        db.session.add_all(
+            [
+                Sales(client, 4, day, 100.0, "credit"),
+                Sales(client, 1, day, 50.0, "cash"),
+                Sales(client, 2, day, 30.0, "cheque"),
+                Recovers(client, 1, day, 20.0, "recover"),
+                Purchasing(4, supplier, 80.0, day, "credit"),
+                Purchasing(1, supplier, 10.0, day, "cash"),
+                Purchasing(2, supplier, 40.0, day, "cheque"),
+                CostsMapping(cost, 1, 5.0, day, "cash"),
+                CostsMapping(cost, 3, 15.0, day, "traite"),
+                Payments(
+                    company_id=supplier, paymentmethod_id=2, date=day, amount=25.0, comment="cheque"
+                ),
+                Payments(cost_id=cost, paymentmethod_id=1, date=day, amount=7.0, comment="cash"),
+                Reconciliations(None, True, client, 7, day, 60.0, "virement"),
+                Reconciliations(None, True, client, 1, day, 10.0, "versement"),
+                Reconciliations(None, False, supplier, 2, day, 40.0, "cheque"),
+                Reconciliations(cost, False, None, 3, day, 15.0, "traite"),
+            ]
+        )
+        db.session.commit()
+
+
+class LedgerAggregatesTestCase(LedgerTestCase):
+    def test_client_balances(self):
+        self.assertEqual(utils.get_sold_clients(), 20.0)
+        self.assertEqual(utils.get_sold_clients(self.client.id), 20.0)
+        self.assertEqual(utils.get_sold_clients(self.supplier.id), 0.0)
+        self.assertEqual(utils.get_sold_portefeuille(pay_methode=2), 30.0)
+
+    def test_treasury(self):
+        self.assertEqual(utils.get_banque(), 15.0)
+        self.assertEqual(utils.get_caisse(), 45.0)
+
+    def test_liabilities(self):
+        self.assertEqual(utils.get_all_liabilities(), 95.0)
+        self.assertEqual(utils.get_liabilites_per_company(self.supplier.id, 2), 25.0)
+        self.assertEqual(utils.get_debt_per_company(), 55.0)
+        self.assertEqual(utils.get_debt_per_cost(), -7.0)
+        self.assertEqual(utils.get_debt(), 48.0)
+
+    def test_query_count_is_constant(self):
+        statements = []
+        companies = [self.client.id, self.supplier.id]
+
+        def count(*args):
+            statements.append(args)
+
+        event.listen(db.engine, "before_cursor_execute", count)
+        try:
+            utils.get_economic_situation()
+            loaded = len(statements)
+            for company in companies * 50:
+                utils.get_sold_clients(company)
+                utils.get_liabilites_per_company(company, 2)
+        finally:
+            event.remove(db.engine, "before_cursor_execute", count)
+
+        self.assertEqual(len(statements), loaded)
+
+
+class RequestMemoizedTestCase(LedgerTestCase):
+    def test_helpers_are_computed_once_per_request(self):
+        statements = []
+
+        def count(*args):
+            statements.append(args)
+
+        self.assertEqual(utils.get_economic_situation(), utils.get_economic_situation())
+        misses = memo_stats()["misses"]
+
+        event.listen(db.engine, "before_cursor_execute", count)
+        try:
+            utils.get_caisse()
+            utils.get_financial_capacity()
+            utils.get_sold_portefeuille(0, 2)
+            utils.get_sold_portefeuille(pay_methode=2)
+        finally:
+            event.remove(db.engine, "before_cursor_execute", count)
+
+        self.assertEqual(statements, [])
+        # only get_financial_capacity itself is new, everything it uses is a hit
+        self.assertEqual(memo_stats()["misses"], misses + 1)
+        self.assertGreaterEqual(memo_stats()["hits"], 5)
+
+
+class TreasuryWeekTestCase(LedgerTestCase):
+    def test_matches_daily_balances(self):
+        today = datetime.date.today()
+        first_day = today - datetime.timedelta(days=today.weekday())
+        db.session.add(
+            Reconciliations(
+                None, True, self.client.id, 2, first_day - datetime.timedelta(7), 5.0, "old"
+            )
+        )
+        db.session.commit()
+
+        treasury = utils.get_treasury_week(first_day)
+
+        for n in range(7):
+            day = first_day + datetime.timedelta(days=n)
+            before = day - datetime.timedelta(days=1)
+            self.assertEqual(treasury["init_sold"][n], utils.get_banque_on_date(end=before))
+            self.assertEqual(treasury["end_sold"][n], utils.get_banque_on_date(end=day))
+
+        self.assertEqual(treasury["caching"][today.weekday()], [10.0, 0.0, 0.0, 0.0, 0.0, 60.0])
+        self.assertEqual(treasury["debt"][today.weekday()], [0.0, 40.0, 15.0, 0.0, 0.0, 0.0])
@@ -1,8 +1,19 @@
 import os
-from app import create_app
+from app import create_app, db
+from app.commands import compile_templates
 
 
 app = create_app(os.getenv("FLASK_CONFIG") or "default")
+if app.config["TEMPLATE_PRECOMPILE"]:
+    compile_templates(app)
+
+try:
+    from uwsgidecorators import postfork
+except ImportError:
+    pass
+else:
+    # the app is loaded once in the uWSGI master, every worker opens its own connections
+    postfork(db.dispose)
 
 
 if __name__ == "__main__":